@@ -1,6 +1,6 @@
 #backend/SafeLedger/admin.py
 from django.contrib import admin
-from .models import User, Company, Postings
+from .models import User, Company, Postings, PostingDailySummary, RetrainJob, RetrainTask, ModelTrainingState
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -16,9 +16,31 @@ class CompanyAdmin(admin.ModelAdmin):
 
 @admin.register(Postings)
 class PostingsAdmin(admin.ModelAdmin):
-    list_display = ('id', 'company', 'accountHandleNumber', 'postDate', 'postAmount', 'postCurrency', 'postDescription')
+    list_display = ('id', 'company', 'accountHandleNumber', 'postDate', 'postAmount', 'postCurrency', 'postDescription',
+                    'is_suspicious', 'anomaly_score', 'model_version')
     list_filter = ('company', 'postDate')
     search_fields = ('postDescription',)
     date_hierarchy = 'postDate'
 
+@admin.register(PostingDailySummary)
+class PostingDailySummaryAdmin(admin.ModelAdmin):
+    list_display = ('company', 'postDate', 'accountHandleNumber', 'postCurrency', 'total', 'count', 'suspicious_count')
+    list_filter = ('company', 'postCurrency')
+    date_hierarchy = 'postDate'
+
+@admin.register(RetrainJob)
+class RetrainJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'company', 'status', 'mode', 'created_at', 'finished_at')
+    list_filter = ('status', 'mode')
+
+@admin.register(RetrainTask)
+class RetrainTaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'job', 'company', 'status', 'mode', 'worker', 'rows', 'sample_fraction', 'finished_at')
+    list_filter = ('status', 'mode')
+
+@admin.register(ModelTrainingState)
+class ModelTrainingStateAdmin(admin.ModelAdmin):
+    list_display = ('company', 'last_posting_id', 'rows', 'sample_fraction', 'updates_since_full', 'trained_at',
+                    'full_trained_at')
+
 # Register your models here.
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SafeledgerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'SafeLedger'
+
+    def ready(self):
+        # registers the cache invalidation signal handlers
+        from . import scoping  # noqa: F401
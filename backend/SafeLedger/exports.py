@@ -0,0 +1,129 @@
+# backend/SafeLedger/exports.py
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from .fast_serializers import format_amount, format_date
+
+# id first, then the ';'-separated layout of posting.csv that ml/preprocess.py
+# and the bulk import read, so an export can be imported or trained on again
+EXPORT_COLUMNS = [
+    'id',
+    'company_id',
+    'accountHandleNumber',
+    'postDate',
+    'postAmount',
+    'postCurrency',
+    'postDescription',
+    'is_suspicious',
+]
+# read for the NDJSON lines only, which carry every field of the list endpoint
+SCORE_COLUMNS = ['anomaly_score', 'model_version']
+
+# rows are sent in chunks of this many; one write per row would make the
+# server flush thousands of tiny chunks per second
+ROWS_PER_CHUNK = 1000
+
+
+class _Echo:
+    # csv.writer target that hands the formatted line back instead of storing it
+    def write(self, value):
+        return value
+
+
+def _chunked(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+async def _achunked(lines):
+    chunk = []
+    async for line in lines:
+        chunk.append(line)
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _export_values(queryset):
+    return queryset.order_by('id').values_list(*EXPORT_COLUMNS, *SCORE_COLUMNS)
+
+
+def export_rows(queryset):
+    """Streams the export columns of a postings queryset with a server-side cursor."""
+    return _export_values(queryset).iterator(chunk_size=2000)
+
+
+async def aexport_rows(queryset, chunk_size=2000):
+    """export_rows() as an async iterator, for streaming responses under ASGI."""
+    # QuerySet.aiterator() runs a plain values_list() query in the event loop
+    # thread, so hop to the ORM's thread per chunk the way aiterator() does
+    rows = export_rows(queryset)
+    fetch = sync_to_async(lambda: list(islice(rows, chunk_size)))
+    while chunk := await fetch():
+        for row in chunk:
+            yield row
+
+
+_csv_writer = csv.writer(_Echo(), delimiter=';', lineterminator='\n')
+
+CSV_HEADER = _csv_writer.writerow(EXPORT_COLUMNS)
+
+
+def csv_line(row):
+    pk, company, account, post_date, amount, currency, description, flag, _, _ = row
+    return _csv_writer.writerow((pk, company, account, format_date(post_date), amount, currency, description, flag))
+
+
+# the same keys and value formats as the postings list endpoint
+_ndjson_dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+def ndjson_line(row):
+    pk, company, account, post_date, amount, currency, description, flag, score, version = row
+    return _ndjson_dumps({
+        'id': pk,
+        'company': company,
+        'accountHandleNumber': account,
+        'postDate': format_date(post_date),
+        'postAmount': format_amount(amount),
+        'postCurrency': currency,
+        'postDescription': description,
+        'is_suspicious': flag,
+        'anomaly_score': score,
+        'model_version': version,
+    }) + '\n'
+
+
+# export format -> (header line, row formatter, content type, file extension)
+EXPORT_FORMATS = {
+    'csv': (CSV_HEADER, csv_line, 'text/csv; charset=utf-8', 'csv'),
+    'ndjson': (None, ndjson_line, 'application/x-ndjson; charset=utf-8', 'ndjson'),
+}
+
+
+def export_lines(rows, export_format):
+    header, line, _, _ = EXPORT_FORMATS[export_format]
+    # the header goes out before the query runs, so the first byte is immediate
+    if header:
+        yield header
+    yield from _chunked(map(line, rows))
+
+
+async def aexport_lines(rows, export_format):
+    """export_lines() over an async iterator of rows."""
+    header, line, _, _ = EXPORT_FORMATS[export_format]
+    if header:
+        yield header
+    async for chunk in _achunked(line(row) async for row in rows):
+        yield chunk
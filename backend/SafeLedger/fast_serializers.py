@@ -0,0 +1,90 @@
+# backend/SafeLedger/fast_serializers.py
+"""
+Read-only fast path for posting listings. Rows come from values_list() instead
+of model instances and each field is converted by one plain function, which
+skips the per-row field machinery of PostingsSerializer. The output is
+byte-for-byte what PostingsSerializer rendered by DRF's JSONRenderer would
+produce (benchmarks/serializers.py checks this).
+"""
+import json
+from decimal import Decimal
+
+from rest_framework.settings import api_settings
+
+from .serializers import PostingsSerializer
+
+POSTING_FIELDS = PostingsSerializer.Meta.fields
+
+# values_list() column of each serializer field
+SOURCES = {'company': 'company_id'}
+
+
+def format_date(value):
+    # same as DateField(format="%d-%m-%Y") without strftime, which only
+    # differs for years below 1000
+    if value.year < 1000:
+        return value.strftime("%d-%m-%Y")
+    return f"{value.day:02d}-{value.month:02d}-{value.year}"
+
+
+def format_amount(value, cents=Decimal('0.01')):
+    # DecimalField(decimal_places=2) with COERCE_DECIMAL_TO_STRING; str() of a
+    # two-place Decimal never switches to exponent notation
+    return str(value.quantize(cents))
+
+
+FORMATTERS = {
+    'postDate': format_date,
+    'postAmount': format_amount,
+}
+
+# the settings JSONRenderer uses, so both encoders agree on every byte
+_encoder = json.JSONEncoder(
+    ensure_ascii=not api_settings.UNICODE_JSON,
+    allow_nan=not api_settings.STRICT_JSON,
+    separators=(',', ':') if api_settings.COMPACT_JSON else (', ', ': '),
+)
+
+
+def _columns(fields):
+    fields = [name for name in POSTING_FIELDS if fields is None or name in fields]
+    # id and postDate are always read, the keyset cursor needs them
+    sources = [SOURCES.get(name, name) for name in fields]
+    sources += [name for name in ('id', 'postDate') if name not in sources]
+    return fields, sources
+
+
+def posting_values(queryset, fields=None):
+    """
+    values_list() queryset with the columns needed for the given serializer
+    fields. Rows are named tuples, so the pagination can read row.postDate.
+    """
+    return queryset.values_list(*_columns(fields)[1], named=True)
+
+
+def posting_rows(rows, fields=None):
+    """
+    Turns posting_values() tuples into the dicts PostingsSerializer would
+    return. Each column is converted in one pass with its formatter, and
+    dates repeat a lot in a ledger, so each distinct date is formatted once.
+    """
+    names, _ = _columns(fields)
+    rows = list(rows)
+    if not rows:
+        return []
+    columns = list(zip(*rows))[:len(names)]
+    for i, name in enumerate(names):
+        if name == 'postDate':
+            formatted = {value: format_date(value) for value in set(columns[i])}
+            columns[i] = map(formatted.__getitem__, columns[i])
+        elif name in FORMATTERS:
+            columns[i] = map(FORMATTERS[name], columns[i])
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def render_json(data):
+    """Encodes plain Python data exactly like JSONRenderer.render."""
+    text = _encoder.encode(data)
+    # JSONRenderer escapes these two, they are not valid inside JavaScript strings
+    text = text.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+    return text.encode()
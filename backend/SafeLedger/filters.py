@@ -0,0 +1,66 @@
+# backend/SafeLedger/filters.py
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from rest_framework.exceptions import ValidationError
+
+
+def _parse(params, name, convert, error):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return convert(value)
+    except (ValueError, InvalidOperation):
+        raise ValidationError({name: error})
+
+
+def _parse_bool(value):
+    lowered = value.lower()
+    if lowered in ('true', '1', 'yes'):
+        return True
+    if lowered in ('false', '0', 'no'):
+        return False
+    raise ValueError(value)
+
+
+# query parameter -> (ORM lookup, converter, error message)
+POSTING_FILTERS = {
+    'date_from': ('postDate__gte', date.fromisoformat, "Use YYYY-MM-DD."),
+    'date_to': ('postDate__lte', date.fromisoformat, "Use YYYY-MM-DD."),
+    'amount_min': ('postAmount__gte', Decimal, "Must be a number."),
+    'amount_max': ('postAmount__lte', Decimal, "Must be a number."),
+    'account': ('accountHandleNumber', int, "Must be an integer."),
+    'is_suspicious': ('is_suspicious', _parse_bool, "Must be true or false."),
+    # review threshold on the stored anomaly score, lower is more anomalous
+    'score_max': ('anomaly_score__lte', float, "Must be a number."),
+}
+
+
+def filter_values(params, names=POSTING_FILTERS):
+    """Parses the given filter parameters; returns {name: value} for those present."""
+    values = {}
+    for name in names:
+        _, convert, error = POSTING_FILTERS[name]
+        value = _parse(params, name, convert, error)
+        if value is not None:
+            values[name] = value
+    return values
+
+
+def filter_postings(qs, params):
+    """Applies the server-side postings filters found in the query parameters."""
+    values = filter_values(params)
+    return qs.filter(**{POSTING_FILTERS[name][0]: value for name, value in values.items()})
+
+
+def requested_fields(params, allowed):
+    """Parses ?fields=a,b,c; returns None when every field is wanted."""
+    raw = params.get('fields')
+    if not raw:
+        return None
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValidationError({'fields': f"Unknown field(s): {', '.join(unknown)}"})
+    return fields
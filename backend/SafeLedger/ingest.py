@@ -0,0 +1,176 @@
+# backend/SafeLedger/ingest.py
+import io
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.backends.base.operations import BaseDatabaseOperations
+from rest_framework import serializers
+
+from .models import Company, Postings
+from .ml.ml_model import score_postings
+from .summaries import apply_deltas, posting_deltas
+
+# Same layout as the ';'-separated posting.csv read by ml/train_model.py
+POSTING_COLUMNS = [
+    'company_id',
+    'accountHandleNumber',
+    'postDate',
+    'postAmount',
+    'postCurrency',
+    'postDescription',
+]
+
+AMOUNT_PATTERN = r'[-+]?\d{1,13}(\.\d{1,2})?'
+MAX_REPORTED_ERRORS = 10
+
+
+def read_postings_csv(upload):
+    """
+    Reads an uploaded ';'-separated postings file into a DataFrame of strings.
+    Files exported from Excel are often latin1, so fall back to that when the
+    bytes are not valid utf-8.
+    """
+    raw = upload.read()
+    try:
+        text = raw.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = raw.decode('latin1')
+    return pd.read_csv(io.StringIO(text), sep=';', dtype=str, keep_default_na=False)
+
+
+def read_postings_json(rows):
+    if not isinstance(rows, list):
+        raise serializers.ValidationError("Expected a list of postings.")
+    if not rows:
+        raise serializers.ValidationError("No postings to import.")
+    bad = [i for i, row in enumerate(rows, start=1) if not isinstance(row, dict)]
+    if bad:
+        raise serializers.ValidationError([f"Row {r}: expected an object." for r in bad[:MAX_REPORTED_ERRORS]])
+    return pd.DataFrame.from_records(rows)
+
+
+def _row_errors(mask, message):
+    # +1 so row numbers match the lines users see in their file
+    rows = (np.flatnonzero(mask.to_numpy()) + 1)[:MAX_REPORTED_ERRORS]
+    return [f"Row {r}: {message}" for r in rows]
+
+
+def _out_of_range(values, field):
+    # the column's bounds on PostgreSQL; SQLite stores any 64-bit value in
+    # an IntegerField, so its own ranges would let through what PostgreSQL rejects
+    low, high = BaseDatabaseOperations.integer_field_ranges[field.get_internal_type()]
+    return ~values.between(low, high)
+
+
+def clean_postings_frame(df, allowed_company_ids=None):
+    """
+    Validates and converts a raw postings frame column by column.
+    Raises a ValidationError listing the first bad rows instead of
+    validating every posting through PostingsSerializer.
+    """
+    if df.empty:
+        raise serializers.ValidationError("No postings to import.")
+    df = df.rename(columns={'company': 'company_id'})
+    missing = [c for c in POSTING_COLUMNS if c not in df.columns and c != 'postDescription']
+    if missing:
+        raise serializers.ValidationError(f"Missing column(s): {', '.join(missing)}")
+
+    df = df.reset_index(drop=True)
+    if 'postDescription' not in df.columns:
+        df['postDescription'] = ''
+    text = {c: df[c].fillna('').astype(str).str.strip() for c in POSTING_COLUMNS}
+
+    errors = []
+
+    company_id = pd.to_numeric(text['company_id'], errors='coerce')
+    errors += _row_errors(company_id.isna() | (company_id % 1 != 0)
+                          | _out_of_range(company_id, Postings._meta.get_field('company').target_field),
+                          "invalid company_id.")
+
+    account = pd.to_numeric(text['accountHandleNumber'], errors='coerce')
+    errors += _row_errors(account.isna() | (account % 1 != 0)
+                          | _out_of_range(account, Postings._meta.get_field('accountHandleNumber')),
+                          "invalid accountHandleNumber.")
+
+    # The API accepts ISO dates, posting.csv uses the dd-mm-YYYY format
+    post_date = pd.to_datetime(text['postDate'], format='%Y-%m-%d', errors='coerce')
+    post_date = post_date.fillna(pd.to_datetime(text['postDate'], format='%d-%m-%Y', errors='coerce'))
+    errors += _row_errors(post_date.isna(), "invalid postDate, use YYYY-MM-DD or DD-MM-YYYY.")
+
+    amount_ok = text['postAmount'].str.fullmatch(AMOUNT_PATTERN)
+    errors += _row_errors(~amount_ok, "invalid postAmount.")
+
+    currency_ok = (text['postCurrency'].str.len() > 0) & (text['postCurrency'].str.len() <= 100)
+    errors += _row_errors(~currency_ok, "postCurrency must be 1-100 characters.")
+    errors += _row_errors(text['postDescription'].str.len() > 100,
+                          "postDescription must be at most 100 characters.")
+
+    if errors:
+        raise serializers.ValidationError(errors)
+
+    company_id = company_id.astype(np.int64)
+    known = set(Company.objects.filter(id__in=company_id.unique().tolist()).values_list('id', flat=True))
+    errors += _row_errors(~company_id.isin(known), "company does not exist.")
+    if allowed_company_ids is not None:
+        errors += _row_errors(company_id.isin(known) & ~company_id.isin(allowed_company_ids),
+                              "you do not have access to this company.")
+    if errors:
+        raise serializers.ValidationError(errors)
+
+    return pd.DataFrame({
+        'company_id': company_id,
+        'accountHandleNumber': account.astype(np.int64),
+        'postDate': post_date.dt.date,
+        'postAmount': text['postAmount'],
+        'postCurrency': text['postCurrency'],
+        'postDescription': text['postDescription'],
+    })
+
+
+def import_postings(df, batch_size=2000):
+    """
+    Saves a cleaned postings frame with one bulk_create per company.
+    Returns the number of created and suspicious postings.
+    """
+    created = 0
+    suspicious = 0
+    deltas = None
+    # every company in the file scored in one call; companies without a
+    # usable model are not flagged, like PostingsSerializer.create
+    scores = score_postings(df.assign(postAmount=df['postAmount'].astype(float)))
+    with transaction.atomic():
+        for company_id, rows in df.groupby('company_id', sort=False).indices.items():
+            group = df.take(rows)
+            flags = scores.suspicious[rows]
+            version = scores.versions.get(int(company_id))
+            anomaly_scores = scores.anomaly_score[rows].tolist() if scores.scored[rows[0]] else [None] * len(rows)
+            objs = [
+                Postings(
+                    company_id=int(company_id),
+                    accountHandleNumber=account,
+                    postDate=post_date,
+                    postAmount=Decimal(amount),
+                    postCurrency=currency,
+                    postDescription=description,
+                    is_suspicious=bool(flag),
+                    anomaly_score=anomaly_score,
+                    model_version=version,
+                )
+                for account, post_date, amount, currency, description, flag, anomaly_score in zip(
+                    group['accountHandleNumber'].tolist(),
+                    group['postDate'].tolist(),
+                    group['postAmount'].tolist(),
+                    group['postCurrency'].tolist(),
+                    group['postDescription'].tolist(),
+                    flags.tolist(),
+                    anomaly_scores,
+                )
+            ]
+            Postings.objects.bulk_create(objs, batch_size=batch_size)
+            deltas = posting_deltas(objs, deltas=deltas)
+            created += len(objs)
+            suspicious += int(flags.sum())
+        apply_deltas(deltas)
+    return {'created': created, 'suspicious': suspicious}
@@ -0,0 +1,275 @@
+# backend/SafeLedger/jobs.py
+import os
+import socket
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from . import metrics
+from .models import Company, ModelTrainingState, RetrainJob, RetrainTask
+from .ml.dataset import company_frame, iter_company_frames, sample_company_frame
+from .ml.ml_model import load_model_for_update, save_model
+from .ml.training import ModelUpdate, fit_companies
+
+# An incremental retrain falls back to a full refit when the new postings are
+# more than this share of what the model has seen, or after this many updates
+# in a row, so drift from the partial updates never piles up for long
+MAX_INCREMENTAL_SHARE = 0.5
+MAX_INCREMENTAL_UPDATES = 30
+# share of the forest replaced by an update at least, more when more is new
+MIN_REPLACED_TREES = 0.1
+# older postings the new trees are grown on next to the new ones; at least
+# the 256 rows a tree samples, see update_company_model
+REFERENCE_ROWS = 2000
+# rows a sampled refit draws when the job does not say; the forest only
+# looks at 256 rows per tree, the rest keeps the feature statistics steady
+DEFAULT_SAMPLE_SIZE = 100_000
+
+# a refit on a random sample of the company's postings
+SampledFit = namedtuple('SampledFit', ['size', 'sampling'])
+
+
+def enqueue_retrain(company=None, requested_by=None, mode='full', sample_size=None, sampling='uniform'):
+    """
+    Queues a retrain job with one task per company. Without a company every
+    company is retrained; companies without postings are skipped.
+    """
+    if mode == 'sampled' and not sample_size:
+        sample_size = DEFAULT_SAMPLE_SIZE
+    with transaction.atomic():
+        job = RetrainJob.objects.create(company=company, requested_by=requested_by, mode=mode,
+                                        sample_size=sample_size, sampling=sampling)
+        company_ids = [company.id] if company else Company.objects.values_list('id', flat=True)
+        RetrainTask.objects.bulk_create([
+            RetrainTask(job=job, company_id=cid, mode=mode, sample_size=sample_size, sampling=sampling)
+            for cid in company_ids
+        ])
+    return job
+
+
+def job_progress(job):
+    counts = dict(job.tasks.values_list('status').annotate(n=Count('id')).order_by())
+    total = sum(counts.values())
+    finished = counts.get('done', 0) + counts.get('failed', 0) + counts.get('skipped', 0)
+    return {
+        'tasks_total': total,
+        'tasks_done': counts.get('done', 0),
+        'tasks_failed': counts.get('failed', 0),
+        'tasks_skipped': counts.get('skipped', 0),
+        'progress': round(finished / total, 3) if total else 1.0,
+    }
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next_task(worker):
+    """
+    Claims the oldest queued task. The conditional UPDATE only succeeds for
+    one worker, so several worker processes can poll the same table.
+    """
+    while True:
+        task = RetrainTask.objects.filter(status='queued').order_by('id').first()
+        if task is None:
+            return None
+        claimed = RetrainTask.objects.filter(id=task.id, status='queued').update(
+            status='running', worker=worker, started_at=timezone.now(),
+        )
+        if claimed:
+            RetrainJob.objects.filter(id=task.job_id, status='queued').update(
+                status='running', started_at=timezone.now(),
+            )
+            task.refresh_from_db()
+            return task
+
+
+def claim_tasks(worker, limit):
+    tasks = []
+    while len(tasks) < limit:
+        task = claim_next_task(worker)
+        if task is None:
+            break
+        tasks.append(task)
+    return tasks
+
+
+def plan_update(company_id):
+    """
+    What an incremental retrain of the company needs: a ModelUpdate, 'current'
+    when nothing was posted since the model was trained, or None when the
+    model has to be refitted on everything.
+    """
+    state = ModelTrainingState.objects.filter(company_id=company_id).first()
+    if state is None or state.updates_since_full >= MAX_INCREMENTAL_UPDATES:
+        return None
+    # the statistics of a sampled model are not on the scale of the new rows
+    if state.sample_fraction < 1:
+        return None
+    model = load_model_for_update(company_id)
+    # models from before the feature pipeline, or replaced outside the worker
+    if model is None or model[2] is None or model[3] != state.model_version:
+        return None
+    new = company_frame(company_id, after_id=state.last_posting_id)
+    if new.empty:
+        return 'current'
+    if len(new) > MAX_INCREMENTAL_SHARE * state.rows:
+        return None
+    reference = company_frame(company_id, up_to_id=state.last_posting_id, limit=REFERENCE_ROWS)
+    replace_fraction = min(max(MIN_REPLACED_TREES, len(new) / (state.rows + len(new))), MAX_INCREMENTAL_SHARE)
+    return ModelUpdate(*model[:3], new, reference, replace_fraction)
+
+
+def refit_plan(company_tasks):
+    """
+    SampledFit for the refit of a company's tasks when it should run on a
+    sample: a sampled task asked for one, or the current model was sampled.
+    None refits on every posting.
+    """
+    modes = {task.mode for task in company_tasks}
+    if 'full' in modes:
+        return None
+    sampled = [task for task in company_tasks if task.mode == 'sampled']
+    if sampled:
+        task = max(sampled, key=lambda task: task.sample_size or DEFAULT_SAMPLE_SIZE)
+        return SampledFit(task.sample_size or DEFAULT_SAMPLE_SIZE, task.sampling)
+    # an incremental task that cannot update keeps its model's sampling
+    state = ModelTrainingState.objects.filter(company_id=company_tasks[0].company_id).first()
+    if state is not None and state.sample_size:
+        return SampledFit(state.sample_size, state.sampling)
+    return None
+
+
+def _training_datasets(company_ids, plans, trained):
+    # incremental updates and samples first, then one streaming pass over the
+    # companies refitted on every posting; records per company the newest
+    # posting id it is trained on and its TrainingSample, if any
+    full = []
+    for company_id in company_ids:
+        plan = plans.get(company_id)
+        if isinstance(plan, ModelUpdate):
+            trained[company_id] = (int(plan.new['id'].max()), None)
+            yield company_id, plan
+        elif isinstance(plan, SampledFit):
+            sample = sample_company_frame(company_id, plan.size, plan.sampling)
+            if sample.population:
+                trained[company_id] = (sample.last_posting_id, sample)
+                yield company_id, sample
+        else:
+            full.append(company_id)
+    if full:
+        for company_id, frame in iter_company_frames(full):
+            trained[company_id] = (int(frame['id'].max()), None)
+            yield company_id, frame
+
+
+def record_training_state(result, watermark, version, sample=None):
+    now = timezone.now()
+    if result.mode == 'incremental':
+        ModelTrainingState.objects.filter(company_id=result.company_id).update(
+            last_posting_id=watermark, rows=F('rows') + result.rows, model_version=version,
+            updates_since_full=F('updates_since_full') + 1, trained_at=now,
+        )
+    else:
+        ModelTrainingState.objects.update_or_create(company_id=result.company_id, defaults={
+            'last_posting_id': watermark, 'model_version': version,
+            'rows': sample.population if sample else result.rows,
+            'updates_since_full': 0, 'full_trained_at': now, 'trained_at': now,
+            'sample_size': sample.size if sample else None,
+            'sampling': sample.sampling if sample else '',
+            'sample_fraction': sample.fraction if sample else 1.0,
+            'sample_seed': sample.seed if sample else None,
+        })
+
+
+def run_tasks(tasks, workers=None, n_jobs=1):
+    """
+    Retrains the companies of the claimed tasks in parallel and records the
+    row count and fit time of each one. Companies without postings are
+    skipped and keep their model; only deleting the company removes it
+    (see CompanyDetailView). Incremental tasks update the current model with
+    the postings added since it was trained (see plan_update) and fall back
+    to a refit when they cannot. Sampled tasks refit on a random sample of
+    the company's postings (see refit_plan).
+    """
+    by_company = defaultdict(list)
+    for task in tasks:
+        by_company[task.company_id].append(task)
+
+    try:
+        plans = {}
+        for company_id, company_tasks in by_company.items():
+            if all(task.mode == 'incremental' for task in company_tasks):
+                plans[company_id] = plan_update(company_id)
+            if plans.get(company_id) == 'current':
+                for task in company_tasks:
+                    task.rows = 0
+                    task.status = 'done'
+            elif plans.get(company_id) is None:
+                plans[company_id] = refit_plan(company_tasks)
+
+        pending = [cid for cid, company_tasks in by_company.items() if company_tasks[0].status == 'running']
+        trained = {}
+        datasets = _training_datasets(pending, plans, trained)
+        for result in fit_companies(datasets, workers=workers, n_jobs=n_jobs):
+            watermark, sample = trained[result.company_id]
+            metrics.TRAIN_SECONDS.observe(result.seconds, company=result.company_id, mode=result.mode)
+            metrics.TRAIN_ROWS.observe(result.rows, company=result.company_id, mode=result.mode)
+            if not result.error:
+                # only this company's artifact is rewritten
+                version = save_model(result.company_id, result.scaler, result.iso, result.features,
+                                     sample.info() if sample else None)
+                record_training_state(result, watermark, version, sample)
+            for task in by_company[result.company_id]:
+                task.rows = result.rows
+                task.fit_seconds = result.seconds
+                task.mode = result.mode
+                if sample:
+                    task.sample_size, task.sampling = sample.size, sample.sampling
+                    task.sample_fraction, task.sample_seed = sample.fraction, sample.seed
+                task.status = 'failed' if result.error else 'done'
+                task.error = result.error or ''
+        # no postings to train on: an empty retrain is no reason to drop a model
+        for task in tasks:
+            if task.status == 'running':
+                task.rows = 0
+                task.status = 'skipped'
+                task.error = 'no postings to train on, the current model is kept'
+    except Exception as e:
+        for task in tasks:
+            if task.status == 'running':
+                task.status = 'failed'
+                task.error = str(e)
+
+    now = timezone.now()
+    for task in tasks:
+        task.finished_at = now
+    RetrainTask.objects.bulk_update(tasks, [
+        'status', 'mode', 'rows', 'fit_seconds', 'sample_size', 'sampling', 'sample_fraction', 'sample_seed',
+        'error', 'finished_at',
+    ])
+    for job_id in {task.job_id for task in tasks}:
+        finish_job_if_complete(job_id)
+    # the worker can sit idle for a long time, publish the fit times now
+    metrics.flush()
+    return tasks
+
+
+def finish_job_if_complete(job_id):
+    if RetrainTask.objects.filter(job_id=job_id, status__in=('queued', 'running')).exists():
+        return
+    status = 'failed' if RetrainTask.objects.filter(job_id=job_id, status='failed').exists() else 'done'
+    RetrainJob.objects.filter(id=job_id, status__in=('queued', 'running')).update(
+        status=status, finished_at=timezone.now(),
+    )
+
+
+def requeue_stale_tasks(timeout):
+    """Puts tasks back in the queue whose worker died while running them."""
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return RetrainTask.objects.filter(status='running', started_at__lt=cutoff).update(
+        status='queued', worker='', started_at=None,
+    )
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from SafeLedger.jobs import enqueue_retrain
+from SafeLedger.models import Company, RetrainJob
+
+
+class Command(BaseCommand):
+    help = ("Queue a model retrain job for the retrain_worker, e.g. a nightly "
+            "`enqueue_retrain --incremental` from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=int,
+                            help="Only retrain this company id (default: every company).")
+        parser.add_argument("--incremental", action="store_true",
+                            help="Update the models with the postings added since their last training.")
+        parser.add_argument("--sample-size", type=int,
+                            help="Refit each model on a random sample of this many postings.")
+        parser.add_argument("--sampling", choices=[name for name, _ in RetrainJob.SAMPLING_CHOICES],
+                            default="uniform", help="How --sample-size draws the postings (default: uniform).")
+
+    def handle(self, *args, **options):
+        company = None
+        if options["company"]:
+            company = Company.objects.filter(id=options["company"]).first()
+            if company is None:
+                raise CommandError(f"Company {options['company']} does not exist.")
+        if options["incremental"] and options["sample_size"]:
+            raise CommandError("Use either --incremental or --sample-size.")
+        if options["sample_size"] is not None and options["sample_size"] < 1:
+            raise CommandError("--sample-size must be a positive number of postings.")
+        mode = "incremental" if options["incremental"] else "sampled" if options["sample_size"] else "full"
+        job = enqueue_retrain(company=company, mode=mode, sample_size=options["sample_size"],
+                              sampling=options["sampling"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Queued {job.mode} retrain job {job.id} with {job.tasks.count()} task(s)."
+        ))
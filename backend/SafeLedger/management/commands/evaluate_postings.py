@@ -1,28 +1,161 @@
-from django.core.management.base import BaseCommand
+import multiprocessing
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+
 from SafeLedger.models import Postings
-from SafeLedger.ml.ml_model import evaluate_posting
+from SafeLedger.ml.features import FEATURE_COLUMNS
+from SafeLedger.ml.ml_model import ModelNotFound, score_company
+from SafeLedger.summaries import rebuild_summaries
+
+
+SCORE_COLUMNS = ['is_suspicious', 'anomaly_score', 'model_version']
+
+
+def backfill_company(company_id, since=None, chunk_size=10000, batch_size=1000, progress=None):
+    """
+    Re-scores one company's postings chunk by chunk and writes back the flag,
+    anomaly score and model version of the rows where any of them changed.
+    Chunks are read with keyset pagination on id, so no cursor is held open
+    while the same table is updated.
+    Returns (rows scored, rows flagged, flags changed).
+    """
+    qs = Postings.objects.filter(company_id=company_id)
+    if since:
+        qs = qs.filter(postDate__gte=since)
+    qs = qs.order_by('id').values_list('id', *FEATURE_COLUMNS, *SCORE_COLUMNS)
+
+    scored = flagged = updated = 0
+    last_id = 0
+    try:
+        while True:
+            chunk = list(qs.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            frame = pd.DataFrame.from_records(chunk, columns=['id', *FEATURE_COLUMNS, *SCORE_COLUMNS])
+            ids = frame['id'].to_numpy(dtype=np.int64)
+            last_id = int(ids[-1])
+
+            # one feature pipeline pass and transform/score_samples for the whole chunk
+            flags, scores, version = score_company(company_id, frame)
+            changed = flags != frame['is_suspicious'].to_numpy(dtype=bool)
+            # a model scores a row the same every time, so unchanged scores of the
+            # same version need no write; unscored rows are NaN and never equal
+            stale = changed | (frame['anomaly_score'].to_numpy(dtype=float) != scores)
+            if version is not None:
+                stale |= frame['model_version'].to_numpy(dtype=float) != version
+            rows = np.flatnonzero(stale)
+            Postings.objects.bulk_update(
+                [Postings(id=i, is_suspicious=f, anomaly_score=a, model_version=version)
+                 for i, f, a in zip(ids[rows].tolist(), flags[rows].tolist(), scores[rows].tolist())],
+                SCORE_COLUMNS, batch_size=batch_size,
+            )
+            scored += len(ids)
+            flagged += int(flags.sum())
+            updated += int(changed.sum())
+            if progress:
+                progress(company_id, scored, len(ids))
+    finally:
+        # the flag UPDATEs bypass the incremental suspicious counts; rebuilt
+        # after a failed chunk too, earlier chunks may have changed flags
+        if updated:
+            rebuild_summaries([company_id])
+    return scored, flagged, updated
+
+
+# large companies report every PROGRESS_EVERY rows so long runs stay visible
+PROGRESS_EVERY = 100000
+
+# the command's stdout in this process, set by _init_worker; forked pool
+# workers inherit it instead of pickling it with every job
+_progress_out = None
+
+
+def _init_worker(out):
+    global _progress_out
+    _progress_out = out
+
+
+def _report_progress(company_id, scored, chunk_rows):
+    if _progress_out is not None and scored // PROGRESS_EVERY != (scored - chunk_rows) // PROGRESS_EVERY:
+        _progress_out.write(f"  company {company_id}: {scored} scored")
+        _progress_out.flush()
+
+
+def _backfill_worker(args):
+    company_id, since, chunk_size, batch_size = args
+    started = time.monotonic()
+    try:
+        result = backfill_company(company_id, since, chunk_size, batch_size, progress=_report_progress)
+        return company_id, result, None, time.monotonic() - started
+    except ModelNotFound as e:
+        return company_id, None, str(e), time.monotonic() - started
+
 
 class Command(BaseCommand):
-    help = "Backfill the `is_suspicious` flag on all postings."
+    help = "Backfill the `is_suspicious` flag and anomaly score on all postings."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=int, action="append", dest="companies",
+                            help="Only re-score this company id (can be repeated).")
+        parser.add_argument("--since", type=date.fromisoformat,
+                            help="Only re-score postings dated on or after YYYY-MM-DD.")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Processes scoring companies in parallel.")
+        parser.add_argument("--chunk-size", type=int, default=10000,
+                            help="Postings read and scored per query.")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Maximum ids per UPDATE statement.")
 
     def handle(self, *args, **options):
         qs = Postings.objects.all()
-        to_update = []
-        for p in qs:
-            data = {
-                "company_id": p.company_id,
-                "accountHandleNumber": p.accountHandleNumber,
-                "postAmount": float(p.postAmount),
-            }
-            try:
-                p.is_suspicious = evaluate_posting(data)
-                to_update.append(p)
-            except Exception as e:
-                self.stderr.write(f"Skipping {p.id}: {e}")
-
-        # Bulk–update in a single query
-        Postings.objects.bulk_update(to_update, ["is_suspicious"])
+        if options["companies"]:
+            qs = qs.filter(company_id__in=options["companies"])
+        if options["since"]:
+            qs = qs.filter(postDate__gte=options["since"])
+        counts = dict(qs.values_list('company_id').annotate(n=Count('id')).order_by('company_id'))
+        if not counts:
+            raise CommandError("No postings match the given filters.")
+
+        total = sum(counts.values())
+        self.stdout.write(f"Scoring {total} postings for {len(counts)} companies.")
+        jobs = [(cid, options["since"], options["chunk_size"], options["batch_size"]) for cid in counts]
+
+        if options["workers"] > 1:
+            # children open their own database connections
+            connections.close_all()
+            pool = multiprocessing.get_context("fork").Pool(options["workers"], initializer=_init_worker,
+                                                            initargs=(self.stdout,))
+            results = pool.imap_unordered(_backfill_worker, jobs)
+        else:
+            pool = None
+            _init_worker(self.stdout)
+            results = map(_backfill_worker, jobs)
+
+        done = processed = flagged = updated = 0
+        try:
+            for company_id, result, error, seconds in results:
+                done += counts[company_id]
+                if error:
+                    self.stderr.write(f"Skipping company {company_id} ({counts[company_id]} postings): {error}")
+                    continue
+                processed += result[0]
+                flagged += result[1]
+                updated += result[2]
+                self.stdout.write(
+                    f"[{done}/{total}] company {company_id}: {result[0]} scored, "
+                    f"{result[1]} suspicious, {result[2]} changed in {seconds:.1f}s"
+                )
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
 
         self.stdout.write(self.style.SUCCESS(
-            f"Processed {len(to_update)} postings; flags updated."
+            f"Processed {processed} postings; {flagged} suspicious, {updated} flags updated."
         ))
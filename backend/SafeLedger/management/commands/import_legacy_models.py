@@ -0,0 +1,21 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from SafeLedger.ml import ml_model
+
+
+class Command(BaseCommand):
+    help = "Split the old scalers.pkl / iso_forests.pkl dicts into per-company model artifacts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scalers", default=os.path.join(ml_model.models_dir, "scalers.pkl"))
+        parser.add_argument("--forests", default=os.path.join(ml_model.models_dir, "iso_forests.pkl"))
+
+    def handle(self, *args, **options):
+        for path in (options["scalers"], options["forests"]):
+            if not os.path.exists(path):
+                raise CommandError(f"{path} does not exist.")
+        imported = ml_model.registry.import_legacy(options["scalers"], options["forests"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported models for {len(imported)} companies into {ml_model.registry.root}."
+        ))
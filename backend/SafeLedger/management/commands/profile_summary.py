@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from SafeLedger import urls
+from SafeLedger.profiling import read_records, summarize
+
+SORT_KEYS = ("total_ms", "p95_ms", "max_ms", "mean_queries", "sql_share")
+
+
+class Command(BaseCommand):
+    help = ("Summarise the requests sampled by ProfilingMiddleware (SAFELEDGER_PROFILE_RATE): "
+            "the slowest API views first.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", default=str(settings.PROFILE_DIR),
+                            help="Profiling directory (default: PROFILE_DIR).")
+        parser.add_argument("--top", type=int, default=10, help="Number of views to list.")
+        parser.add_argument("--sort", choices=SORT_KEYS, default="total_ms",
+                            help="Rank by total time (default), p95/max latency, queries or SQL share.")
+        parser.add_argument("--hours", type=float, help="Only requests of the last HOURS hours.")
+        parser.add_argument("--all-views", action="store_true",
+                            help="Include views outside SafeLedger.urls (admin, frontend, /metrics).")
+
+    def handle(self, *args, **options):
+        views = None if options["all_views"] else {pattern.name for pattern in urls.urlpatterns}
+        since = None
+        if options["hours"]:
+            since = (datetime.now() - timedelta(hours=options["hours"])).timestamp()
+        rows = summarize(read_records(options["dir"]), views=views, since=since)
+        if not rows:
+            self.stdout.write(f"No profiled requests in {options['dir']}.")
+            return
+        rows.sort(key=lambda row: row[options["sort"]], reverse=True)
+
+        self.stdout.write(f"{'view':<28} {'requests':>8} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+                          f"{'max ms':>9} {'queries':>8} {'max q':>6} {'sql %':>6}")
+        for row in rows[:options["top"]]:
+            self.stdout.write(
+                f"{row['view'][:28]:<28} {row['requests']:>8} {row['total_ms'] / 1000:>9.2f} "
+                f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['max_ms']:>9.1f} "
+                f"{row['mean_queries']:>8.1f} {row['max_queries']:>6} {row['sql_share']:>6.0%}"
+            )
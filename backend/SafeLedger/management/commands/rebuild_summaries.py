@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from SafeLedger.summaries import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-company daily posting summaries from the postings table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=int, action="append", dest="companies",
+                            help="Only rebuild this company id (can be repeated).")
+
+    def handle(self, *args, **options):
+        written = rebuild_summaries(options["companies"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} summary rows."))
@@ -0,0 +1,63 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from SafeLedger import metrics
+from SafeLedger.jobs import claim_tasks, requeue_stale_tasks, run_tasks, worker_name
+from SafeLedger.ml.training import default_workers
+
+
+class Command(BaseCommand):
+    help = "Process queued model retrain jobs from the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=None,
+                            help="Training processes fitting companies in parallel "
+                                 "(default: SAFELEDGER_TRAIN_WORKERS or the CPU count).")
+        parser.add_argument("--n-jobs", type=int, default=1,
+                            help="Threads per IsolationForest fit.")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Tasks claimed at once (default: 4 per training process).")
+        parser.add_argument("--poll-interval", type=float, default=2.0,
+                            help="Seconds to sleep when the queue is empty.")
+        parser.add_argument("--stale-after", type=int, default=3600,
+                            help="Requeue tasks that have been running for this many seconds.")
+        parser.add_argument("--once", action="store_true",
+                            help="Exit when the queue is empty instead of polling.")
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_tasks(options["stale_after"])
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale task(s).")
+
+        concurrency = options["concurrency"] or default_workers()
+        batch_size = options["batch_size"] or 4 * concurrency
+        name = worker_name()
+        self.stdout.write(f"Worker {name} started with {concurrency} training process(es).")
+        try:
+            while True:
+                tasks = claim_tasks(name, batch_size)
+                if not tasks:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+                started = time.monotonic()
+                run_tasks(tasks, workers=concurrency, n_jobs=options["n_jobs"])
+                for task in tasks:
+                    fit = f"{task.fit_seconds:.2f}s" if task.fit_seconds is not None else "-"
+                    self.stdout.write(
+                        f"Job {task.job_id} company {task.company_id}: {task.status} ({task.mode}), "
+                        f"{task.rows} rows, fit {fit}"
+                        + (f", sample {task.sample_fraction:.1%} seed {task.sample_seed}"
+                           if task.sample_fraction is not None else "")
+                        + (f" ({task.error})" if task.error else "")
+                    )
+                self.stdout.write(f"Batch of {len(tasks)} task(s) in {time.monotonic() - started:.2f}s")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connections.close_all()
+            metrics.mark_process_dead(os.getpid())
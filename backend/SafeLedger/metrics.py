@@ -0,0 +1,265 @@
+# backend/SafeLedger/metrics.py
+"""
+In-process counters and histograms, rendered in the Prometheus text format
+on /metrics (see views.metrics_view).
+
+Observing is a dict lookup, a bisect and two additions under a lock, so the
+instrumentation stays on in production. Each gunicorn worker (and the
+retrain_worker) counts on its own; with SAFELEDGER_METRICS_DIR set, every
+process also writes its totals to <dir>/metrics_<pid>.json at most every
+FLUSH_INTERVAL seconds, and /metrics adds up the files of all processes, so
+a scrape sees the whole server whichever worker answers it. Without the
+setting /metrics only shows the process that served it.
+
+The files of processes that exited are dropped: gunicorn.conf.py clears the
+directory when the master starts and removes a worker's file when it exits
+(mark_process_dead), and the sum skips files whose process is gone, like a
+retrain_worker that was killed. The directory must not be shared between
+hosts, the pids would mix.
+
+This module imports nothing from Django, the ml scripts use it too.
+"""
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+FLUSH_INTERVAL = 5.0
+
+# seconds, from a cached model's predict() up to a full retrain
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+ROW_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+_lock = threading.Lock()
+_metrics = {}
+_flushed_at = 0.0
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        # label values -> count
+        self.values = {}
+        _metrics[name] = self
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        _maybe_flush()
+
+    def merge(self, values, key, value):
+        values[key] = values.get(key, 0) + value
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (the last one is +Inf), sum]
+        self.values = {}
+        _metrics[name] = self
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+        _maybe_flush()
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def merge(self, values, key, value):
+        entry = values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+        entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+        entry[1] += value[1]
+
+    def samples(self, values):
+        bounds = [_format_value(bound) for bound in self.buckets] + ['+Inf']
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield f'{self.name}_bucket', {**labels, 'le': bound}, cumulative
+            yield f'{self.name}_count', labels, cumulative
+            yield f'{self.name}_sum', labels, total
+
+
+SCORING_SECONDS = Histogram(
+    'safeledger_scoring_seconds', 'Time to score a batch of postings with a company model.', ['company'])
+SCORING_FALLBACKS = Counter(
+    'safeledger_scoring_fallbacks_total',
+    'Postings saved unflagged because the company model could not score them.', ['company', 'reason'])
+MODEL_LOAD_SECONDS = Histogram(
+    'safeledger_model_load_seconds', 'Time to load a company model artifact from disk.', ['company'])
+TRAIN_SECONDS = Histogram(
+    'safeledger_train_seconds', 'Time to fit or update a company model in a retrain task.', ['company', 'mode'])
+TRAIN_ROWS = Histogram(
+    'safeledger_train_rows', 'Postings a company model was fitted on in a retrain task.', ['company', 'mode'],
+    buckets=ROW_BUCKETS)
+REQUEST_SECONDS = Histogram(
+    'safeledger_request_seconds', 'Time until an API response is returned (first byte for streamed ones).',
+    ['view', 'method', 'status'])
+
+
+def _metrics_dir():
+    return os.environ.get('SAFELEDGER_METRICS_DIR')
+
+
+def _snapshot():
+    with _lock:
+        return {name: [[list(key), value] for key, value in metric.values.items()]
+                for name, metric in _metrics.items()}
+
+
+def flush():
+    """Writes this process's totals to the metrics directory, if there is one."""
+    global _flushed_at
+    directory = _metrics_dir()
+    if not directory:
+        return
+    _flushed_at = time.monotonic()
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.metrics.')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(_snapshot(), f)
+    os.replace(tmp, _metrics_file(directory, os.getpid()))
+
+
+def _metrics_file(directory, pid):
+    return os.path.join(directory, f'metrics_{pid}.json')
+
+
+def _file_pid(filename):
+    # metrics_<pid>.json -> pid, None for anything else in the directory
+    if not (filename.startswith('metrics_') and filename.endswith('.json')):
+        return None
+    try:
+        return int(filename[len('metrics_'):-len('.json')])
+    except ValueError:
+        return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def mark_process_dead(pid):
+    """Drops the totals of a process that exited, from gunicorn's child_exit."""
+    directory = _metrics_dir()
+    if directory:
+        _unlink(_metrics_file(directory, pid))
+
+
+def clear_dir():
+    """Removes every process's totals, from gunicorn's on_starting."""
+    directory = _metrics_dir()
+    if not directory or not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if _file_pid(filename) is not None or filename.startswith('.metrics.'):
+            _unlink(os.path.join(directory, filename))
+
+
+def _maybe_flush():
+    if _metrics_dir() and time.monotonic() - _flushed_at >= FLUSH_INTERVAL:
+        try:
+            flush()
+        except OSError:
+            # metrics must never fail the request that produced them
+            pass
+
+
+def _collect():
+    # name -> {label values: value}, over every process when there is a directory
+    directory = _metrics_dir()
+    if not directory:
+        with _lock:
+            return {name: dict(metric.values) for name, metric in _metrics.items()}
+    flush()
+    totals = {name: {} for name in _metrics}
+    for filename in os.listdir(directory):
+        pid = _file_pid(filename)
+        if pid is None:
+            continue
+        if not _alive(pid):
+            # an exited process gunicorn did not reap, or a later pid reuse
+            # would carry its counters on
+            _unlink(os.path.join(directory, filename))
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, entries in snapshot.items():
+            metric = _metrics.get(name)
+            if metric is None:
+                continue
+            for key, value in entries:
+                metric.merge(totals[name], tuple(key), value)
+    return totals
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, values in _collect().items():
+        metric = _metrics[name]
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        for sample, labels, value in metric.samples(values):
+            if labels:
+                label_text = ','.join(f'{label}="{_escape(text)}"' for label, text in labels.items())
+                lines.append(f'{sample}{{{label_text}}} {_format_value(value)}')
+            else:
+                lines.append(f'{sample} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,212 @@
+# backend/SafeLedger/middleware.py
+import cProfile
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from .metrics import REQUEST_SECONDS
+from .profiling import QueryRecorder, dump_stats, write_record
+
+
+def view_label(request):
+    # the URL name, not the path, so ids in URLs do not add label values
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match._func_path
+
+
+class _StreamEnd:
+    # calls callback once, after the last chunk or when the server closes the
+    # response early; the async variant below serves the async views
+    def __init__(self, content, callback):
+        self.content = content
+        self.callback = callback
+
+    def close(self):
+        callback, self.callback = self.callback, None
+        if callback is not None:
+            callback()
+
+
+class _SyncStreamEnd(_StreamEnd):
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.content)
+        except StopIteration:
+            self.close()
+            raise
+
+
+class _AsyncStreamEnd(_StreamEnd):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await anext(self.content)
+        except StopAsyncIteration:
+            self.close()
+            raise
+
+
+def on_response_sent(response, callback):
+    """
+    Calls callback() once the response is done: right away, or for a
+    streaming response (the exports) once its body has been consumed, since
+    that is when its queries run.
+    """
+    if not response.streaming:
+        callback()
+        return
+    content = response.streaming_content
+    if response.is_async:
+        response.streaming_content = _AsyncStreamEnd(aiter(content), callback)
+    else:
+        response.streaming_content = _SyncStreamEnd(iter(content), callback)
+
+
+class MetricsMiddleware:
+    """
+    Records the latency of every request in safeledger_request_seconds, by
+    view name, method and status. Works for the sync and the async views;
+    streaming responses are timed until their last chunk.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        on_response_sent(response, lambda: self.observe(request, response, started))
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        on_response_sent(response, lambda: self.observe(request, response, started))
+        return response
+
+    def observe(self, request, response, started):
+        REQUEST_SECONDS.observe(time.perf_counter() - started, view=view_label(request),
+                                method=request.method, status=response.status_code)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a random PROFILE_SAMPLE_RATE share of the requests: wall time,
+    number of SQL queries and their time, written to the profiling log (see
+    profiling.py). A streaming response is measured until its body has been
+    consumed, which is when an export runs its queries. With PROFILE_CPROFILE a cProfile of the request is dumped
+    too; under ASGI it only sees the event loop thread, which other requests
+    share meanwhile. Off (and not in the stack at all) while the rate is 0.
+    """
+    sync_capable = True
+    async_capable = True
+
+    # only one cProfile can run in a process, concurrent requests skip it
+    _profiler_lock = threading.Lock()
+
+    def __init__(self, get_response):
+        self.rate = settings.PROFILE_SAMPLE_RATE
+        if self.rate <= 0:
+            raise MiddlewareNotUsed
+        self.directory = settings.PROFILE_DIR
+        self.cprofile = settings.PROFILE_CPROFILE
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.rate:
+            return self.get_response(request)
+        recorder, profile, measuring, started = self.start()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            measuring.close()
+            raise
+        self.finish(request, response, recorder, profile, measuring, started)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= self.rate:
+            return await self.get_response(request)
+        recorder, profile, measuring, started = self.start()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            measuring.close()
+            raise
+        self.finish(request, response, recorder, profile, measuring, started)
+        return response
+
+    def start(self):
+        profile = None
+        if self.cprofile and self._profiler_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # another profiler (a debugger, coverage) is active
+                self._profiler_lock.release()
+                profile = None
+        recorder = QueryRecorder()
+        measuring = ExitStack()
+        # the wrapper list lives on the connection of this request's context,
+        # which the views' sync_to_async calls share; it is left there until
+        # the response is done, see finish()
+        measuring.enter_context(connection.execute_wrapper(recorder))
+        measuring.callback(self.stop, profile)
+        return recorder, profile, measuring, time.perf_counter()
+
+    def stop(self, profile):
+        if profile is not None:
+            profile.disable()
+            self._profiler_lock.release()
+
+    def finish(self, request, response, recorder, profile, measuring, started):
+        def done():
+            measuring.close()
+            self.record(request, response, recorder, profile, started)
+        on_response_sent(response, done)
+
+    def record(self, request, response, recorder, profile, started):
+        wall = time.perf_counter() - started
+        view = view_label(request)
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'time': time.time(),
+            'view': view,
+            'route': match.route if match is not None else '',
+            'method': request.method,
+            'status': response.status_code,
+            'wall_ms': round(wall * 1000, 3),
+            'queries': recorder.queries,
+            'sql_ms': round(recorder.seconds * 1000, 3),
+        }
+        try:
+            if profile is not None:
+                record['profile'] = dump_stats(self.directory, view, profile)
+            write_record(self.directory, record)
+        except OSError:
+            # profiling must never fail the request it measured
+            pass
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('SafeLedger', '0006_retrainjob_retraintask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='retraintask',
+            name='fit_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
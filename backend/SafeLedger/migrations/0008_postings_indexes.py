@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 16:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('SafeLedger', '0007_retraintask_fit_seconds'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='postings',
+            index=models.Index(fields=['company', 'postDate', 'id'], name='postings_company_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postings',
+            index=models.Index(fields=['company', 'is_suspicious', 'postDate'], name='postings_company_susp_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postings',
+            index=models.Index(condition=models.Q(('is_suspicious', True)), fields=['company', 'postDate'], name='postings_suspicious_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postings',
+            index=models.Index(fields=['postDate'], name='postings_date_idx'),
+        ),
+    ]
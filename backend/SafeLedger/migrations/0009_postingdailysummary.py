@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-18 16:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def build_summaries(apps, schema_editor):
+    # Fill the rollup from the postings that already exist
+    Postings = apps.get_model('SafeLedger', 'Postings')
+    PostingDailySummary = apps.get_model('SafeLedger', 'PostingDailySummary')
+    rows = (
+        Postings.objects.values('company_id', 'postDate', 'accountHandleNumber', 'postCurrency')
+        .annotate(total=Sum('postAmount'), count=Count('id'),
+                  suspicious_count=Count('id', filter=Q(is_suspicious=True)))
+        .order_by()
+    )
+    PostingDailySummary.objects.bulk_create(
+        (PostingDailySummary(**row) for row in rows.iterator()), batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('SafeLedger', '0008_postings_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostingDailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('postDate', models.DateField()),
+                ('accountHandleNumber', models.IntegerField()),
+                ('postCurrency', models.CharField(max_length=100)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('count', models.IntegerField(default=0)),
+                ('suspicious_count', models.IntegerField(default=0)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='SafeLedger.company')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('company', 'postDate', 'accountHandleNumber', 'postCurrency'), name='posting_summary_unique_key')],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-18 16:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('SafeLedger', '0009_postingdailysummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModelTrainingState',
+            fields=[
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='training_state', serialize=False, to='SafeLedger.company')),
+                ('last_posting_id', models.BigIntegerField(default=0)),
+                ('rows', models.IntegerField(default=0)),
+                ('model_version', models.IntegerField(blank=True, null=True)),
+                ('updates_since_full', models.IntegerField(default=0)),
+                ('full_trained_at', models.DateTimeField(blank=True, null=True)),
+                ('trained_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='retrainjob',
+            name='mode',
+            field=models.CharField(choices=[('full', 'Full refit'), ('incremental', 'Incremental update')], default='full', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='retraintask',
+            name='mode',
+            field=models.CharField(choices=[('full', 'Full refit'), ('incremental', 'Incremental update')], default='full', max_length=20),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2 on 2026-10-18 16:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('SafeLedger', '0010_modeltrainingstate_retrain_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='modeltrainingstate',
+            name='sample_fraction',
+            field=models.FloatField(default=1.0),
+        ),
+        migrations.AddField(
+            model_name='modeltrainingstate',
+            name='sample_seed',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='modeltrainingstate',
+            name='sample_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='modeltrainingstate',
+            name='sampling',
+            field=models.CharField(blank=True, choices=[('uniform', 'Uniform'), ('time', 'Stratified by month')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='retrainjob',
+            name='sample_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='retrainjob',
+            name='sampling',
+            field=models.CharField(choices=[('uniform', 'Uniform'), ('time', 'Stratified by month')], default='uniform', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='retraintask',
+            name='sample_fraction',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='retraintask',
+            name='sample_seed',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='retraintask',
+            name='sample_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='retraintask',
+            name='sampling',
+            field=models.CharField(choices=[('uniform', 'Uniform'), ('time', 'Stratified by month')], default='uniform', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='retrainjob',
+            name='mode',
+            field=models.CharField(choices=[('full', 'Full refit'), ('incremental', 'Incremental update'), ('sampled', 'Refit on a sample')], default='full', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='retraintask',
+            name='mode',
+            field=models.CharField(choices=[('full', 'Full refit'), ('incremental', 'Incremental update'), ('sampled', 'Refit on a sample')], default='full', max_length=20),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('SafeLedger', '0011_sampled_retrain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postings',
+            name='anomaly_score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='postings',
+            name='model_version',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='postings',
+            index=models.Index(condition=models.Q(('anomaly_score__isnull', False)), fields=['company', 'anomaly_score', 'id'], name='postings_company_score_idx'),
+        ),
+    ]
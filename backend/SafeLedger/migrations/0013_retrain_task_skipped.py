@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('SafeLedger', '0012_postings_anomaly_score'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='retrainjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('skipped', 'Skipped')], default='queued', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='retraintask',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('skipped', 'Skipped')], default='queued', max_length=20),
+        ),
+    ]
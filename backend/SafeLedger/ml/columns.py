@@ -0,0 +1,10 @@
+# columns.py
+"""
+Posting columns the models read. Kept apart from features so the web
+process can name them without importing pandas (see dataset).
+"""
+
+FEATURE_COLUMNS = ('accountHandleNumber', 'postDate', 'postAmount', 'postCurrency', 'postDescription')
+
+# the two raw columns models trained before the pipeline were fitted on
+LEGACY_COLUMNS = ('accountHandleNumber', 'postAmount')
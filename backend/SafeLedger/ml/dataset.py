@@ -0,0 +1,176 @@
+# dataset.py
+import secrets
+from itertools import islice
+
+import numpy as np
+from django.db.models import Count, Max
+from django.db.models.functions import TruncMonth
+
+from ..models import Postings
+from .columns import FEATURE_COLUMNS
+from .training import TrainingSample
+
+
+def company_row_counts(company_ids=None):
+    """Number of postings per company, from a single GROUP BY query."""
+    qs = Postings.objects.all()
+    if company_ids is not None:
+        qs = qs.filter(company_id__in=company_ids)
+    rows = qs.values('company_id').annotate(n=Count('id')).order_by()
+    return {r['company_id']: r['n'] for r in rows}
+
+
+FRAME_COLUMNS = ('id', *FEATURE_COLUMNS)
+
+
+def _postings_frame(parts):
+    import pandas as pd
+    frame = pd.concat(parts, ignore_index=True)
+    frame['postAmount'] = frame['postAmount'].astype(float)
+    return frame
+
+
+def iter_company_frames(company_ids=None, chunk_size=10000):
+    """
+    Streams the id and FEATURE_COLUMNS of all postings ordered by company and
+    yields (company_id, DataFrame) once a company is complete, for the
+    feature pipeline. Only one chunk of rows and one company's postings are
+    held in memory at a time.
+    """
+    import pandas as pd
+
+    qs = Postings.objects.order_by('company_id', 'id').values_list('company_id', *FRAME_COLUMNS)
+    if company_ids is not None:
+        qs = qs.filter(company_id__in=company_ids)
+
+    rows = qs.iterator(chunk_size=chunk_size)
+    current, parts = None, []
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        frame = pd.DataFrame.from_records(chunk, columns=['company_id', *FRAME_COLUMNS])
+        cids = frame['company_id'].to_numpy(dtype=np.int64)
+        # Split the chunk wherever the company changes
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(cids)) + 1, [len(cids)]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            cid = int(cids[start])
+            if cid != current:
+                if current is not None:
+                    yield current, _postings_frame(parts)
+                current, parts = cid, []
+            parts.append(frame.iloc[start:end, 1:])
+    if current is not None:
+        yield current, _postings_frame(parts)
+
+
+def company_frame(company_id, after_id=0, up_to_id=None, limit=None):
+    """
+    One company's postings with after_id < id <= up_to_id, in the layout of
+    iter_company_frames. With a limit only the newest rows of the range are read.
+    """
+    import pandas as pd
+
+    qs = Postings.objects.filter(company_id=company_id, id__gt=after_id)
+    if up_to_id is not None:
+        qs = qs.filter(id__lte=up_to_id)
+    qs = qs.order_by('-id' if limit else 'id').values_list(*FRAME_COLUMNS)
+    if limit:
+        qs = qs[:limit]
+    return _postings_frame([pd.DataFrame.from_records(list(qs), columns=FRAME_COLUMNS)])
+
+
+def reservoir_sample(values, size, rng, chunk_size=10000):
+    """
+    Uniform random sample of up to size items from an iterator of unknown
+    length, holding only the sample in memory (reservoir sampling, Algorithm R,
+    applied a chunk at a time). Returns (sample array, number of items seen).
+    """
+    reservoir = np.empty(size, dtype=np.int64)
+    seen = 0
+    while chunk := list(islice(values, chunk_size)):
+        chunk = np.asarray(chunk, dtype=np.int64)
+        fill = min(max(size - seen, 0), len(chunk))
+        reservoir[seen:seen + fill] = chunk[:fill]
+        rest = chunk[fill:]
+        if len(rest):
+            # item number i replaces a random slot with probability size / (i + 1);
+            # of two items drawing the same slot the later one stays, like one at a time
+            slots = rng.integers(0, seen + fill + np.arange(len(rest)) + 1)
+            kept = slots < size
+            reservoir[slots[kept]] = rest[kept]
+        seen += len(chunk)
+    return reservoir[:min(seen, size)], seen
+
+
+def allocate(counts, size):
+    """Splits size over groups in proportion to their counts (largest remainder)."""
+    counts = np.asarray(counts, dtype=np.int64)
+    total = counts.sum()
+    if total <= size:
+        return counts
+    exact = counts * size / total
+    quotas = np.floor(exact).astype(np.int64)
+    quotas[np.argsort(quotas - exact)[:size - quotas.sum()]] += 1
+    return quotas
+
+
+def _time_stratified_ids(qs, size, rng, chunk_size):
+    # one stratum per calendar month; the GROUP BY gives each month's size up
+    # front, so the positions to keep are drawn before the single streaming pass
+    months = list(qs.annotate(month=TruncMonth('postDate')).values('month')
+                  .annotate(n=Count('id')).order_by('month').values_list('n', flat=True))
+    quotas = allocate(months, size)
+    offsets = np.concatenate(([0], np.cumsum(months)[:-1]))
+    wanted = np.sort(np.concatenate([
+        offset + rng.choice(count, quota, replace=False)
+        for offset, count, quota in zip(offsets, months, quotas)
+    ] or [np.empty(0, dtype=np.int64)]))
+
+    ids = qs.order_by('postDate', 'id').values_list('id', flat=True).iterator(chunk_size=chunk_size)
+    picked, position = [], 0
+    while chunk := list(islice(ids, chunk_size)):
+        start, end = np.searchsorted(wanted, [position, position + len(chunk)])
+        picked.append(np.asarray(chunk, dtype=np.int64)[wanted[start:end] - position])
+        position += len(chunk)
+    return np.concatenate(picked) if picked else np.empty(0, dtype=np.int64), sum(months)
+
+
+def sample_company_frame(company_id, size, sampling='uniform', seed=None, chunk_size=10000):
+    """
+    A random sample of at most size postings of one company, in the layout of
+    iter_company_frames, as a training.TrainingSample. Only posting ids are
+    streamed from the database to draw it, and only the sampled rows are read
+    in full, so the frame costs the same for any ledger size.
+
+    sampling is 'uniform' (reservoir sampling over the ids) or 'time', which
+    keeps every month's share of the postings. The sample is reproducible
+    from the seed, a random one when none is given.
+    """
+    import pandas as pd
+
+    if seed is None:
+        seed = secrets.randbits(32)
+    rng = np.random.default_rng(seed)
+    qs = Postings.objects.filter(company_id=company_id)
+    # postings added while sampling are left for the next retrain
+    last_posting_id = qs.aggregate(last=Max('id'))['last'] or 0
+    qs = qs.filter(id__lte=last_posting_id)
+    if sampling == 'time':
+        ids, population = _time_stratified_ids(qs, size, rng, chunk_size)
+    else:
+        ids, population = reservoir_sample(
+            qs.order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size), size, rng, chunk_size,
+        )
+
+    ids = np.sort(ids).tolist()
+    # id__in lists stay under the 999 parameters older SQLite builds allow
+    parts = [
+        pd.DataFrame.from_records(
+            list(Postings.objects.filter(id__in=ids[i:i + 900]).order_by('id').values_list(*FRAME_COLUMNS)),
+            columns=FRAME_COLUMNS,
+        )
+        for i in range(0, len(ids), 900)
+    ]
+    frame = _postings_frame(parts or [pd.DataFrame(columns=FRAME_COLUMNS)])
+    return TrainingSample(frame, sampling, size, seed, population, last_posting_id)
@@ -0,0 +1,213 @@
+# features.py
+"""
+Feature pipeline shared by training, online scoring and the backfill.
+
+A batch of postings (a DataFrame with FEATURE_COLUMNS) becomes one float
+matrix with:
+
+- the signed log amount and its z-score against the posting's account
+- the account's usual amount (a target encoding) and how rare the account is
+- the day of week as a point on a circle, and a month-end flag
+- how rare the posting's currency is
+- how rare its description is, by hashed description bucket
+
+Categories are encoded as a few numeric columns instead of one-hots, since
+an IsolationForest picks split features at random and dozens of sparse
+columns would leave the amount columns to a few percent of the splits.
+
+Every step is a NumPy/pandas operation over the whole batch. The fitted
+state is a plain dict of arrays (stored in the model artifact), so a
+posting gets the same features whether it is scored alone or in a batch
+of a million.
+"""
+import numpy as np
+import pandas as pd
+
+from .columns import FEATURE_COLUMNS, LEGACY_COLUMNS  # noqa: F401
+
+# bump when transform() changes, artifacts of another version are not used
+FEATURES_VERSION = 1
+
+FEATURE_NAMES = (
+    'amount', 'amount_z', 'account_amount', 'account_rarity',
+    'weekday_sin', 'weekday_cos', 'month_end',
+    'currency_rarity', 'description_rarity',
+)
+
+DESCRIPTION_BUCKETS = 1024
+
+
+def signed_log(amount):
+    # amounts span cents to millions in both directions
+    return np.sign(amount) * np.log1p(np.abs(amount))
+
+
+def legacy_features(frame):
+    """The [accountHandleNumber, postAmount] matrix of models without a pipeline."""
+    return np.column_stack([np.asarray(frame[name], dtype=float) for name in LEGACY_COLUMNS])
+
+
+def description_buckets(descriptions):
+    # numbers are dropped first, so "Faktura 1042" and "Faktura 1043" share a bucket;
+    # hash_array is seeded with a fixed key, so buckets are the same in every process
+    text = pd.Series(np.asarray(descriptions, dtype=object)).fillna('').astype(str)
+    text = text.str.lower().str.replace(r'\d+', '#', regex=True).str.strip()
+    return (pd.util.hash_array(text.to_numpy(dtype=object)) % DESCRIPTION_BUCKETS).astype(np.int64)
+
+
+def _lookup(keys, values, wanted, default):
+    # values[i] for keys[i] == wanted, default where wanted is not in keys (keys sorted)
+    if len(keys) == 0:
+        return np.full(len(wanted), default, dtype=float)
+    pos = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    return np.where(keys[pos] == wanted, values[pos], default)
+
+
+def _rarity(counts, rows):
+    return -np.log((counts + 1) / (rows + 1))
+
+
+def _counts(values):
+    keys, counts = np.unique(values, return_counts=True)
+    return keys, counts.astype(float)
+
+
+def _add_counts(keys, counts, new_keys, new_counts):
+    # union of two sorted key/count arrays, counts of shared keys added up
+    merged = pd.Series(counts, index=keys).add(pd.Series(new_counts, index=new_keys), fill_value=0)
+    return merged.index.to_numpy(dtype=keys.dtype if len(keys) else new_keys.dtype), merged.to_numpy(dtype=float)
+
+
+def _account_stats(accounts, amount):
+    stats = pd.DataFrame({'account': accounts, 'amount': amount}).groupby('account')['amount']
+    return stats.agg(['mean', 'std', 'count'])
+
+
+def _merge_stats(old, new):
+    """
+    Combines two per-group (mean, std, count) tables as if computed over
+    both sets of rows at once (Chan et al.'s parallel variance formula).
+    """
+    old, new = old.align(new, fill_value=0)
+    n = old['count'] + new['count']
+    delta = new['mean'] - old['mean']
+    mean = old['mean'] + delta * new['count'] / n
+    m2 = (old['std'].fillna(0) ** 2 * (old['count'] - 1).clip(lower=0)
+          + new['std'].fillna(0) ** 2 * (new['count'] - 1).clip(lower=0)
+          + delta ** 2 * old['count'] * new['count'] / n)
+    std = np.sqrt(m2 / (n - 1)).where(n > 1)
+    # groups only in one table keep their own statistics
+    mean = mean.where(old['count'] > 0, new['mean']).where(new['count'] > 0, old['mean'])
+    return pd.DataFrame({'mean': mean, 'std': std, 'count': n})
+
+
+class FeaturePipeline:
+    """
+    fit() learns the account, currency and description statistics of one
+    company; transform() turns postings into the model's feature matrix.
+    """
+
+    def __init__(self, state=None):
+        if state is not None and state.get('version') != FEATURES_VERSION:
+            raise ValueError(f"Feature pipeline version {state.get('version')} is not supported, "
+                             f"retrain the model (expected {FEATURES_VERSION}).")
+        self.state = state
+
+    def fit(self, frame):
+        accounts = np.asarray(frame['accountHandleNumber'], dtype=np.int64)
+        amount = signed_log(np.asarray(frame['postAmount'], dtype=float))
+        stats = _account_stats(accounts, amount)
+        currencies, currency_counts = _counts(np.asarray(frame['postCurrency'], dtype=str))
+        buckets, bucket_counts = _counts(description_buckets(frame['postDescription']))
+        self.state = {
+            'version': FEATURES_VERSION,
+            'rows': len(accounts),
+            # all keys are sorted, transform() looks them up with searchsorted
+            'accounts': stats.index.to_numpy(dtype=np.int64),
+            'account_mean': stats['mean'].to_numpy(dtype=float),
+            # NaN for accounts with a single posting, transform() uses the overall spread
+            'account_std': stats['std'].to_numpy(dtype=float),
+            'account_count': stats['count'].to_numpy(dtype=float),
+            'amount_mean': float(amount.mean()),
+            'amount_std': float(amount.std(ddof=1)) if len(amount) > 1 else 0.0,
+            'currencies': currencies,
+            'currency_count': currency_counts,
+            'description_buckets': buckets,
+            'description_count': bucket_counts,
+        }
+        return self
+
+    def partial_fit(self, frame):
+        """
+        Adds postings to the fitted statistics, as if fit() had seen them
+        too, without going back to the rows it was fitted on.
+        """
+        if self.state is None:
+            return self.fit(frame)
+        state = self.state
+        accounts = np.asarray(frame['accountHandleNumber'], dtype=np.int64)
+        amount = signed_log(np.asarray(frame['postAmount'], dtype=float))
+
+        old = pd.DataFrame({'mean': state['account_mean'], 'std': state['account_std'],
+                            'count': state['account_count']}, index=state['accounts'])
+        stats = _merge_stats(old, _account_stats(accounts, amount))
+        overall = _merge_stats(
+            pd.DataFrame({'mean': [state['amount_mean']], 'std': [state['amount_std']], 'count': [state['rows']]}),
+            pd.DataFrame({'mean': [amount.mean()], 'std': [amount.std(ddof=1) if len(amount) > 1 else np.nan],
+                          'count': [len(amount)]}),
+        ).iloc[0]
+        currencies, currency_counts = _add_counts(state['currencies'], state['currency_count'],
+                                                  *_counts(np.asarray(frame['postCurrency'], dtype=str)))
+        buckets, bucket_counts = _add_counts(state['description_buckets'], state['description_count'],
+                                             *_counts(description_buckets(frame['postDescription'])))
+        self.state = {
+            **state,
+            'rows': state['rows'] + len(accounts),
+            'accounts': stats.index.to_numpy(dtype=np.int64),
+            'account_mean': stats['mean'].to_numpy(dtype=float),
+            'account_std': stats['std'].to_numpy(dtype=float),
+            'account_count': stats['count'].to_numpy(dtype=float),
+            'amount_mean': float(overall['mean']),
+            'amount_std': float(overall['std']) if overall['count'] > 1 else 0.0,
+            'currencies': currencies,
+            'currency_count': currency_counts,
+            'description_buckets': buckets,
+            'description_count': bucket_counts,
+        }
+        return self
+
+    def transform(self, frame):
+        state = self.state
+        rows = state['rows']
+        accounts = np.asarray(frame['accountHandleNumber'], dtype=np.int64)
+        amount = signed_log(np.asarray(frame['postAmount'], dtype=float))
+
+        # accounts unseen in training get the company-wide mean and spread
+        mean = _lookup(state['accounts'], state['account_mean'], accounts, state['amount_mean'])
+        std = _lookup(state['accounts'], state['account_std'], accounts, np.nan)
+        std = np.where(np.isnan(std) | (std <= 1e-9), max(state['amount_std'], 1.0), std)
+        account_count = _lookup(state['accounts'], state['account_count'], accounts, 0.0)
+
+        dates = pd.DatetimeIndex(pd.to_datetime(np.asarray(frame['postDate'])))
+        angle = dates.dayofweek.to_numpy() * (2 * np.pi / 7)
+
+        currency_count = _lookup(state['currencies'], state['currency_count'],
+                                 np.asarray(frame['postCurrency'], dtype=str), 0.0)
+        description_count = _lookup(state['description_buckets'], state['description_count'],
+                                    description_buckets(frame['postDescription']), 0.0)
+
+        return np.column_stack([
+            amount, (amount - mean) / std, mean, _rarity(account_count, rows),
+            np.sin(angle), np.cos(angle), dates.is_month_end.astype(float),
+            _rarity(currency_count, rows), _rarity(description_count, rows),
+        ])
+
+    def fit_transform(self, frame):
+        return self.fit(frame).transform(frame)
+
+
+def model_features(pipeline, frame):
+    """Feature matrix for a model: its pipeline, or the legacy two columns without one."""
+    if pipeline is None:
+        return legacy_features(frame)
+    return pipeline.transform(frame)
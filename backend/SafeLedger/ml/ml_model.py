@@ -1,29 +1,326 @@
 # ml_model.py
-import pickle, os
-import numpy as np
+import os
+import logging
+import tempfile
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from ..metrics import MODEL_LOAD_SECONDS, SCORING_FALLBACKS, SCORING_SECONDS
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines, no cross-process locking
+    fcntl = None
+
+# joblib and sklearn are imported on first use so that importing this module
+# (and every Django view that uses it) stays cheap
+
+logger = logging.getLogger(__name__)
+
+
+class ModelNotFound(ValueError):
+    """The company has no usable anomaly model (none yet, or its artifact could not be loaded)."""
 
-# Load the dicts of scalers & models
 base = os.path.dirname(__file__)
-with open(os.path.join(base, 'models/scalers.pkl'), 'rb') as f:
-    scalers = pickle.load(f)
-with open(os.path.join(base, 'models/iso_forests.pkl'), 'rb') as f:
-    iso_forests = pickle.load(f)
+# SAFELEDGER_MODEL_DIR keeps benchmark and scratch models out of the real ones
+models_dir = os.environ.get('SAFELEDGER_MODEL_DIR', os.path.join(base, 'models'))
 
-def evaluate_posting(posting_data):
+class ModelRegistry:
     """
-    posting_data must include 'company_id', 'accountHandleNumber', 'postAmount'.
-    Returns True if anomalous, False otherwise.
+    One joblib artifact per company (company_<id>.joblib) holding its scaler,
+    IsolationForest and the fitted state of its feature pipeline (None for
+    models trained on the legacy two columns), plus how its training rows
+    were sampled (None when it saw every posting). Artifacts are loaded on
+    first use with mmap_mode='r', so the NumPy arrays inside them are shared
+    read-only between processes through the page cache, and saving a company
+    rewrites only its own file.
+
+    Every save or delete bumps the counter in the GENERATION file and the new
+    generation is stored in the artifact as its version. Processes read the
+    counter at most every check_interval seconds and, when it moved, drop
+    only the cached companies whose artifact changed.
+    """
+
+    def __init__(self, root, check_interval=None):
+        self.root = root
+        if check_interval is None:
+            check_interval = float(os.environ.get('SAFELEDGER_MODEL_CHECK_INTERVAL', '1.0'))
+        self.check_interval = check_interval
+        # company_id -> (file mtime, scaler, iso, version, features); mtime is None
+        # for in-memory models, scaler/iso are None when the artifact could not be loaded
+        self._cache = {}
+        self._generation = None
+        self._checked_at = None
+
+    def path(self, company_id):
+        return os.path.join(self.root, f'company_{company_id}.joblib')
+
+    def _mtime(self, company_id):
+        try:
+            return os.stat(self.path(company_id)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def generation(self):
+        try:
+            with open(os.path.join(self.root, 'GENERATION')) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    @contextmanager
+    def _bump_generation(self):
+        # Held while an artifact is replaced, so the counter only moves once
+        # the new file is in place; yields the generation being written
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, 'GENERATION'), 'a+') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                generation = int(f.read() or 0) + 1
+                yield generation
+                f.seek(0)
+                f.truncate()
+                f.write(str(generation))
+                f.flush()
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def refresh(self, force=False):
+        """Evicts cached companies whose artifact changed since they were loaded."""
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        generation = self.generation()
+        if generation == self._generation:
+            return
+        for company_id, cached in list(self._cache.items()):
+            if cached[0] is not None and cached[0] != self._mtime(company_id):
+                self._cache.pop(company_id, None)
+        self._generation = generation
+
+    def _entry(self, company_id):
+        self.refresh()
+        cached = self._cache.get(company_id)
+        if cached is None:
+            mtime = self._mtime(company_id)
+            if mtime is None:
+                return None
+            cached = (mtime, *self._load(company_id))
+            # a single dict assignment, so other threads see the old or new model
+            self._cache[company_id] = cached
+        return cached
+
+    def get(self, company_id):
+        """Returns (scaler, iso) for the company, or None if it has no model."""
+        model = self.model(company_id)
+        return model[:2] if model is not None else None
+
+    def model(self, company_id):
+        """(scaler, iso, FeaturePipeline or None for legacy models), or None."""
+        model = self.versioned_model(company_id)
+        return model[:3] if model is not None else None
+
+    def versioned_model(self, company_id):
+        """model() plus its version(), read from the same cache entry, or None."""
+        cached = self._entry(company_id)
+        if cached is None or cached[1] is None:
+            return None
+        return cached[1], cached[2], cached[4], cached[3]
+
+    def version(self, company_id):
+        """Generation at which the company's model was saved, None without a model."""
+        cached = self._entry(company_id)
+        return cached[3] if cached is not None and cached[1] is not None else None
+
+    def _load(self, company_id):
+        import joblib
+        from .features import FeaturePipeline
+        try:
+            with MODEL_LOAD_SECONDS.time(company=company_id):
+                artifact = joblib.load(self.path(company_id), mmap_mode='r')
+                state = artifact.get('features')
+                features = FeaturePipeline(state) if state is not None else None
+            return artifact['scaler'], artifact['iso'], artifact.get('version'), features
+        except Exception:
+            # A broken artifact (or one from another pipeline version) must not
+            # take the request down; the company is treated as having no model
+            # until it is retrained
+            logger.exception("Could not load anomaly model for company %s", company_id)
+            return None, None, None, None
+
+    def load_for_update(self, company_id):
+        """
+        A private copy of the company's model for training code to modify:
+        read fully into memory (no mmap) and never cached.
+        Returns (scaler, iso, features, version), or None without a usable artifact.
+        """
+        import joblib
+        from .features import FeaturePipeline
+        try:
+            artifact = joblib.load(self.path(company_id))
+            state = artifact.get('features')
+            features = FeaturePipeline(state) if state is not None else None
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.exception("Could not load anomaly model for company %s", company_id)
+            return None
+        return artifact['scaler'], artifact['iso'], features, artifact.get('version')
+
+    def save(self, company_id, scaler, iso, features=None, sample=None):
+        import joblib
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=f'.company_{company_id}.')
+        os.close(fd)
+        try:
+            with self._bump_generation() as version:
+                joblib.dump({'company_id': company_id, 'version': version,
+                             'scaler': scaler, 'iso': iso,
+                             'features': features.state if features is not None else None,
+                             'sample': sample}, tmp)
+                # readers either see the old or the new file, never a partial one
+                os.replace(tmp, self.path(company_id))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self._cache.pop(company_id, None)
+        return version
+
+    def delete(self, company_id):
+        with self._bump_generation():
+            try:
+                os.unlink(self.path(company_id))
+            except FileNotFoundError:
+                pass
+        self._cache.pop(company_id, None)
+
+    def put(self, company_id, scaler, iso, features=None):
+        """Uses a model in this process only, without writing an artifact."""
+        self._cache[company_id] = (None, scaler, iso, None, features)
+
+    def company_ids(self):
+        names = os.listdir(self.root) if os.path.isdir(self.root) else []
+        ids = (name[len('company_'):-len('.joblib')] for name in names
+               if name.startswith('company_') and name.endswith('.joblib'))
+        return sorted(int(cid) for cid in ids if cid.isdigit())
+
+    def import_legacy(self, scalers_path, forests_path):
+        """Splits the old scalers.pkl / iso_forests.pkl dicts into per-company artifacts."""
+        import joblib
+        legacy_scalers = joblib.load(scalers_path)
+        legacy_forests = joblib.load(forests_path)
+        imported = []
+        for company_id, scaler in legacy_scalers.items():
+            if company_id in legacy_forests:
+                self.save(company_id, scaler, legacy_forests[company_id])
+                imported.append(company_id)
+        return imported
+
+registry = ModelRegistry(models_dir)
+
+def warm_up(company_ids=None):
+    """
+    Imports sklearn and loads the artifacts ahead of the first request.
+    Meant to run in each worker after fork (see gunicorn.conf.py).
+    Returns the number of companies with a usable model.
+    """
+    import sklearn.ensemble, sklearn.preprocessing  # noqa: F401
+    from . import features  # noqa: F401  (pandas)
+    if company_ids is None:
+        company_ids = registry.company_ids()
+    return sum(registry.get(cid) is not None for cid in company_ids)
+
+def save_model(company_id, scaler, iso, features=None, sample=None):
+    return registry.save(company_id, scaler, iso, features, sample)
+
+def delete_model(company_id):
+    registry.delete(company_id)
+
+def load_model_for_update(company_id):
+    return registry.load_for_update(company_id)
+
+# score_postings() result. suspicious (bool), anomaly_score
+# (IsolationForest.score_samples, lower is more anomalous, NaN where not
+# scored) and scored (False for rows of companies without a usable model) are
+# aligned with the input rows; versions maps each scored company to the
+# version of the model that scored it (None for in-memory models)
+Scores = namedtuple('Scores', ['suspicious', 'anomaly_score', 'scored', 'versions'])
+
+def score_company(company_id, postings):
+    """
+    postings is a DataFrame (or dict of columns) with the FEATURE_COLUMNS of
+    features.py, all rows belonging to company_id. The whole batch goes
+    through the company's feature pipeline and one transform/score_samples
+    call. Returns (suspicious, anomaly_score, model version).
+    Raises ModelNotFound when the company has no usable model.
     """
-    cid = posting_data['company_id']
-    if cid not in scalers:
+    model = registry.versioned_model(company_id)
+    if model is None:
         # Fallback: no model for this company
-        raise ValueError(f"No anomaly model for company {cid}")
+        raise ModelNotFound(f"No anomaly model for company {company_id}")
 
-    scaler = scalers[cid]
-    iso    = iso_forests[cid]
+    from .features import model_features
+    scaler, iso, features, version = model
+    with SCORING_SECONDS.time(company=company_id):
+        Xs = scaler.transform(model_features(features, postings))
+        scores = iso.score_samples(Xs)
+        # the same threshold as iso.predict(), without scoring the rows twice
+        return scores - iso.offset_ < 0, scores, version
 
-    features = np.array([[posting_data['accountHandleNumber'],
-                          posting_data['postAmount']]])
-    Xs = scaler.transform(features)
-    pred = iso.predict(Xs)
-    return pred[0] == -1
+def score_postings(postings):
+    """
+    Scores postings of any number of companies: a DataFrame or dict of
+    columns (arrays or lists) with company_id and the FEATURE_COLUMNS. Rows
+    are grouped by company and each group is scored with one
+    score_company() call. Returns Scores aligned with the input order.
+    Rows of companies without a usable model are counted in
+    safeledger_scoring_fallbacks_total and left unflagged; any other error
+    from scoring propagates.
+    """
+    import numpy as np
+    import pandas as pd
+
+    frame = postings if isinstance(postings, pd.DataFrame) else pd.DataFrame(postings)
+    suspicious = np.zeros(len(frame), dtype=bool)
+    anomaly_score = np.full(len(frame), np.nan)
+    scored = np.zeros(len(frame), dtype=bool)
+    versions = {}
+    if not len(frame):
+        return Scores(suspicious, anomaly_score, scored, versions)
+
+    company_ids = frame['company_id'].to_numpy(dtype=np.int64)
+    # a stable sort keeps each company's rows in input order
+    order = np.argsort(company_ids, kind='stable')
+    starts = np.flatnonzero(np.diff(company_ids[order])) + 1
+    for rows in np.split(order, starts):
+        company_id = int(company_ids[rows[0]])
+        try:
+            flags, scores, versions[company_id] = score_company(company_id, frame.take(rows))
+        except ModelNotFound as e:
+            SCORING_FALLBACKS.inc(len(rows), company=company_id, reason=type(e).__name__)
+            continue
+        suspicious[rows] = flags
+        anomaly_score[rows] = scores
+        scored[rows] = True
+    return Scores(suspicious, anomaly_score, scored, versions)
+
+def evaluate_postings(company_id, postings):
+    """
+    Boolean array, True where a posting of company_id is anomalous.
+    Raises ModelNotFound when the company has no usable model.
+    """
+    return score_company(company_id, postings)[0]
+
+def evaluate_posting(posting_data):
+    """
+    posting_data must include 'company_id' and the FEATURE_COLUMNS.
+    Returns True if anomalous, False otherwise.
+    """
+    import pandas as pd
+    return bool(evaluate_postings(posting_data['company_id'], pd.DataFrame([posting_data]))[0])
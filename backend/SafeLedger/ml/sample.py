@@ -1,4 +1,9 @@
-from ml_model import evaluate_posting
+import os
+import sys
+
+# import through the SafeLedger package, the ml modules use relative imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from SafeLedger.ml.ml_model import score_postings
 
 samples = [
 
@@ -38,10 +43,11 @@ samples = [
 ]
 
 if __name__ == "__main__":
-    for p in samples:
-        try:
-            is_anom = evaluate_posting(p)
-            status = "SUSPICIOUS" if is_anom else "normal"
-            print(f"Company {p['company_id']}: {p['postDescription']} -> {status}")
-        except Exception as e:
-            print(f"Error evaluating posting for company {p['company_id']}: {e}")
+    # all samples in one call, grouped by company inside score_postings
+    scores = score_postings({column: [p[column] for p in samples] for column in samples[0]})
+    for p, is_anom, score, scored in zip(samples, scores.suspicious, scores.anomaly_score, scores.scored):
+        if not scored:
+            print(f"Company {p['company_id']}: {p['postDescription']} -> no model")
+            continue
+        status = "SUSPICIOUS" if is_anom else "normal"
+        print(f"Company {p['company_id']}: {p['postDescription']} -> {status} (score {score:.3f})")
@@ -1,31 +1,33 @@
 # train_model.py
-import pandas as pd
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
-import pickle
 import os
+import pandas as pd
+import sys
+
+# import through the SafeLedger package, the ml modules use relative imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from SafeLedger.ml.features import FEATURE_COLUMNS
+from SafeLedger.ml.ml_model import ModelRegistry
+from SafeLedger.ml.training import fit_companies
 
 data = pd.read_csv('backend/SafeLedger/ml/posting.csv', sep=';', encoding='latin1')
 data['postDate'] = pd.to_datetime(data['postDate'], format='%d-%m-%Y', errors='coerce')
+data['postDescription'] = data['postDescription'].fillna('')
 
-scalers = {}
-models  = {}
-
-for cid, group in data.groupby('company_id'):
-    X = group[['accountHandleNumber', 'postAmount']]
-    scaler = StandardScaler().fit(X)
-    Xs = scaler.transform(X)
-
-    iso = IsolationForest(contamination=0.05, random_state=42).fit(Xs)
+# Optional worker count: python train_model.py [workers]
+workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
 
-    scalers[cid] = scaler
-    models[cid]  = iso
+registry = ModelRegistry('backend/SafeLedger/ml/models')
 
-# Save the two dicts
-os.makedirs('models', exist_ok=True)
-with open('backend/SafeLedger/ml/models/scalers.pkl', 'wb') as f:
-    pickle.dump(scalers, f)
-with open('backend/SafeLedger/ml/models/iso_forests.pkl', 'wb') as f:
-    pickle.dump(models, f)
+datasets = (
+    (cid, group[list(FEATURE_COLUMNS)])
+    for cid, group in data.groupby('company_id')
+)
+for result in fit_companies(datasets, workers=workers):
+    if result.error:
+        print(f"Company {result.company_id}: failed ({result.error})")
+        continue
+    # one artifact per company
+    registry.save(result.company_id, result.scaler, result.iso, result.features)
+    print(f"Company {result.company_id}: {result.rows} rows in {result.seconds:.2f}s")
 
 print("Trained and saved per-company models.")
@@ -0,0 +1,153 @@
+# training.py
+import os
+import time
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+
+
+FitResult = namedtuple('FitResult', ['company_id', 'scaler', 'iso', 'features', 'rows', 'seconds', 'error', 'mode'])
+
+# An incremental update of a trained model: the postings added since it was
+# trained, a bounded sample of the ones before, and the share of trees to replace
+ModelUpdate = namedtuple('ModelUpdate', ['scaler', 'iso', 'features', 'new', 'reference', 'replace_fraction'])
+
+
+class TrainingSample(namedtuple('TrainingSample', ['frame', 'sampling', 'size', 'seed', 'population', 'last_posting_id'])):
+    """
+    Postings drawn at random from a company's ledger (see dataset.sample_company_frame):
+    population rows with id <= last_posting_id, of which the frame holds up to size.
+    """
+
+    @property
+    def fraction(self):
+        return len(self.frame) / self.population if self.population else 1.0
+
+    def info(self):
+        # stored in the model artifact next to its version
+        return {'sampling': self.sampling, 'size': self.size, 'seed': self.seed, 'rows': len(self.frame),
+                'population': self.population, 'fraction': self.fraction}
+
+
+def fit_company_model(data, n_jobs=None):
+    """
+    Fits the feature pipeline, scaler and IsolationForest for one company.
+    data is a DataFrame of postings (features.FEATURE_COLUMNS), or an already
+    built feature matrix, in which case no pipeline is returned.
+    Returns (scaler, iso, features).
+    """
+    # imported here so web processes that only enqueue retrains never load sklearn
+    from sklearn.ensemble import IsolationForest
+    from sklearn.preprocessing import StandardScaler
+
+    if isinstance(data, np.ndarray):
+        features, X = None, data
+    else:
+        from .features import FeaturePipeline
+        features = FeaturePipeline()
+        X = features.fit_transform(data)
+    scaler = StandardScaler().fit(X)
+    iso = IsolationForest(contamination=0.05, random_state=42, n_jobs=n_jobs).fit(scaler.transform(X))
+    return scaler, iso, features
+
+
+def update_company_model(update, n_jobs=None):
+    """
+    Brings a trained model up to date without refitting it on all history:
+
+    - the feature pipeline statistics and the scaler absorb the new postings
+      (partial_fit)
+    - the oldest replace_fraction of the trees are dropped, and as many new
+      ones are grown in a separate forest on the new postings plus the
+      reference sample, with the max_samples of the kept trees so every
+      tree is normalised by the same average path length
+    - the contamination threshold (offset_) of the merged forest is
+      recomputed on that same data
+
+    When a tree would sample a different number of rows than the kept ones,
+    the company has fewer than 256 postings, so the new postings and the
+    reference sample are its whole ledger and the forest is refitted on them.
+    Returns (scaler, iso, features); the scaler and pipeline in update are
+    modified in place.
+    """
+    import pandas as pd
+    from sklearn.ensemble import IsolationForest
+
+    scaler, iso, features = update.scaler, update.iso, update.features
+    features.partial_fit(update.new)
+    X = features.transform(pd.concat([update.new, update.reference], ignore_index=True))
+    scaler.partial_fit(features.transform(update.new))
+    Xs = scaler.transform(X)
+
+    # a different seed per update, or the new trees would repeat the last ones
+    seed = (iso.random_state or 0) + int(scaler.n_samples_seen_)
+    params = dict(contamination=iso.contamination, max_features=iso.max_features, n_jobs=n_jobs)
+    max_samples = min(256, len(Xs)) if iso.max_samples == 'auto' else iso.max_samples_
+    if max_samples != iso.max_samples_:
+        fresh = IsolationForest(n_estimators=iso.n_estimators, random_state=seed, **params).fit(Xs)
+        return scaler, fresh, features
+
+    replaced = max(1, round(len(iso.estimators_) * update.replace_fraction))
+    fresh = IsolationForest(n_estimators=replaced, max_samples=iso.max_samples_, random_state=seed,
+                            **params).fit(Xs)
+    # every per-tree attribute is kept in step, score_samples zips them; the
+    # estimators_samples_ of the kept trees index rows of their own fit
+    iso.estimators_ = iso.estimators_[replaced:] + fresh.estimators_
+    iso.estimators_features_ = iso.estimators_features_[replaced:] + fresh.estimators_features_
+    iso._seeds = np.concatenate([iso._seeds[replaced:], fresh._seeds])
+    iso._average_path_length_per_tree = (tuple(iso._average_path_length_per_tree[replaced:])
+                                         + tuple(fresh._average_path_length_per_tree))
+    iso._decision_path_lengths = tuple(iso._decision_path_lengths[replaced:]) + tuple(fresh._decision_path_lengths)
+    iso._n_samples = fresh._n_samples
+    if iso.contamination != 'auto':
+        iso.offset_ = np.percentile(iso.score_samples(Xs), 100.0 * iso.contamination)
+    return scaler, iso, features
+
+
+def _timed_fit(company_id, data, n_jobs):
+    # Errors are returned instead of raised so one bad company does not
+    # cancel the rest of the pool
+    started = time.perf_counter()
+    if isinstance(data, ModelUpdate):
+        mode, rows, fit = 'incremental', len(data.new), update_company_model
+    elif isinstance(data, TrainingSample):
+        mode, rows, fit, data = 'sampled', len(data.frame), fit_company_model, data.frame
+    else:
+        mode, rows, fit = 'full', len(data), fit_company_model
+    try:
+        scaler, iso, features = fit(data, n_jobs=n_jobs)
+    except Exception as e:
+        return FitResult(company_id, None, None, None, rows, time.perf_counter() - started, str(e), mode)
+    return FitResult(company_id, scaler, iso, features, rows, time.perf_counter() - started, None, mode)
+
+
+def default_workers():
+    return int(os.environ.get('SAFELEDGER_TRAIN_WORKERS', os.cpu_count() or 1))
+
+
+def fit_companies(datasets, workers=None, n_jobs=1):
+    """
+    Fits independent companies in parallel worker processes.
+    datasets is an iterable of (company_id, postings frame, feature matrix,
+    TrainingSample or ModelUpdate). It is read in the calling
+    thread a few companies at a time, so a streaming database source keeps
+    only about 2 * workers matrices in flight. n_jobs is passed to each
+    IsolationForest; keep it at 1 when workers already fill the cores.
+    Yields a FitResult per company in completion order.
+    """
+    workers = workers or default_workers()
+    if workers == 1:
+        for company_id, data in datasets:
+            yield _timed_fit(company_id, data, n_jobs)
+        return
+
+    from joblib import Parallel, delayed
+
+    datasets = iter(datasets)
+    with Parallel(n_jobs=workers, return_as='generator_unordered') as parallel:
+        while True:
+            batch = list(islice(datasets, 2 * workers))
+            if not batch:
+                break
+            yield from parallel(delayed(_timed_fit)(company_id, data, n_jobs) for company_id, data in batch)
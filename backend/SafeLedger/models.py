@@ -36,7 +36,122 @@ class Postings(models.Model):
     postDescription = models.CharField(max_length=100)
 
     is_suspicious = models.BooleanField(default=False)
+    # IsolationForest.score_samples of the posting, lower is more anomalous, and
+    # the version of the company model that scored it; None until scored
+    anomaly_score = models.FloatField(null=True, blank=True)
+    model_version = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # company ledger pages and date ranges, ordered like the keyset pagination
+            models.Index(fields=['company', 'postDate', 'id'], name='postings_company_date_idx'),
+            # anomaly review filtered on the flag
+            models.Index(fields=['company', 'is_suspicious', 'postDate'], name='postings_company_susp_date_idx'),
+            # only the few suspicious rows, for review queues
+            models.Index(fields=['company', 'postDate'], condition=models.Q(is_suspicious=True),
+                         name='postings_suspicious_idx'),
+            # admin date_hierarchy and date filters across all companies
+            models.Index(fields=['postDate'], name='postings_date_idx'),
+            # top-N review, most anomalous first, of the scored postings
+            models.Index(fields=['company', 'anomaly_score', 'id'], condition=models.Q(anomaly_score__isnull=False),
+                         name='postings_company_score_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
-    
\ No newline at end of file
+    
+class PostingDailySummary(models.Model):
+    # Rollup of one company's postings per day, account and currency, kept up
+    # to date by SafeLedger.summaries whenever postings are written
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    postDate = models.DateField()
+    accountHandleNumber = models.IntegerField()
+    postCurrency = models.CharField(max_length=100)
+    total = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+    suspicious_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'postDate', 'accountHandleNumber', 'postCurrency'],
+                                    name='posting_summary_unique_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.company_id} {self.postDate} {self.accountHandleNumber} {self.postCurrency}"
+
+class RetrainJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('skipped', 'Skipped'),
+    ]
+    MODE_CHOICES = [
+        ('full', 'Full refit'),
+        ('incremental', 'Incremental update'),
+        ('sampled', 'Refit on a sample'),
+    ]
+    SAMPLING_CHOICES = [
+        ('uniform', 'Uniform'),
+        ('time', 'Stratified by month'),
+    ]
+
+    # No company means a full retrain of every company
+    company = models.ForeignKey(Company, null=True, blank=True, on_delete=models.CASCADE)
+    requested_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES, default='full')
+    # rows drawn per company by a sampled refit
+    sample_size = models.PositiveIntegerField(null=True, blank=True)
+    sampling = models.CharField(max_length=20, choices=SAMPLING_CHOICES, default='uniform')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Retrain job {self.id} ({self.status})"
+
+class RetrainTask(models.Model):
+    # One company retrain inside a job, claimed by exactly one worker
+    job = models.ForeignKey(RetrainJob, related_name='tasks', on_delete=models.CASCADE)
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=RetrainJob.STATUS_CHOICES, default='queued')
+    # requested mode; once done, the mode that ran (incremental can fall back to full)
+    mode = models.CharField(max_length=20, choices=RetrainJob.MODE_CHOICES, default='full')
+    sample_size = models.PositiveIntegerField(null=True, blank=True)
+    sampling = models.CharField(max_length=20, choices=RetrainJob.SAMPLING_CHOICES, default='uniform')
+    # share of the company's postings a sampled refit was trained on, and the seed it drew them with
+    sample_fraction = models.FloatField(null=True, blank=True)
+    sample_seed = models.BigIntegerField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    rows = models.IntegerField(default=0)
+    fit_seconds = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Retrain task {self.id} for company {self.company_id} ({self.status})"
+
+class ModelTrainingState(models.Model):
+    # What a company's current model was trained on, so an incremental
+    # retrain only has to read the postings added after last_posting_id
+    company = models.OneToOneField(Company, primary_key=True, related_name='training_state',
+                                   on_delete=models.CASCADE)
+    last_posting_id = models.BigIntegerField(default=0)
+    rows = models.IntegerField(default=0)
+    # registry version of the artifact this state belongs to
+    model_version = models.IntegerField(null=True, blank=True)
+    updates_since_full = models.IntegerField(default=0)
+    # how a sampled refit drew its rows; sample_size is None after a refit on every posting
+    sample_size = models.PositiveIntegerField(null=True, blank=True)
+    sampling = models.CharField(max_length=20, choices=RetrainJob.SAMPLING_CHOICES, blank=True)
+    sample_fraction = models.FloatField(default=1.0)
+    sample_seed = models.BigIntegerField(null=True, blank=True)
+    full_trained_at = models.DateTimeField(null=True, blank=True)
+    trained_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Training state of company {self.company_id} (up to posting {self.last_posting_id})"
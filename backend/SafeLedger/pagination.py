@@ -0,0 +1,106 @@
+# backend/SafeLedger/pagination.py
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class PostingsKeysetPagination(BasePagination):
+    """
+    Cursor pagination on (postDate, id). The cursor holds the last row of the
+    previous page, so every page is a `WHERE (postDate, id) > (...) LIMIT n`
+    query that costs the same no matter how deep into the ledger it is.
+
+    Pagination is opt-in: requests without ?cursor= or ?page_size= still get
+    the plain list the dashboard expects.
+    """
+    ordering = ('postDate', 'id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 500
+    max_page_size = 5000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.take_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset() for async views, reads the page with the async ORM."""
+        queryset = self.page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.take_page([row async for row in queryset])
+
+    def page_queryset(self, queryset, request):
+        # the unevaluated query for the requested page, None when not paginating
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            last_date, last_id = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(postDate__gt=last_date) | Q(postDate=last_date, id__gt=last_id)
+            )
+
+        # one extra row tells us whether there is a next page
+        return queryset[:self.page_size + 1]
+
+    def take_page(self, rows):
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, row):
+        raw = json.dumps([row.postDate.isoformat(), row.id]).encode()
+        return urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            post_date, post_id = json.loads(raw)
+            return date.fromisoformat(post_date), int(post_id)
+        except (ValueError, TypeError):
+            raise NotFound("Invalid cursor.")
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_paginated_data(self, data):
+        return {'next': self.get_next_link(), 'results': data}
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
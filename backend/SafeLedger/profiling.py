@@ -0,0 +1,117 @@
+# backend/SafeLedger/profiling.py
+"""
+Records of sampled requests written by ProfilingMiddleware, and the
+summary the profile_summary command prints from them.
+
+Each process appends one JSON line per sampled request to
+<PROFILE_DIR>/requests-<pid>.jsonl, rotated at PROFILE_MAX_BYTES with
+PROFILE_BACKUPS old files kept; one file per process, so gunicorn workers
+never rotate a file another one is writing. With cProfile enabled, the
+stats of each profiled request are dumped next to it as
+<view>-<timestamp>.prof, for `python -m pstats`.
+"""
+import glob
+import json
+import logging
+import os
+import re
+import time
+from logging.handlers import RotatingFileHandler
+
+PROFILE_MAX_BYTES = 10 * 1024 * 1024
+PROFILE_BACKUPS = 5
+
+_loggers = {}
+
+
+class QueryRecorder:
+    """connection.execute_wrapper() that counts the queries of one request and their time."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - started
+
+
+def _logger(directory):
+    # a logger of its own per directory and process, so records never reach the root handlers
+    key = (directory, os.getpid())
+    logger = _loggers.get(key)
+    if logger is None:
+        os.makedirs(directory, exist_ok=True)
+        logger = logging.getLogger(f'safeledger.profiling.{len(_loggers)}')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handler = RotatingFileHandler(os.path.join(directory, f'requests-{os.getpid()}.jsonl'),
+                                      maxBytes=PROFILE_MAX_BYTES, backupCount=PROFILE_BACKUPS, delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.handlers = [handler]
+        _loggers[key] = logger
+    return logger
+
+
+def write_record(directory, record):
+    _logger(directory).info(json.dumps(record, separators=(',', ':')))
+
+
+def dump_stats(directory, view, profile):
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', view)
+    path = os.path.join(directory, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.prof')
+    profile.dump_stats(path)
+    return path
+
+
+def read_records(directory):
+    for path in sorted(glob.glob(os.path.join(directory, 'requests-*.jsonl*'))):
+        with open(path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # the tail of a line a worker was writing
+                    continue
+
+
+def summarize(records, views=None, since=None):
+    """
+    Per view: request count, p50/p95/max wall time, mean and max query
+    count, and the share of the wall time spent in SQL. Only views in
+    views (URL names) are kept when it is given, and only records at or
+    after the since timestamp.
+    """
+    # the middleware imports this module in every web process, numpy is only needed here
+    import numpy as np
+
+    by_view = {}
+    for record in records:
+        if views is not None and record['view'] not in views:
+            continue
+        if since is not None and record['time'] < since:
+            continue
+        by_view.setdefault(record['view'], []).append(record)
+
+    rows = []
+    for view, entries in by_view.items():
+        wall = np.array([entry['wall_ms'] for entry in entries])
+        queries = np.array([entry['queries'] for entry in entries])
+        sql = np.array([entry['sql_ms'] for entry in entries])
+        rows.append({
+            'view': view,
+            'route': entries[-1].get('route', ''),
+            'requests': len(entries),
+            'total_ms': float(wall.sum()),
+            'p50_ms': float(np.percentile(wall, 50)),
+            'p95_ms': float(np.percentile(wall, 95)),
+            'max_ms': float(wall.max()),
+            'mean_queries': float(queries.mean()),
+            'max_queries': int(queries.max()),
+            'sql_share': float(sql.sum() / wall.sum()) if wall.sum() else 0.0,
+        })
+    return rows
@@ -0,0 +1,83 @@
+# backend/SafeLedger/scoping.py
+"""
+Cached set of company ids each user may see. Accountants and customers are
+scoped to their companies; the set is read once per session (it is dropped
+on login) and kept in Django's cache, so views can filter on
+company_id IN (...) instead of joining through User.companies on every
+request. Any change to a user's companies clears their entry.
+"""
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from .models import Company, User
+
+SCOPED_ROLES = ("accountant", "customer")
+CACHE_TIMEOUT = 15 * 60
+
+
+def _cache_key(user_id):
+    return f"safeledger:companies:{user_id}"
+
+
+def allowed_company_ids(user):
+    """
+    frozenset of the company ids the user may see, or None when the role
+    sees every company. Memoised on the user object for the rest of the request.
+    """
+    if user.role not in SCOPED_ROLES:
+        return None
+    ids = getattr(user, "_allowed_company_ids", None)
+    if ids is None:
+        key = _cache_key(user.pk)
+        cached = cache.get(key)
+        if cached is None:
+            cached = list(user.companies.values_list("id", flat=True))
+            cache.set(key, cached, CACHE_TIMEOUT)
+        ids = user._allowed_company_ids = frozenset(cached)
+    return ids
+
+
+async def aallowed_company_ids(user):
+    """allowed_company_ids() for async views, through the async cache and ORM APIs."""
+    if user.role not in SCOPED_ROLES:
+        return None
+    ids = getattr(user, "_allowed_company_ids", None)
+    if ids is None:
+        key = _cache_key(user.pk)
+        cached = await cache.aget(key)
+        if cached is None:
+            cached = [pk async for pk in user.companies.values_list("id", flat=True)]
+            await cache.aset(key, cached, CACHE_TIMEOUT)
+        ids = user._allowed_company_ids = frozenset(cached)
+    return ids
+
+
+def invalidate(user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+
+
+@receiver(m2m_changed, sender=User.companies.through)
+def _companies_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # user.companies.add/remove/clear/set
+        if action in ("post_add", "post_remove", "post_clear"):
+            instance.__dict__.pop("_allowed_company_ids", None)
+            invalidate([instance.pk])
+    elif action in ("post_add", "post_remove"):
+        invalidate(pk_set)
+    elif action == "pre_clear":
+        # company.user_set.clear(): the users are only known before the clear
+        invalidate(instance.user_set.values_list("id", flat=True))
+
+
+@receiver(pre_delete, sender=Company)
+def _company_deleted(sender, instance, **kwargs):
+    # the cascade removes the m2m rows without sending m2m_changed
+    invalidate(instance.user_set.values_list("id", flat=True))
+
+
+@receiver(user_logged_in)
+def _logged_in(sender, user, **kwargs):
+    invalidate([user.pk])
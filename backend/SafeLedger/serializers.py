@@ -1,11 +1,44 @@
+import copy
+
+from django.db import transaction
 from rest_framework import serializers
-from .models import User, Postings, Company
-from .ml.ml_model import evaluate_posting
-from sklearn.exceptions import NotFittedError
+from .models import User, Postings, Company, RetrainJob, RetrainTask
+from .ml.ml_model import score_postings
+from .jobs import job_progress
+from .summaries import record_created, record_updated
+from .scoping import allowed_company_ids
+
+class ScopedCompanyField(serializers.PrimaryKeyRelatedField):
+    """
+    Company of a posting. Accountants and customers may only use their own
+    companies, which are checked against the cached allowed ids before the
+    row is loaded by primary key; an id that is still cached but deleted
+    since is reported like any unknown company.
+    """
+    def to_internal_value(self, data):
+        request = self.context.get('request')
+        allowed = allowed_company_ids(request.user) if request else None
+        if allowed is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in allowed:
+            raise serializers.ValidationError("You do not have access to this company.")
+        try:
+            return self.get_queryset().get(pk=pk)
+        except Company.DoesNotExist:
+            self.fail('does_not_exist', pk_value=pk)
 
 class PostingsSerializer(serializers.ModelSerializer):
+    company = ScopedCompanyField(queryset=Company.objects.all())
     postDate = serializers.DateField(format="%d-%m-%Y")
     is_suspicious = serializers.BooleanField(read_only=True)
+    anomaly_score = serializers.FloatField(read_only=True)
+    model_version = serializers.IntegerField(read_only=True)
     class Meta:
         model = Postings
         fields = [
@@ -17,23 +50,73 @@ class PostingsSerializer(serializers.ModelSerializer):
             'postCurrency',
             'postDescription',
             'is_suspicious',
+            'anomaly_score',
+            'model_version',
         ]
 
-    def create(self, validated_data):
-        posting = Postings.objects.create(**validated_data)
+    def __init__(self, *args, **kwargs):
+        # optional projection, e.g. PostingsSerializer(qs, many=True, fields=['id', 'postAmount'])
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    # the posting fields the anomaly model reads
+    SCORED_FIELDS = ('company', 'accountHandleNumber', 'postDate', 'postAmount', 'postCurrency', 'postDescription')
 
-        data = {
-            'company_id': posting.company.id,
-            'accountHandleNumber': posting.accountHandleNumber,
-            'postAmount': float(posting.postAmount),
+    def score(self, values):
+        """
+        Scores one posting given its field values and returns the flag, the
+        anomaly score and the model version to store; a company without a
+        usable model leaves it unflagged and unscored.
+        """
+        company_id = values['company'].id
+        scores = score_postings({
+            'company_id': [company_id],
+            'accountHandleNumber': [values['accountHandleNumber']],
+            'postDate': [values['postDate']],
+            'postAmount': [float(values['postAmount'])],
+            'postCurrency': [values['postCurrency']],
+            'postDescription': [values.get('postDescription', '')],
+        })
+        if not scores.scored[0]:
+            return {'is_suspicious': False, 'anomaly_score': None, 'model_version': None}
+        return {
+            'is_suspicious': bool(scores.suspicious[0]),
+            'anomaly_score': float(scores.anomaly_score[0]),
+            'model_version': scores.versions[company_id],
         }
-        try:
-            posting.is_suspicious = evaluate_posting(data)
-        except (ValueError, NotFittedError):
-            posting.is_suspicious = False
-        posting.save()
+
+    def create(self, validated_data):
+        # Score before the INSERT so each posting is written only once
+        validated_data.update(self.score(validated_data))
+        with transaction.atomic():
+            posting = Postings.objects.create(**validated_data)
+            record_created([posting])
+        return posting
+
+    def update(self, instance, validated_data):
+        old = copy.copy(instance)
+        values = {name: getattr(instance, name) for name in self.SCORED_FIELDS}
+        if any(validated_data.get(name, value) != value for name, value in values.items()):
+            # a stored score must describe the posting as it is now
+            validated_data.update(self.score({**values, **validated_data}))
+        with transaction.atomic():
+            posting = super().update(instance, validated_data)
+            record_updated(old, posting)
         return posting
 
+class SummaryTotalsSerializer(serializers.Serializer):
+    total = serializers.DecimalField(max_digits=18, decimal_places=2)
+    count = serializers.IntegerField()
+    suspicious_count = serializers.IntegerField()
+
+class PostingSummarySerializer(SummaryTotalsSerializer):
+    period = serializers.DateField()
+    accountHandleNumber = serializers.IntegerField()
+    postCurrency = serializers.CharField()
+
 class CompanySerializer(serializers.ModelSerializer):
     class Meta:
         model = Company
@@ -64,8 +147,9 @@ class CustomerSerializer(serializers.ModelSerializer):
         ]
 
     def get_company_name(self, obj):
-        first = obj.companies.first()
-        return first.companyName if first else None
+        # .all() uses the list views' prefetch; first() would query per user
+        companies = sorted(obj.companies.all(), key=lambda c: c.id)
+        return companies[0].companyName if companies else None
 
     def validate_username(self, value):
         # if User.objects.filter(username=value).exists():      CHANGED BECAUSE OF UNIQUE CONSTRAINT
@@ -154,4 +238,34 @@ class AccountantSerializer(serializers.ModelSerializer):
         user.save()
         user.companies.set(company_list)
         return user
-    
\ No newline at end of file
+
+class RetrainTaskSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RetrainTask
+        fields = [
+            'company', 'status', 'mode', 'rows', 'fit_seconds',
+            'sample_size', 'sampling', 'sample_fraction', 'sample_seed', 'error',
+        ]
+
+class RetrainJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+    tasks = RetrainTaskSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = RetrainJob
+        fields = [
+            'id',
+            'company',
+            'status',
+            'mode',
+            'sample_size',
+            'sampling',
+            'created_at',
+            'started_at',
+            'finished_at',
+            'progress',
+            'tasks',
+        ]
+
+    def get_progress(self, obj):
+        return job_progress(obj)
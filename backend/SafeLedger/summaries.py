@@ -0,0 +1,134 @@
+# backend/SafeLedger/summaries.py
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth, TruncYear
+
+from .models import PostingDailySummary, Postings
+
+SUMMARY_KEY = ('company_id', 'postDate', 'accountHandleNumber', 'postCurrency')
+SUMMARY_VALUES = ('total', 'count', 'suspicious_count')
+
+# ?group= on the summary endpoint -> expression the rows are grouped on
+PERIODS = {
+    'day': F('postDate'),
+    'month': TruncMonth('postDate'),
+    'year': TruncYear('postDate'),
+}
+
+
+def posting_deltas(postings, sign=1, deltas=None):
+    """
+    Adds (sign=1) or removes (sign=-1) postings from a dict of
+    summary key -> [total, count, suspicious_count] changes.
+    """
+    if deltas is None:
+        deltas = defaultdict(lambda: [Decimal(0), 0, 0])
+    for posting in postings:
+        row = deltas[tuple(getattr(posting, name) for name in SUMMARY_KEY)]
+        row[0] += sign * Decimal(posting.postAmount)
+        row[1] += sign
+        row[2] += sign if posting.is_suspicious else 0
+    return deltas
+
+
+def _add_to_summaries(rows):
+    """
+    One INSERT ... ON CONFLICT DO UPDATE per batch that adds the values of
+    (key..., total, count, suspicious_count) rows to the existing summary
+    rows, inserting the missing ones. SQLite 3.24+ and PostgreSQL both
+    understand it, the two backends settings.py can configure.
+    """
+    meta = PostingDailySummary._meta
+    fields = [meta.get_field(name) for name in (*SUMMARY_KEY, *SUMMARY_VALUES)]
+    qn = connection.ops.quote_name
+    table = qn(meta.db_table)
+    columns = [qn(field.column) for field in fields]
+    key, values = columns[:len(SUMMARY_KEY)], columns[len(SUMMARY_KEY):]
+    row_sql = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    batch_size = connection.ops.bulk_batch_size(fields, rows)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row_sql] * len(batch))} "
+                f"ON CONFLICT ({', '.join(key)}) DO UPDATE SET "
+                + ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in values),
+                [field.get_db_prep_value(value, connection)
+                 for row in batch for field, value in zip(fields, row)],
+            )
+
+
+def apply_deltas(deltas):
+    """
+    Adds summary changes to the existing rows in the database, so concurrent
+    writers add up instead of overwriting each other; a whole bulk import is
+    one statement per batch instead of one UPDATE per key. Rows whose last
+    posting is gone are removed.
+    """
+    rows = [(*key, *row) for key, row in deltas.items() if any(row)]
+    if not rows:
+        return
+    with transaction.atomic():
+        _add_to_summaries(rows)
+        company_ids = {row[0] for row in rows}
+        PostingDailySummary.objects.filter(company_id__in=company_ids, count__lte=0).delete()
+
+
+def record_created(postings):
+    apply_deltas(posting_deltas(postings))
+
+
+def record_deleted(postings):
+    apply_deltas(posting_deltas(postings, sign=-1))
+
+
+def record_updated(old, new):
+    deltas = posting_deltas([old], sign=-1)
+    apply_deltas(posting_deltas([new], deltas=deltas))
+
+
+def rebuild_summaries(company_ids=None):
+    """
+    Recomputes the rollup from the postings table with one GROUP BY, for
+    changes made outside the API (bulk flag updates, admin edits, raw SQL).
+    Returns the number of summary rows written.
+    """
+    postings = Postings.objects.all()
+    summaries = PostingDailySummary.objects.all()
+    if company_ids is not None:
+        postings = postings.filter(company_id__in=company_ids)
+        summaries = summaries.filter(company_id__in=company_ids)
+    rows = (
+        postings.values(*SUMMARY_KEY)
+        .annotate(total=Sum('postAmount'), count=Count('id'),
+                  suspicious_count=Count('id', filter=Q(is_suspicious=True)))
+        .order_by()
+    )
+    with transaction.atomic():
+        summaries.delete()
+        created = PostingDailySummary.objects.bulk_create(
+            (PostingDailySummary(**row) for row in rows.iterator()), batch_size=2000,
+        )
+    return len(created)
+
+
+def company_summary(company_id, period='day', date_from=None, date_to=None):
+    """
+    Totals per period, account and currency for one company, read from the
+    rollup table instead of the postings.
+    """
+    qs = PostingDailySummary.objects.filter(company_id=company_id)
+    if date_from:
+        qs = qs.filter(postDate__gte=date_from)
+    if date_to:
+        qs = qs.filter(postDate__lte=date_to)
+    rows = (
+        qs.annotate(period=PERIODS[period])
+        .values('period', 'accountHandleNumber', 'postCurrency')
+        .annotate(total=Sum('total'), count=Sum('count'), suspicious_count=Sum('suspicious_count'))
+        .order_by('period', 'accountHandleNumber', 'postCurrency')
+    )
+    return list(rows)
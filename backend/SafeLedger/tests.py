@@ -1 +1,347 @@
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+import pandas as pd
 from django.test import TestCase
+
+from . import metrics
+from .models import Company, Postings
+from .ml import ml_model
+from .ml.dataset import allocate, iter_company_frames, reservoir_sample, sample_company_frame
+from .ml.features import FEATURE_COLUMNS, FEATURE_NAMES, FeaturePipeline
+from .ml.ml_model import ModelRegistry
+from .ml.training import ModelUpdate, fit_company_model, update_company_model
+
+
+def make_postings(company, amounts, account=1001, post_date=date(2025, 1, 31)):
+    Postings.objects.bulk_create([
+        Postings(
+            company=company,
+            accountHandleNumber=account,
+            postDate=post_date,
+            postAmount=Decimal(str(amount)),
+            postCurrency='DKK',
+            postDescription='Test posting',
+        )
+        for amount in amounts
+    ])
+
+
+class CompanyFeatureStreamTest(TestCase):
+    def test_frames_carry_every_feature_column(self):
+        print("[CompanyFeatureStreamTest] test_frames_carry_every_feature_column")
+        first = Company.objects.create(companyName='First')
+        second = Company.objects.create(companyName='Second')
+        make_postings(first, [10, 20, 30])
+        make_postings(second, [-1.5], account=2001)
+
+        result = dict(iter_company_frames(chunk_size=2))
+        self.assertEqual(list(result[first.id].columns), ['id', *FEATURE_COLUMNS])
+        self.assertEqual(result[first.id]['postAmount'].tolist(), [10.0, 20.0, 30.0])
+        self.assertEqual(result[second.id]['postDescription'].tolist(), ['Test posting'])
+        self.assertEqual(list(dict(iter_company_frames([second.id]))), [second.id])
+
+    def test_reservoir_sample_is_uniform(self):
+        print("[CompanyFeatureStreamTest] test_reservoir_sample_is_uniform")
+        rng = np.random.default_rng(0)
+        picks = np.zeros(100)
+        for _ in range(2000):
+            sample, seen = reservoir_sample(iter(range(100)), 10, rng, chunk_size=7)
+            self.assertEqual((len(set(sample)), seen), (10, 100))
+            picks[sample] += 1
+        # every item is kept 200 times in expectation
+        self.assertLess(np.abs(picks - 200).max(), 60)
+        self.assertEqual(sorted(reservoir_sample(iter(range(3)), 10, rng)[0]), [0, 1, 2])
+
+    def test_sample_company_frame(self):
+        print("[CompanyFeatureStreamTest] test_sample_company_frame")
+        company = Company.objects.create(companyName='Sampled')
+        make_postings(company, range(60), post_date=date(2025, 1, 15))
+        make_postings(company, range(30), post_date=date(2025, 2, 15))
+        make_postings(company, range(10), post_date=date(2025, 3, 15))
+        np.testing.assert_array_equal(allocate([60, 30, 10], 20), [12, 6, 2])
+        np.testing.assert_array_equal(allocate([1, 1, 1], 2).sum(), 2)
+
+        sample = sample_company_frame(company.id, 20, 'time', seed=7, chunk_size=8)
+        self.assertEqual((len(sample.frame), sample.population, sample.fraction), (20, 100, 0.2))
+        self.assertEqual(sample.last_posting_id, Postings.objects.order_by('id').last().id)
+        self.assertEqual(list(sample.frame.columns), ['id', *FEATURE_COLUMNS])
+        months = pd.to_datetime(sample.frame['postDate']).dt.month.value_counts().to_dict()
+        self.assertEqual(months, {1: 12, 2: 6, 3: 2})
+
+        # the seed reproduces the sample
+        uniform = sample_company_frame(company.id, 20, seed=7, chunk_size=8)
+        self.assertEqual(uniform.frame['id'].tolist(), sample_company_frame(company.id, 20, seed=7).frame['id'].tolist())
+        self.assertEqual(uniform.frame['id'].nunique(), 20)
+        self.assertEqual(len(sample_company_frame(company.id, 500).frame), 100)
+
+
+def warm_up_with(registry):
+    with mock.patch.object(ml_model, 'registry', registry):
+        return ml_model.warm_up()
+
+
+class ModelRegistryTest(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.registry = ModelRegistry(tmp.name, check_interval=0)
+        self.X = np.random.default_rng(0).normal(1000, 50, size=(200, 2))
+
+    def test_save_writes_one_file_per_company(self):
+        print("[ModelRegistryTest] test_save_writes_one_file_per_company")
+        self.registry.save(1, *fit_company_model(self.X))
+        other = self.registry.path(1)
+        mtime = os.stat(other).st_mtime_ns
+
+        self.registry.save(2, *fit_company_model(self.X))
+        self.assertEqual(self.registry.company_ids(), [1, 2])
+        self.assertEqual(os.stat(other).st_mtime_ns, mtime)
+
+    def test_models_load_lazily_and_pick_up_new_artifacts(self):
+        print("[ModelRegistryTest] test_models_load_lazily_and_pick_up_new_artifacts")
+        ModelRegistry(self.registry.root).save(1, *fit_company_model(self.X))
+        self.assertIsNone(self.registry.get(2))
+
+        scaler, iso = self.registry.get(1)
+        self.assertEqual(scaler.n_samples_seen_, 200)
+
+        # another process retrains the company
+        os.utime(self.registry.path(1), ns=(0, 0))
+        ModelRegistry(self.registry.root).save(1, *fit_company_model(self.X[:100]))
+        scaler, iso = self.registry.get(1)
+        self.assertEqual(scaler.n_samples_seen_, 100)
+
+    def test_startup_does_not_import_the_ml_libraries(self):
+        print("[ModelRegistryTest] test_startup_does_not_import_the_ml_libraries")
+        # a fresh process, this one already has them loaded by the tests
+        code = ("import os, sys; os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings'); "
+                "import django; django.setup(); import core.urls; "
+                "print(*[m for m in ('pandas', 'sklearn', 'joblib') if m in sys.modules])")
+        out = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(__file__)),
+                             check=True, capture_output=True, text=True).stdout
+        self.assertEqual(out.split(), [])
+
+    def test_generation_change_reloads_only_changed_companies(self):
+        print("[ModelRegistryTest] test_generation_change_reloads_only_changed_companies")
+        worker = ModelRegistry(self.registry.root, check_interval=0)
+        first_version = self.registry.save(1, *fit_company_model(self.X))
+        self.registry.save(2, *fit_company_model(self.X))
+        _, iso_1 = worker.get(1)
+        _, iso_2 = worker.get(2)
+        self.assertEqual(worker.version(1), first_version)
+
+        os.utime(self.registry.path(1), ns=(0, 0))
+        new_version = self.registry.save(1, *fit_company_model(self.X[:100]))
+        self.assertGreater(new_version, first_version)
+        self.assertEqual(self.registry.generation(), new_version)
+
+        self.assertIsNot(worker.get(1)[1], iso_1)
+        self.assertEqual(worker.version(1), new_version)
+        self.assertIs(worker.get(2)[1], iso_2)
+
+    def test_cached_models_are_kept_between_checks(self):
+        print("[ModelRegistryTest] test_cached_models_are_kept_between_checks")
+        worker = ModelRegistry(self.registry.root, check_interval=3600)
+        self.registry.save(1, *fit_company_model(self.X))
+        _, iso = worker.get(1)
+
+        self.registry.delete(1)
+        self.assertIs(worker.get(1)[1], iso)
+        worker.refresh(force=True)
+        self.assertIsNone(worker.get(1))
+
+    def test_broken_artifact_is_treated_as_missing(self):
+        print("[ModelRegistryTest] test_broken_artifact_is_treated_as_missing")
+        with open(self.registry.path(3), 'wb') as f:
+            f.write(b'not a model')
+        with self.assertLogs('SafeLedger.ml.ml_model', level='ERROR'):
+            self.assertIsNone(self.registry.get(3))
+        self.assertEqual(warm_up_with(self.registry), 0)
+
+
+def ledger_frame(rows=400, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'accountHandleNumber': rng.choice([1001, 2001, 3001], size=rows),
+        'postDate': pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 365, size=rows), unit='D'),
+        'postAmount': rng.normal(1000, 50, size=rows),
+        'postCurrency': 'DKK',
+        'postDescription': rng.choice(['Faktura', 'Husleje januar', 'Kørsel'], size=rows),
+    })
+
+
+class FeaturePipelineTest(TestCase):
+    def setUp(self):
+        self.frame = ledger_frame()
+        self.pipeline = FeaturePipeline().fit(self.frame)
+
+    def test_rows_do_not_depend_on_the_batch(self):
+        print("[FeaturePipelineTest] test_rows_do_not_depend_on_the_batch")
+        X = self.pipeline.transform(self.frame)
+        self.assertEqual(X.shape, (400, len(FEATURE_NAMES)))
+        np.testing.assert_allclose(self.pipeline.transform(self.frame.iloc[[7]]), X[[7]])
+
+    def test_calendar_and_unknown_values(self):
+        print("[FeaturePipelineTest] test_calendar_and_unknown_values")
+        usual = dict(zip(FEATURE_NAMES, self.pipeline.transform(self.frame.iloc[[0]])[0]))
+        row = pd.DataFrame([{'accountHandleNumber': 9999, 'postDate': date(2025, 1, 31), 'postAmount': 1000.0,
+                             'postCurrency': 'EUR', 'postDescription': None}])
+        features = dict(zip(FEATURE_NAMES, self.pipeline.transform(row)[0]))
+        self.assertAlmostEqual(features['weekday_sin'], np.sin(4 * 2 * np.pi / 7))
+        self.assertEqual(features['month_end'], 1.0)
+        # unseen account, currency and description are as rare as can be
+        for name in ('account_rarity', 'currency_rarity', 'description_rarity'):
+            self.assertAlmostEqual(features[name], np.log(401))
+            self.assertLess(usual[name], 2)
+
+        # an amount far from the account's usual ones stands out in its z-score
+        row = row.assign(accountHandleNumber=1001, postAmount=1_000_000.0)
+        features = dict(zip(FEATURE_NAMES, self.pipeline.transform(row)[0]))
+        self.assertGreater(features['amount_z'], 50)
+
+    def test_partial_fit_matches_fit_on_all_rows(self):
+        print("[FeaturePipelineTest] test_partial_fit_matches_fit_on_all_rows")
+        frame = self.frame.copy()
+        frame.loc[399, ['accountHandleNumber', 'postCurrency']] = [4001, 'EUR']
+        updated = FeaturePipeline().fit(frame.iloc[:300]).partial_fit(frame.iloc[300:390]).partial_fit(frame.iloc[390:])
+        refitted = FeaturePipeline().fit(frame)
+        for key, value in refitted.state.items():
+            if key == 'currencies':
+                self.assertEqual(list(updated.state[key]), ['DKK', 'EUR'])
+            else:
+                np.testing.assert_allclose(updated.state[key], value, err_msg=key)
+
+    def test_update_keeps_the_forest_consistent(self):
+        print("[FeaturePipelineTest] test_update_keeps_the_forest_consistent")
+        scaler, iso, features = fit_company_model(self.frame.iloc[:300])
+        kept = iso.estimators_[30:]
+        update = ModelUpdate(scaler, iso, features, self.frame.iloc[300:], self.frame.iloc[100:300], 0.3)
+        scaler, iso, features = update_company_model(update)
+
+        self.assertEqual(len(iso.estimators_), 100)
+        self.assertEqual(iso.estimators_[:70], kept)
+        for per_tree in (iso.estimators_features_, iso._seeds, iso.estimators_samples_,
+                         iso._average_path_length_per_tree, iso._decision_path_lengths):
+            self.assertEqual(len(per_tree), len(iso.estimators_))
+        self.assertEqual(iso.max_samples_, 256)
+        # the threshold flags the contamination share of the refit rows
+        Xs = scaler.transform(features.transform(pd.concat([update.new, update.reference])))
+        self.assertAlmostEqual(iso.offset_, np.percentile(iso.score_samples(Xs), 5))
+        self.assertAlmostEqual((iso.predict(Xs) == -1).mean(), 0.05, delta=0.01)
+
+        # a small ledger outgrows the old max_samples: the whole ledger, refitted
+        scaler, iso, features = fit_company_model(self.frame.iloc[:150])
+        small = update_company_model(ModelUpdate(scaler, iso, features, self.frame.iloc[150:160],
+                                                 self.frame.iloc[:150], 0.3))[1]
+        self.assertIsNot(small, iso)
+        self.assertEqual((len(small.estimators_), small.max_samples_), (100, 160))
+
+    def test_saved_pipeline_scores_and_legacy_models_still_work(self):
+        print("[FeaturePipelineTest] test_saved_pipeline_scores_and_legacy_models_still_work")
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        registry = ModelRegistry(tmp.name, check_interval=0)
+        registry.save(1, *fit_company_model(self.frame))
+        # a legacy artifact, fitted on [accountHandleNumber, postAmount]
+        legacy = self.frame[['accountHandleNumber', 'postAmount']].to_numpy(dtype=float)
+        registry.save(2, *fit_company_model(legacy))
+
+        postings = pd.concat([self.frame.iloc[:3], self.frame.iloc[:1].assign(postAmount=-5_000_000.0)])
+        with mock.patch.object(ml_model, 'registry', ModelRegistry(tmp.name)):
+            self.assertEqual(ml_model.evaluate_postings(1, postings).tolist(), [False, False, False, True])
+            self.assertEqual(ml_model.evaluate_postings(2, postings)[-1], True)
+            self.assertIsNone(ml_model.registry.model(2)[2])
+
+        with mock.patch('SafeLedger.ml.features.FEATURES_VERSION', 2):
+            with self.assertLogs('SafeLedger.ml.ml_model', level='ERROR'):
+                self.assertIsNone(ModelRegistry(tmp.name).get(1))
+
+    def test_score_postings_keeps_input_order_across_companies(self):
+        print("[FeaturePipelineTest] test_score_postings_keeps_input_order_across_companies")
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        registry = ModelRegistry(tmp.name, check_interval=0)
+        registry.save(1, *fit_company_model(self.frame))
+        # a legacy model, so rows scored by the wrong company's model would not fit
+        registry.save(2, *fit_company_model(self.frame[['accountHandleNumber', 'postAmount']].to_numpy(dtype=float)))
+
+        # companies interleaved, company 3 has no model
+        postings = self.frame.iloc[:6].assign(company_id=[2, 1, 3, 1, 2, 3])
+        postings.loc[postings.index[[1, 4]], 'postAmount'] = -5_000_000.0
+        postings.index = [50, 40, 30, 20, 10, 0]
+        with mock.patch.object(ml_model, 'registry', registry):
+            scores = ml_model.score_postings(postings)
+            self.assertEqual(scores.scored.tolist(), [True, True, False, True, True, False])
+            self.assertEqual(scores.suspicious.tolist(), [False, True, False, False, True, False])
+            self.assertTrue(np.isnan(scores.anomaly_score[[2, 5]]).all())
+            self.assertEqual(sorted(scores.versions), [1, 2])
+            # the same numbers as scoring each company on its own
+            for company_id in (1, 2):
+                rows = np.flatnonzero(postings['company_id'].to_numpy() == company_id)
+                flags, anomaly_score, version = ml_model.score_company(company_id, postings.iloc[rows])
+                self.assertEqual(scores.versions[company_id], version)
+                np.testing.assert_array_equal(scores.suspicious[rows], flags)
+                np.testing.assert_allclose(scores.anomaly_score[rows], anomaly_score)
+                np.testing.assert_array_equal(flags, ml_model.evaluate_postings(company_id, postings.iloc[rows]))
+
+            # a model that fails (here on a feature shape mismatch) is an
+            # error, not a company without a model
+            scaler, iso, features, version = registry.versioned_model(1)
+            with mock.patch.object(registry, 'versioned_model', return_value=(scaler, iso, None, version)):
+                with self.assertRaisesRegex(ValueError, 'features'):
+                    ml_model.score_postings(self.frame.iloc[:6].assign(company_id=1))
+
+
+class MetricsTest(TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        print("[MetricsTest] test_histogram_buckets_are_cumulative")
+        for rows in (5, 50, 50, 5_000_000, 50_000_000):
+            metrics.TRAIN_ROWS.observe(rows, company='metrics-test', mode='full')
+        text = metrics.render()
+        labels = 'company="metrics-test",mode="full"'
+        self.assertIn(f'safeledger_train_rows_bucket{{{labels},le="10"}} 1\n', text)
+        self.assertIn(f'safeledger_train_rows_bucket{{{labels},le="100"}} 3\n', text)
+        self.assertIn(f'safeledger_train_rows_bucket{{{labels},le="10000000"}} 4\n', text)
+        self.assertIn(f'safeledger_train_rows_bucket{{{labels},le="+Inf"}} 5\n', text)
+        self.assertIn(f'safeledger_train_rows_count{{{labels}}} 5\n', text)
+        self.assertIn(f'safeledger_train_rows_sum{{{labels}}} 55000105.0\n', text)
+
+    def test_processes_are_added_up_through_the_metrics_dir(self):
+        print("[MetricsTest] test_processes_are_added_up_through_the_metrics_dir")
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        metrics.SCORING_FALLBACKS.inc(company='metrics-dir', reason='ValueError')
+        # what another worker process flushed
+        with open(os.path.join(tmp.name, f'metrics_{os.getppid()}.json'), 'w') as f:
+            f.write('{"safeledger_scoring_fallbacks_total": [[["metrics-dir", "ValueError"], 2]], "unknown": []}')
+        with mock.patch.dict(os.environ, {'SAFELEDGER_METRICS_DIR': tmp.name}):
+            text = metrics.render()
+        self.assertIn('safeledger_scoring_fallbacks_total{company="metrics-dir",reason="ValueError"} 3\n', text)
+        self.assertIn(f'metrics_{os.getpid()}.json', os.listdir(tmp.name))
+
+    def test_files_of_exited_processes_are_dropped(self):
+        print("[MetricsTest] test_files_of_exited_processes_are_dropped")
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                check=True, capture_output=True, text=True).stdout.strip()
+        for pid in (exited, os.getppid()):
+            with open(os.path.join(tmp.name, f'metrics_{pid}.json'), 'w') as f:
+                f.write('{"safeledger_scoring_fallbacks_total": [[["exited", "ValueError"], 5]]}')
+        with mock.patch.dict(os.environ, {'SAFELEDGER_METRICS_DIR': tmp.name}):
+            text = metrics.render()
+            self.assertIn('safeledger_scoring_fallbacks_total{company="exited",reason="ValueError"} 5\n', text)
+            self.assertNotIn(f'metrics_{exited}.json', os.listdir(tmp.name))
+
+            # gunicorn's child_exit and on_starting hooks
+            metrics.mark_process_dead(os.getppid())
+            self.assertNotIn('company="exited"', metrics.render())
+            metrics.clear_dir()
+        self.assertEqual(os.listdir(tmp.name), [])
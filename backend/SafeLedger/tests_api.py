@@ -2,13 +2,53 @@
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
-from .models import Company, User, Postings
-from .ml.ml_model import scalers, iso_forests
+from .models import Company, User, Postings, PostingDailySummary, ModelTrainingState
+from .ml import ml_model
+import io
+import os
+from datetime import date
+from decimal import Decimal
 import numpy as np
+import joblib
+import tempfile
+from unittest import mock
+from django.core.management import call_command
+from django.db import connection
+from django.core.cache import cache
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from asgiref.sync import sync_to_async
 
+class DummyScaler:
+    def transform(self, X):
+        return X
+
+class DummyIso:
+    # every posting is anomalous
+    offset_ = 0.0
+    def score_samples(self, X):
+        return np.full(len(X), -1.0)
+
+class DummyBatchIso:
+    # anomalous above 1.000.000 (the legacy features are [account, amount])
+    offset_ = 0.0
+    def score_samples(self, X):
+        return np.where(X[:, 1] > 1_000_000, -1.0, 1.0)
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
 class BaseAPITest(APITestCase):
     def setUp(self):
         self.client = APIClient()
+        # ids are reused between tests, cached company scopes must not be
+        cache.clear()
+
+        # Keep the real model artifacts out of the test run
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.registry = ml_model.ModelRegistry(tmp.name)
+        patcher = mock.patch.object(ml_model, 'registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
         # Users
         self.superuser = User.objects.create_user(
@@ -24,14 +64,32 @@ class BaseAPITest(APITestCase):
         self.accountant.companies.add(self.company)
 
         # Patch ML model for postings
-        class DummyScaler:
-            def transform(self, X):
-                return X
-        class DummyIso:
-            def predict(self, X):
-                return np.array([-1])
-        scalers[self.company.id] = DummyScaler()
-        iso_forests[self.company.id] = DummyIso()
+        self.registry.put(self.company.id, DummyScaler(), DummyIso())
+
+    def use_batch_model(self):
+        # Flag every posting above 1.000.000 so batch results are predictable
+        self.registry.put(self.company.id, DummyScaler(), DummyBatchIso())
+
+class QueryCountMixin:
+    """
+    Regression harness for N+1 queries: a list endpoint must issue the same
+    number of queries whether it returns a few rows or many.
+    """
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response
+
+    def assertQueryCountIndependentOfSize(self, url, add_rows, params=None, more=5):
+        # the first request fills per-user caches such as the company scope
+        self.count_queries(url, params)
+        before, _ = self.count_queries(url, params)
+        add_rows(more)
+        after, response = self.count_queries(url, params)
+        self.assertEqual(after, before, f"{url} went from {before} to {after} queries "
+                                        f"after adding {more} rows")
+        return response
 
 class CompanyAPITest(BaseAPITest):
     def test_create_company(self):
@@ -139,8 +197,980 @@ class PostingAPITest(BaseAPITest):
         # Intentional failure: expect is_suspicious False
         self.assertFalse(response.data.get('is_suspicious'))
 
+def metric_value(text, sample):
+    # value of one sample line of the /metrics output, 0 when it is not there yet
+    for line in text.splitlines():
+        if line.startswith(sample + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0.0
+
+class MetricsAPITest(BaseAPITest):
+    def scrape(self, **headers):
+        response = self.client.get(reverse('metrics'), **headers)
+        return response, response.content.decode()
+
+    @override_settings(METRICS_PUBLIC=True)
+    def test_scoring_fallbacks_and_request_latency_are_counted(self):
+        print("[MetricsAPITest] test_scoring_fallbacks_and_request_latency_are_counted")
+        other = Company.objects.create(companyName='NoModelCo')
+        self.accountant.companies.add(other)
+        fallback = f'safeledger_scoring_fallbacks_total{{company="{other.id}",reason="ModelNotFound"}}'
+        scored = f'safeledger_scoring_seconds_count{{company="{self.company.id}"}}'
+        created = 'safeledger_request_seconds_count{view="postings-list",method="POST",status="201"}'
+        _, before = self.scrape()
+
+        self.client.force_authenticate(self.accountant)
+        for company in (self.company, other):
+            response = self.client.post(reverse('postings-list'), {
+                'company': company.id, 'accountHandleNumber': 1001, 'postDate': '2025-04-20',
+                'postAmount': '100', 'postCurrency': 'DKK', 'postDescription': 'Metrics posting',
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response, after = self.scrape()
+        print(after[:500])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE safeledger_request_seconds histogram', after)
+        self.assertEqual(metric_value(after, fallback) - metric_value(before, fallback), 1)
+        self.assertEqual(metric_value(after, scored) - metric_value(before, scored), 1)
+        self.assertEqual(metric_value(after, created) - metric_value(before, created), 2)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_token_is_required_when_configured(self):
+        print("[MetricsAPITest] test_token_is_required_when_configured")
+        self.assertEqual(self.scrape()[0].status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer wrong')[0].status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer scrape-token')[0].status_code,
+                         status.HTTP_200_OK)
+
+    def test_hidden_without_token_or_public_opt_in(self):
+        print("[MetricsAPITest] test_hidden_without_token_or_public_opt_in")
+        self.assertEqual(self.scrape()[0].status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(self.superuser)
+        self.assertEqual(self.scrape()[0].status_code, status.HTTP_404_NOT_FOUND)
+
+class ProfilingAPITest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.profile_dir = tmp.name
+        Postings.objects.create(company=self.company, accountHandleNumber=1001, postDate=date(2025, 3, 1),
+                                postAmount=Decimal('10'), postCurrency='DKK', postDescription='Profiled')
+
+    def records(self):
+        from .profiling import read_records
+        return list(read_records(self.profile_dir))
+
+    def test_sampled_requests_are_recorded_and_summarised(self):
+        print("[ProfilingAPITest] test_sampled_requests_are_recorded_and_summarised")
+        with override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=self.profile_dir, PROFILE_CPROFILE=True):
+            client = APIClient()
+            client.force_authenticate(self.accountant)
+            self.assertEqual(client.get(reverse('companies-list')).status_code, status.HTTP_200_OK)
+            client.force_login(self.accountant)
+            self.assertEqual(client.get(reverse('postings-list')).status_code, status.HTTP_200_OK)
+        records = self.records()
+        print("Records:", records)
+        self.assertEqual([r['view'] for r in records], ['companies-list', 'postings-list'])
+        self.assertEqual(records[0]['route'], 'api/companies/')
+        self.assertTrue(all(r['queries'] > 0 and r['wall_ms'] >= r['sql_ms'] for r in records))
+        self.assertTrue(os.path.exists(records[0]['profile']))
+
+        out = io.StringIO()
+        call_command('profile_summary', dir=self.profile_dir, sort='mean_queries', stdout=out)
+        print(out.getvalue())
+        self.assertIn('companies-list', out.getvalue())
+        self.assertIn('postings-list', out.getvalue())
+
+    def test_disabled_by_default(self):
+        print("[ProfilingAPITest] test_disabled_by_default")
+        with override_settings(PROFILE_DIR=self.profile_dir):
+            client = APIClient()
+            client.force_authenticate(self.accountant)
+            client.get(reverse('companies-list'))
+        self.assertEqual(self.records(), [])
+
+    async def test_async_views_count_their_queries(self):
+        print("[ProfilingAPITest] test_async_views_count_their_queries")
+        with override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=self.profile_dir):
+            await self.async_client.aforce_login(self.accountant)
+            response = await self.async_client.get(reverse('postings-list'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        records = await sync_to_async(self.records)()
+        print("Records:", records)
+        self.assertEqual(records[-1]['view'], 'postings-list')
+        self.assertGreater(records[-1]['queries'], 0)
+
+    def test_exports_are_measured_until_their_body_is_sent(self):
+        print("[ProfilingAPITest] test_exports_are_measured_until_their_body_is_sent")
+        with override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=self.profile_dir):
+            client = APIClient()
+            client.force_authenticate(self.accountant)
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(reverse('postings-export', args=['csv']))
+                self.assertEqual(self.records(), [])
+                body = b''.join(response.streaming_content)
+        records = self.records()
+        print("Records:", records)
+        self.assertIn(b'Profiled', body)
+        self.assertEqual(records[0]['view'], 'postings-export')
+        self.assertEqual(records[0]['queries'], len(queries.captured_queries))
+
+    async def test_async_exports_count_their_queries(self):
+        print("[ProfilingAPITest] test_async_exports_count_their_queries")
+        with override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=self.profile_dir):
+            await self.async_client.aforce_login(self.accountant)
+            response = await self.async_client.get(reverse('postings-export', args=['ndjson']))
+            before = await sync_to_async(self.records)()
+            body = b''.join([chunk async for chunk in response.streaming_content])
+        records = await sync_to_async(self.records)()
+        print("Records:", records)
+        self.assertIn(b'Profiled', body)
+        self.assertEqual(before, [])
+        self.assertEqual(records[-1]['view'], 'postings-export')
+        self.assertGreater(records[-1]['queries'], 0)
+
 # Intentional failing unit test
 class IntentionalFailureTest(BaseAPITest):
     def test_will_fail(self):
         print("[IntentionalFailureTest] This test is designed to fail")
         self.assertEqual(1, 2, "Intentional failure to demonstrate test failures")
+
+class PostingBulkImportAPITest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.use_batch_model()
+        self.url = reverse('postings-bulk')
+
+    def test_bulk_import_json(self):
+        print("[PostingBulkImportAPITest] test_bulk_import_json")
+        self.client.force_authenticate(self.accountant)
+        rows = [
+            {
+                'company': self.company.id,
+                'accountHandleNumber': 1001,
+                'postDate': '2025-04-20',
+                'postAmount': amount,
+                'postCurrency': 'DKK',
+                'postDescription': 'Bulk posting',
+            }
+            for amount in ['100.50', '2000000', '-25']
+        ]
+        response = self.client.post(self.url, rows, format='json')
+        print("Status code:", response.status_code, "Data:", response.data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(response.data['suspicious'], 1)
+        self.assertEqual(
+            list(Postings.objects.order_by('id').values_list('is_suspicious', flat=True)),
+            [False, True, False],
+        )
+
+    def test_bulk_import_csv(self):
+        print("[PostingBulkImportAPITest] test_bulk_import_csv")
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        self.client.force_authenticate(self.accountant)
+        csv = (
+            "company_id;accountHandleNumber;postDate;postAmount;postCurrency;postDescription\n"
+            f"{self.company.id};1001;01-02-2025;150.25;DKK;Faktura\n"
+            f"{self.company.id};2001;02-02-2025;5000000;DKK;Equus regninger\n"
+        )
+        upload = SimpleUploadedFile('posting.csv', csv.encode('latin1'), content_type='text/csv')
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+        print("Status code:", response.status_code, "Data:", response.data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        posting = Postings.objects.get(accountHandleNumber=1001)
+        self.assertEqual(str(posting.postDate), '2025-02-01')
+        self.assertEqual(str(posting.postAmount), '150.25')
+
+    def test_bulk_import_rejects_other_company(self):
+        print("[PostingBulkImportAPITest] test_bulk_import_rejects_other_company")
+        self.client.force_authenticate(self.accountant)
+        other = Company.objects.create(companyName='OtherCo')
+        rows = [{
+            'company': other.id,
+            'accountHandleNumber': 1001,
+            'postDate': '2025-04-20',
+            'postAmount': '10',
+            'postCurrency': 'DKK',
+            'postDescription': 'Not mine',
+        }]
+        response = self.client.post(self.url, rows, format='json')
+        print("Status code:", response.status_code, "Data:", response.data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Postings.objects.exists())
+
+    def test_bulk_import_rejects_malformed_rows(self):
+        print("[PostingBulkImportAPITest] test_bulk_import_rejects_malformed_rows")
+        self.client.force_authenticate(self.accountant)
+        row = {'company': self.company.id, 'accountHandleNumber': 1001, 'postDate': '2025-04-20',
+               'postAmount': '10', 'postCurrency': 'DKK'}
+        cases = [
+            ([], ["No postings to import."]),
+            ([1, 2], ["Row 1: expected an object.", "Row 2: expected an object."]),
+            ([row, {**row, 'accountHandleNumber': 99999999999}], ["Row 2: invalid accountHandleNumber."]),
+            ([{**row, 'company': 2**63}], ["Row 1: invalid company_id."]),
+        ]
+        for rows, errors in cases:
+            response = self.client.post(self.url, rows, format='json')
+            print("Status code:", response.status_code, "Data:", response.data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data, errors)
+        self.assertFalse(Postings.objects.exists())
+
+class RetrainAPITest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        Postings.objects.bulk_create([
+            Postings(
+                company=self.company, accountHandleNumber=1001 + i % 3,
+                postDate='2025-01-01', postAmount=f"{amount:.2f}",
+                postCurrency='DKK', postDescription='Retrain posting',
+            )
+            for i, amount in enumerate(rng.normal(1000, 50, size=40))
+        ])
+
+    def test_retrain_is_queued_and_run_by_worker(self):
+        print("[RetrainAPITest] test_retrain_is_queued_and_run_by_worker")
+        self.client.force_authenticate(self.superuser)
+        response = self.client.post(reverse('retrain-ml'), {'company_id': self.company.id}, format='json')
+        print("Status code:", response.status_code, "Data:", response.data)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        status_url = reverse('retrain-job', args=[response.data['job_id']])
+        self.assertEqual(self.client.get(status_url).data['status'], 'queued')
+
+        call_command('retrain_worker', once=True, concurrency=1, stdout=io.StringIO())
+
+        job = self.client.get(status_url).data
+        print("Job:", job)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['progress']['tasks_done'], 1)
+        self.assertEqual(job['tasks'][0]['rows'], 40)
+        self.assertGreater(job['tasks'][0]['fit_seconds'], 0)
+        scaler, iso = ml_model.ModelRegistry(self.registry.root).get(self.company.id)
+        self.assertEqual(scaler.n_samples_seen_, 40)
+        self.assertEqual(self.registry.company_ids(), [self.company.id])
+
+    def test_full_retrain_creates_task_per_company(self):
+        print("[RetrainAPITest] test_full_retrain_creates_task_per_company")
+        Company.objects.create(companyName='EmptyCo')
+        self.client.force_authenticate(self.superuser)
+        response = self.client.post(reverse('retrain-ml'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        call_command('retrain_worker', once=True, concurrency=2, stdout=io.StringIO())
+
+        job = self.client.get(reverse('retrain-job', args=[response.data['job_id']])).data
+        print("Job:", job)
+        self.assertEqual(job['progress']['tasks_total'], 2)
+        self.assertEqual(job['progress']['progress'], 1.0)
+
+    def test_retrain_without_postings_keeps_the_model(self):
+        print("[RetrainAPITest] test_retrain_without_postings_keeps_the_model")
+        self.client.force_authenticate(self.superuser)
+        self.client.post(reverse('retrain-ml'), {'company_id': self.company.id}, format='json')
+        call_command('retrain_worker', once=True, concurrency=1, stdout=io.StringIO())
+        version = self.registry.version(self.company.id)
+
+        Postings.objects.filter(company=self.company).delete()
+        response = self.client.post(reverse('retrain-ml'), {'company_id': self.company.id}, format='json')
+        call_command('retrain_worker', once=True, concurrency=1, stdout=io.StringIO())
+
+        job = self.client.get(reverse('retrain-job', args=[response.data['job_id']])).data
+        print("Job:", job)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual((job['progress']['tasks_skipped'], job['progress']['progress']), (1, 1.0))
+        self.assertEqual(job['tasks'][0]['status'], 'skipped')
+        self.assertIn('no postings', job['tasks'][0]['error'])
+        self.assertEqual(self.registry.version(self.company.id), version)
+        self.assertTrue(ModelTrainingState.objects.filter(company=self.company).exists())
+
+    def test_incremental_retrain_starts_from_the_watermark(self):
+        print("[RetrainAPITest] test_incremental_retrain_starts_from_the_watermark")
+        self.client.force_authenticate(self.superuser)
+
+        def retrain(mode):
+            response = self.client.post(reverse('retrain-ml'), {'company_id': self.company.id, 'mode': mode},
+                                        format='json')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            call_command('retrain_worker', once=True, concurrency=1, stdout=io.StringIO())
+            task = self.client.get(reverse('retrain-job', args=[response.data['job_id']])).data['tasks'][0]
+            print("Task:", task)
+            return task, ModelTrainingState.objects.get(company=self.company)
+
+        def add_postings(amounts):
+            Postings.objects.bulk_create([
+                Postings(company=self.company, accountHandleNumber=1001, postDate='2025-02-03',
+                         postAmount=f"{amount:.2f}", postCurrency='DKK', postDescription='Retrain posting')
+                for amount in amounts
+            ])
+
+        # without a training state an incremental retrain is a full one
+        task, state = retrain('incremental')
+        self.assertEqual((task['mode'], task['rows']), ('full', 40))
+        self.assertEqual(state.last_posting_id, Postings.objects.order_by('id').last().id)
+
+        add_postings(np.random.default_rng(1).normal(1000, 50, size=10))
+        task, state = retrain('incremental')
+        self.assertEqual((task['mode'], task['rows']), ('incremental', 10))
+        self.assertEqual((state.rows, state.updates_since_full), (50, 1))
+        self.assertEqual(state.last_posting_id, Postings.objects.order_by('id').last().id)
+        scaler, iso, features = ml_model.ModelRegistry(self.registry.root).model(self.company.id)
+        self.assertEqual(scaler.n_samples_seen_, 50)
+        self.assertEqual(features.state['rows'], 50)
+        self.assertEqual(len(iso.estimators_), 100)
+        self.assertEqual(state.model_version, self.registry.version(self.company.id))
+
+        # nothing new: the model is left alone
+        task, unchanged = retrain('incremental')
+        self.assertEqual((task['mode'], task['rows']), ('incremental', 0))
+        self.assertEqual(unchanged.model_version, state.model_version)
+
+        # too much new data for an update falls back to a full refit
+        add_postings(np.random.default_rng(2).normal(1000, 50, size=30))
+        task, state = retrain('incremental')
+        self.assertEqual((task['mode'], task['rows']), ('full', 80))
+        self.assertEqual(state.updates_since_full, 0)
+
+        response = self.client.post(reverse('retrain-ml'), {'mode': 'partial'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sampled_retrain_records_fraction_and_seed(self):
+        print("[RetrainAPITest] test_sampled_retrain_records_fraction_and_seed")
+        self.client.force_authenticate(self.superuser)
+        response = self.client.post(reverse('retrain-ml'), {
+            'company_id': self.company.id, 'mode': 'sampled', 'sample_size': 10, 'sampling': 'time',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        call_command('retrain_worker', once=True, concurrency=1, stdout=io.StringIO())
+
+        task = self.client.get(reverse('retrain-job', args=[response.data['job_id']])).data['tasks'][0]
+        print("Task:", task)
+        self.assertEqual((task['mode'], task['rows'], task['sampling']), ('sampled', 10, 'time'))
+        self.assertEqual(task['sample_fraction'], 0.25)
+        scaler, iso = ml_model.ModelRegistry(self.registry.root).get(self.company.id)
+        self.assertEqual(scaler.n_samples_seen_, 10)
+        artifact = joblib.load(self.registry.path(self.company.id))
+        self.assertEqual(artifact['sample']['seed'], task['sample_seed'])
+        self.assertEqual((artifact['sample']['population'], artifact['sample']['fraction']), (40, 0.25))
+        state = ModelTrainingState.objects.get(company=self.company)
+        self.assertEqual((state.rows, state.sample_size, state.sample_seed), (40, 10, task['sample_seed']))
+
+        # an incremental retrain of a sampled model draws a new sample of the same size
+        response = self.client.post(reverse('retrain-ml'), {'company_id': self.company.id, 'mode': 'incremental'},
+                                    format='json')
+        call_command('retrain_worker', once=True, concurrency=1, stdout=io.StringIO())
+        task = self.client.get(reverse('retrain-job', args=[response.data['job_id']])).data['tasks'][0]
+        self.assertEqual((task['mode'], task['rows']), ('sampled', 10))
+
+        response = self.client.post(reverse('retrain-ml'), {'mode': 'sampled', 'sample_size': 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class EvaluatePostingsCommandTest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.use_batch_model()
+        self.other = Company.objects.create(companyName='NoModelCo')
+        Postings.objects.bulk_create([
+            Postings(
+                company=company, accountHandleNumber=1001, postDate=post_date,
+                postAmount=amount, postCurrency='DKK', postDescription='Backfill',
+                is_suspicious=flagged,
+            )
+            for company, post_date, amount, flagged in [
+                (self.company, '2025-01-01', '5000000', False),
+                (self.company, '2025-02-01', '5000000', False),
+                (self.company, '2025-02-02', '10', True),
+                (self.company, '2025-02-03', '20', False),
+                (self.other, '2025-02-01', '5000000', False),
+            ]
+        ])
+
+    def test_backfill_updates_changed_flags_in_chunks(self):
+        print("[EvaluatePostingsCommandTest] test_backfill_updates_changed_flags_in_chunks")
+        out, err = io.StringIO(), io.StringIO()
+        call_command('evaluate_postings', chunk_size=2, batch_size=1, stdout=out, stderr=err)
+        print(out.getvalue(), err.getvalue())
+        self.assertEqual(
+            list(Postings.objects.filter(company=self.company).order_by('id').values_list('is_suspicious', flat=True)),
+            [True, True, False, False],
+        )
+        self.assertIn("Skipping company", err.getvalue())
+        self.assertIn("3 flags updated", out.getvalue())
+        self.assertEqual(
+            list(Postings.objects.order_by('id').values_list('anomaly_score', flat=True)),
+            [-1.0, -1.0, 1.0, 1.0, None],
+        )
+
+    def test_progress_goes_to_the_command_stdout(self):
+        print("[EvaluatePostingsCommandTest] test_progress_goes_to_the_command_stdout")
+        from .management.commands import evaluate_postings
+        out = io.StringIO()
+        with mock.patch.object(evaluate_postings, 'PROGRESS_EVERY', 2):
+            call_command('evaluate_postings', company=[self.company.id], chunk_size=1, stdout=out)
+        self.assertIn(f"  company {self.company.id}: 2 scored\n  company {self.company.id}: 4 scored\n",
+                      out.getvalue())
+
+    def test_failed_chunk_still_rebuilds_summaries(self):
+        print("[EvaluatePostingsCommandTest] test_failed_chunk_still_rebuilds_summaries")
+        from .management.commands import evaluate_postings
+        from .summaries import rebuild_summaries
+        rebuild_summaries()
+        score_company = evaluate_postings.score_company
+        calls = []
+
+        def fail_second_chunk(company_id, frame):
+            calls.append(company_id)
+            if len(calls) == 2:
+                raise ValueError("model deleted mid-run")
+            return score_company(company_id, frame)
+
+        with mock.patch.object(evaluate_postings, 'score_company', fail_second_chunk):
+            with self.assertRaises(ValueError):
+                evaluate_postings.backfill_company(self.company.id, chunk_size=2)
+        # the first chunk flagged the January posting, and the rollup knows it
+        self.assertEqual(
+            list(Postings.objects.filter(company=self.company).order_by('id').values_list('is_suspicious', flat=True)),
+            [True, True, True, False],
+        )
+        self.assertEqual(
+            PostingDailySummary.objects.filter(company=self.company, postDate=date(2025, 1, 1)).get().suspicious_count, 1,
+        )
+
+    def test_backfill_since_and_company_filters(self):
+        print("[EvaluatePostingsCommandTest] test_backfill_since_and_company_filters")
+        call_command('evaluate_postings', company=[self.company.id], since=date(2025, 2, 1),
+                     stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(
+            list(Postings.objects.filter(company=self.company).order_by('id').values_list('is_suspicious', flat=True)),
+            [False, True, False, False],
+        )
+
+class PostingAnomaliesAPITest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.accountant)
+        self.other = Company.objects.create(companyName='OtherCo')
+        Postings.objects.bulk_create([
+            Postings(
+                company=company, accountHandleNumber=1001, postDate=post_date,
+                postAmount='100', postCurrency='DKK', postDescription='Review',
+                anomaly_score=score, model_version=3 if score is not None else None,
+            )
+            for company, post_date, score in [
+                (self.company, '2025-01-01', -0.40),
+                (self.company, '2025-01-02', -0.70),
+                (self.company, '2025-02-01', -0.55),
+                (self.company, '2025-02-02', None),
+                (self.company, '2025-03-01', -0.30),
+                (self.other, '2025-01-01', -0.90),
+            ]
+        ])
+        self.url = reverse('postings-anomalies')
+
+    def test_most_anomalous_first_within_scope(self):
+        print("[PostingAnomaliesAPITest] test_most_anomalous_first_within_scope")
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # OtherCo is not the accountant's, the unscored posting is left out
+        self.assertEqual([row['anomaly_score'] for row in response.data], [-0.70, -0.55, -0.40, -0.30])
+        self.assertEqual(response.data[0]['model_version'], 3)
+
+        response = self.client.get(self.url, {'company': self.company.id, 'limit': 2, 'date_from': '2025-01-02'})
+        self.assertEqual([row['postDate'] for row in response.data], ['02-01-2025', '01-02-2025'])
+
+        response = self.client.get(self.url, {'score_max': '-0.5'})
+        self.assertEqual([row['anomaly_score'] for row in response.data], [-0.70, -0.55])
+        # the browsable API goes through the serializer and agrees
+        html = self.client.get(self.url, {'score_max': '-0.5'}, HTTP_ACCEPT='application/json; indent=2')
+        self.assertEqual(html.data, response.data)
+
+    def test_invalid_limit(self):
+        print("[PostingAnomaliesAPITest] test_invalid_limit")
+        for limit in ('0', '1001', 'ten'):
+            response = self.client.get(self.url, {'limit': limit})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('limit', response.data)
+
+    def test_edited_postings_are_rescored(self):
+        print("[PostingAnomaliesAPITest] test_edited_postings_are_rescored")
+        class AmountIso:
+            offset_ = -0.5
+            def score_samples(self, X):
+                return -X[:, 1] / 1_000_000
+        self.registry.put(self.company.id, DummyScaler(), AmountIso())
+        response = self.client.post(reverse('postings-list'), {
+            'company': self.company.id, 'accountHandleNumber': 1001, 'postDate': '2025-04-20',
+            'postAmount': '250000', 'postCurrency': 'DKK', 'postDescription': 'Edited',
+        }, format='json')
+        detail = reverse('postings-detail', args=[response.data['id']])
+
+        response = self.client.patch(detail, {'postAmount': '2000000'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        posting = Postings.objects.get(pk=response.data['id'])
+        self.assertEqual((posting.anomaly_score, posting.is_suspicious), (-2.0, True))
+        # the top-N review sees the new score
+        self.assertEqual(self.client.get(self.url, {'limit': 1}).data[0]['id'], posting.id)
+
+        self.client.patch(detail, {'postAmount': '100000'}, format='json')
+        posting.refresh_from_db()
+        self.assertEqual((posting.anomaly_score, posting.is_suspicious), (-0.1, False))
+
+    def test_created_postings_store_their_score(self):
+        print("[PostingAnomaliesAPITest] test_created_postings_store_their_score")
+        response = self.client.post(reverse('postings-list'), {
+            'company': self.company.id, 'accountHandleNumber': 1001, 'postDate': '2025-04-20',
+            'postAmount': '250', 'postCurrency': 'DKK', 'postDescription': 'Scored',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['anomaly_score'], -1.0)
+        self.assertEqual(Postings.objects.get(pk=response.data['id']).anomaly_score, -1.0)
+
+        # no model: stored unscored and not flagged
+        self.client.force_authenticate(self.superuser)
+        response = self.client.post(reverse('postings-list'), {
+            'company': self.other.id, 'accountHandleNumber': 1001, 'postDate': '2025-04-20',
+            'postAmount': '250', 'postCurrency': 'DKK', 'postDescription': 'Unscored',
+        }, format='json')
+        self.assertEqual((response.data['anomaly_score'], response.data['model_version']), (None, None))
+
+class PostingListQueryAPITest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.accountant)
+        self.other = Company.objects.create(companyName='OtherCo')
+        # several postings share a date so the cursor has to break ties on id
+        rows = [
+            ('2025-01-03', '100.00', 1001, False),
+            ('2025-01-01', '250.00', 1001, True),
+            ('2025-01-02', '75.50', 2001, False),
+            ('2025-01-02', '5000.00', 2001, True),
+            ('2025-01-02', '10.00', 1001, False),
+            ('2025-01-04', '900.00', 3001, False),
+            ('2025-01-01', '60.00', 3001, False),
+        ]
+        Postings.objects.bulk_create([
+            Postings(company=self.company, postDate=d, postAmount=a, accountHandleNumber=acc,
+                     is_suspicious=flag, postCurrency='DKK', postDescription='Query')
+            for d, a, acc, flag in rows
+        ])
+        Postings.objects.create(company=self.other, postDate='2025-01-01', postAmount='1',
+                                accountHandleNumber=1001, postCurrency='DKK', postDescription='Hidden')
+        self.url = reverse('postings-list')
+
+    def test_unpaginated_list_is_unchanged(self):
+        print("[PostingListQueryAPITest] test_unpaginated_list_is_unchanged")
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 7)
+
+    def test_cursor_pages_follow_date_and_id(self):
+        print("[PostingListQueryAPITest] test_cursor_pages_follow_date_and_id")
+        expected = list(Postings.objects.filter(company=self.company)
+                        .order_by('postDate', 'id').values_list('id', flat=True))
+        seen = []
+        url = self.url + '?page_size=3'
+        while url:
+            response = self.client.get(url)
+            print("Status code:", response.status_code, "Data:", response.data)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+
+    def test_filters_and_projection(self):
+        print("[PostingListQueryAPITest] test_filters_and_projection")
+        response = self.client.get(self.url, {
+            'date_from': '2025-01-02', 'date_to': '2025-01-03',
+            'amount_min': '50', 'account': '2001', 'fields': 'id,postAmount,is_suspicious',
+        })
+        print("Status code:", response.status_code, "Data:", response.data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['postAmount'] for row in response.data], ['75.50', '5000.00'])
+        self.assertEqual(set(response.data[0]), {'id', 'postAmount', 'is_suspicious'})
+
+        response = self.client.get(self.url, {'is_suspicious': 'true', 'amount_max': '1000'})
+        self.assertEqual([row['postAmount'] for row in response.data], ['250.00'])
+
+    def test_invalid_parameters(self):
+        print("[PostingListQueryAPITest] test_invalid_parameters")
+        self.assertEqual(self.client.get(self.url, {'date_from': '01-02-2025'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'fields': 'id,password'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'cursor': 'garbage'}).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+class CompanySummaryAPITest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.use_batch_model()
+        self.client.force_authenticate(self.accountant)
+        self.url = reverse('companies-summary', args=[self.company.id])
+
+    def post_posting(self, post_date, amount, account=1001, currency='DKK'):
+        response = self.client.post(reverse('postings-list'), {
+            'company': self.company.id, 'accountHandleNumber': account, 'postDate': post_date,
+            'postAmount': amount, 'postCurrency': currency, 'postDescription': 'Summary',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def summary_rows(self):
+        return list(PostingDailySummary.objects.order_by('postDate', 'accountHandleNumber')
+                    .values_list('postDate', 'accountHandleNumber', 'total', 'count', 'suspicious_count'))
+
+    def test_rollup_follows_create_update_delete_and_import(self):
+        print("[CompanySummaryAPITest] test_rollup_follows_create_update_delete_and_import")
+        first = self.post_posting('2025-03-01', '100.00')
+        self.post_posting('2025-03-01', '2000000.00')
+        moved = self.post_posting('2025-03-02', '50.00', account=2001)
+        self.client.patch(reverse('postings-detail', args=[moved]), {'postDate': '2025-03-01'}, format='json')
+        self.client.delete(reverse('postings-detail', args=[first]))
+        self.client.post(reverse('postings-bulk'), [
+            {'company': self.company.id, 'accountHandleNumber': 2001, 'postDate': '2025-03-05',
+             'postAmount': amount, 'postCurrency': 'DKK', 'postDescription': 'Bulk'}
+            for amount in ['10', '20']
+        ], format='json')
+
+        self.assertEqual(self.summary_rows(), [
+            (date(2025, 3, 1), 1001, Decimal('2000000.00'), 1, 1),
+            (date(2025, 3, 1), 2001, Decimal('50.00'), 1, 0),
+            (date(2025, 3, 5), 2001, Decimal('30.00'), 2, 0),
+        ])
+        incremental = self.summary_rows()
+        call_command('rebuild_summaries', stdout=io.StringIO())
+        self.assertEqual(self.summary_rows(), incremental)
+
+    def test_bulk_deltas_are_one_statement(self):
+        print("[CompanySummaryAPITest] test_bulk_deltas_are_one_statement")
+        from .summaries import apply_deltas, posting_deltas
+
+        def apply_for(keys):
+            postings = [Postings(company=self.company, accountHandleNumber=1000 + i, postDate=date(2025, 5, 1),
+                                 postAmount=Decimal('10.00'), postCurrency='DKK', is_suspicious=i % 2 == 0)
+                        for i in range(keys)]
+            with CaptureQueriesContext(connection) as queries:
+                apply_deltas(posting_deltas(postings))
+            return len(queries)
+
+        few = apply_for(3)
+        # the first three keys already exist and are added to
+        self.assertEqual(apply_for(60), few)
+        self.assertEqual(PostingDailySummary.objects.count(), 60)
+        self.assertEqual(list(PostingDailySummary.objects.filter(accountHandleNumber__lt=1003).order_by('id')
+                              .values_list('total', 'count', 'suspicious_count')),
+                         [(Decimal('20.00'), 2, 2), (Decimal('20.00'), 2, 0), (Decimal('20.00'), 2, 2)])
+
+    def test_summary_endpoint_groups_by_period(self):
+        print("[CompanySummaryAPITest] test_summary_endpoint_groups_by_period")
+        self.post_posting('2025-03-01', '100.00')
+        self.post_posting('2025-03-20', '25.50')
+        self.post_posting('2025-04-02', '10.00', currency='EUR')
+
+        response = self.client.get(self.url, {'group': 'month'})
+        print("Status code:", response.status_code, "Data:", response.data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(r['period'], r['postCurrency'], r['total'], r['count'])
+                          for r in response.data['rows']],
+                         [('2025-03-01', 'DKK', '125.50', 2), ('2025-04-01', 'EUR', '10.00', 1)])
+        self.assertEqual(response.data['totals']['DKK'], {'total': '125.50', 'count': 2, 'suspicious_count': 0})
+
+        response = self.client.get(self.url, {'date_from': '2025-03-10'})
+        self.assertEqual(len(response.data['rows']), 2)
+        self.assertEqual(self.client.get(self.url, {'group': 'week'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_summary_of_other_company_is_hidden(self):
+        print("[CompanySummaryAPITest] test_summary_of_other_company_is_hidden")
+        other = Company.objects.create(companyName='OtherCo')
+        response = self.client.get(reverse('companies-summary', args=[other.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class PostingExportAPITest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.accountant)
+        other = Company.objects.create(companyName='OtherCo')
+        Postings.objects.bulk_create([
+            Postings(company=company, accountHandleNumber=account, postDate=post_date, postAmount=amount,
+                     postCurrency='DKK', postDescription=description, is_suspicious=flag)
+            for company, account, post_date, amount, description, flag in [
+                (self.company, 1001, '2025-02-01', '150.25', 'Faktura; rettet', False),
+                (self.company, 2001, '2025-02-02', '5000000.00', 'Equus regninger', True),
+                (other, 1001, '2025-02-01', '1.00', 'Hidden', False),
+            ]
+        ])
+
+    def export(self, export_format, **params):
+        response = self.client.get(reverse('postings-export', args=[export_format]), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export_matches_posting_csv_layout(self):
+        print("[PostingExportAPITest] test_csv_export_matches_posting_csv_layout")
+        import pandas as pd
+        body = self.export('csv')
+        print(body)
+        df = pd.read_csv(io.StringIO(body), sep=';', encoding='utf-8')
+        self.assertEqual(list(df.columns), ['id', 'company_id', 'accountHandleNumber', 'postDate',
+                                            'postAmount', 'postCurrency', 'postDescription', 'is_suspicious'])
+        self.assertEqual(df['postDate'].tolist(), ['01-02-2025', '02-02-2025'])
+        self.assertEqual(df['postDescription'].tolist(), ['Faktura; rettet', 'Equus regninger'])
+        self.assertEqual(df['is_suspicious'].tolist(), [False, True])
+
+    def test_ndjson_export_uses_list_format_and_filters(self):
+        print("[PostingExportAPITest] test_ndjson_export_uses_list_format_and_filters")
+        import json
+        rows = [json.loads(line) for line in self.export('ndjson', is_suspicious='true').splitlines()]
+        listed = self.client.get(reverse('postings-list'), {'is_suspicious': 'true'}).data
+        self.assertEqual(rows, [dict(row) for row in listed])
+        self.assertEqual(rows[0]['postAmount'], '5000000.00')
+
+    def test_unknown_format(self):
+        print("[PostingExportAPITest] test_unknown_format")
+        response = self.client.get(reverse('postings-export', args=['xlsx']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class PostingFastPathAPITest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.accountant)
+        Postings.objects.bulk_create([
+            Postings(company=self.company, accountHandleNumber=account, postDate=post_date,
+                     postAmount=amount, postCurrency='DKK', postDescription=description, is_suspicious=flag)
+            for account, post_date, amount, description, flag in [
+                (1001, date(2025, 1, 2), Decimal('150.25'), 'Faktura', False),
+                (2001, date(2025, 1, 2), Decimal('-0.5'), 'Kørsel "Århus" linje', True),
+                (3001, date(999, 12, 31), Decimal('1234567890123.40'), '', False),
+            ]
+        ])
+
+    def serializer_bytes(self, queryset, many=True, **kwargs):
+        from rest_framework.renderers import JSONRenderer
+        from .serializers import PostingsSerializer
+        return JSONRenderer().render(PostingsSerializer(queryset, many=many, **kwargs).data)
+
+    def test_list_and_detail_bytes_match_serializer(self):
+        print("[PostingFastPathAPITest] test_list_and_detail_bytes_match_serializer")
+        qs = Postings.objects.all()
+        response = self.client.get(reverse('postings-list'))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, self.serializer_bytes(qs))
+
+        response = self.client.get(reverse('postings-list'), {'fields': 'postDate,postAmount'})
+        self.assertEqual(response.content, self.serializer_bytes(qs, fields=['postDate', 'postAmount']))
+
+        posting = qs.get(accountHandleNumber=2001)
+        response = self.client.get(reverse('postings-detail', args=[posting.id]))
+        self.assertEqual(response.content, self.serializer_bytes(posting, many=False))
+
+    def test_paginated_page_and_browsable_api(self):
+        print("[PostingFastPathAPITest] test_paginated_page_and_browsable_api")
+        response = self.client.get(reverse('postings-list'), {'page_size': 2})
+        data = response.json()
+        self.assertEqual([row['postDate'] for row in data['results']], ['31-12-999', '02-01-2025'])
+        self.assertEqual(len(self.client.get(data['next']).json()['results']), 1)
+
+        # the browsable API still goes through the serializer
+        response = self.client.get(reverse('postings-list'), HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'150.25', response.content)
+
+class ListQueryCountAPITest(QueryCountMixin, BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.second = Company.objects.create(companyName='SecondCo')
+        self.accountant.companies.add(self.second)
+        self.created = 0
+
+    def add_customers(self, n):
+        for _ in range(n):
+            self.created += 1
+            customer = User.objects.create_user(username=f'c{self.created}', email=f'c{self.created}@test.dk',
+                                                password='pw', role='customer')
+            # shares both companies with the accountant
+            customer.companies.add(self.company, self.second)
+
+    def test_customer_list_is_constant_and_distinct(self):
+        print("[ListQueryCountAPITest] test_customer_list_is_constant_and_distinct")
+        self.add_customers(1)
+        for user in (self.accountant, self.superuser):
+            self.client.force_authenticate(user)
+            self.assertQueryCountIndependentOfSize(reverse('customers-list'), self.add_customers)
+        response = self.client.get(reverse('customers-list'))
+        self.assertEqual(len(response.data), self.created)
+        self.assertEqual({row['company_name'] for row in response.data}, {'TestCo'})
+
+        self.client.force_authenticate(self.accountant)
+        response = self.client.get(reverse('customers-list'))
+        self.assertEqual(len({row['id'] for row in response.data}), len(response.data))
+
+    def test_accountant_and_company_lists_are_constant(self):
+        print("[ListQueryCountAPITest] test_accountant_and_company_lists_are_constant")
+        self.client.force_authenticate(self.superuser)
+
+        def add_accountants(n):
+            for i in range(n):
+                user = User.objects.create_user(username=f'a{i}', email=f'a{i}@test.dk',
+                                                password='pw', role='accountant')
+                user.companies.add(self.company)
+        self.assertQueryCountIndependentOfSize(reverse('accountants-list'), add_accountants)
+
+        def add_companies(n):
+            self.superuser.companies.add(*[Company.objects.create(companyName=f'Co{self.created + i}')
+                                           for i in range(n)])
+            self.created += n
+        self.assertQueryCountIndependentOfSize(reverse('companies-list'), add_companies)
+        # plain Django view, authenticated through the session
+        self.client.force_login(self.superuser)
+        self.assertQueryCountIndependentOfSize(reverse('user-details'), add_companies)
+
+    def test_postings_list_is_constant(self):
+        print("[ListQueryCountAPITest] test_postings_list_is_constant")
+        self.client.force_authenticate(self.accountant)
+
+        def add_postings(n):
+            Postings.objects.bulk_create([
+                Postings(company=company, accountHandleNumber=1001, postDate='2025-01-01',
+                         postAmount='1.00', postCurrency='DKK', postDescription='Count')
+                for company in (self.company, self.second) for _ in range(n)
+            ])
+        add_postings(1)
+        self.assertQueryCountIndependentOfSize(reverse('postings-list'), add_postings)
+        self.assertQueryCountIndependentOfSize(reverse('postings-list'), add_postings, {'page_size': 50})
+        self.assertQueryCountIndependentOfSize(reverse('postings-list'), add_postings,
+                                               {'format': 'api'})
+
+class CompanyScopeCacheAPITest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.accountant)
+        self.other = Company.objects.create(companyName='OtherCo')
+        Postings.objects.create(company=self.other, accountHandleNumber=1001, postDate='2025-01-01',
+                                postAmount='1.00', postCurrency='DKK', postDescription='Other')
+        self.url = reverse('postings-list')
+
+    def scope_queries(self, method='get', url=None, data=None):
+        # a fresh user object per request, as with session authentication
+        self.client.force_authenticate(User.objects.get(pk=self.accountant.pk))
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url or self.url, data, format='json')
+        return response, [q['sql'] for q in queries if 'user_companies' in q['sql']]
+
+    def test_scope_is_cached_and_follows_company_changes(self):
+        print("[CompanyScopeCacheAPITest] test_scope_is_cached_and_follows_company_changes")
+        response, scope_sql = self.scope_queries()
+        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(scope_sql), 1)
+        response, scope_sql = self.scope_queries()
+        self.assertEqual(scope_sql, [])
+
+        # m2m_changed from either side of the relation drops the cached scope
+        self.accountant.companies.add(self.other)
+        self.assertEqual(len(self.scope_queries()[0].data), 1)
+        self.other.user_set.remove(self.accountant)
+        self.assertEqual(len(self.scope_queries()[0].data), 0)
+        self.other.user_set.add(self.accountant)
+        self.assertEqual(len(self.scope_queries()[0].data), 1)
+        # deleting a company cascades without m2m_changed
+        other_id = self.other.id
+        self.other.delete()
+        response, scope_sql = self.scope_queries(url=reverse('companies-summary', args=[other_id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(scope_sql), 1)
+
+    def test_posting_company_is_checked_against_the_scope(self):
+        print("[CompanyScopeCacheAPITest] test_posting_company_is_checked_against_the_scope")
+        data = {'accountHandleNumber': 1001, 'postDate': '2025-04-20', 'postAmount': '10',
+                'postCurrency': 'DKK', 'postDescription': 'Scoped'}
+        self.client.get(self.url)
+        response = self.client.post(self.url, {**data, 'company': self.other.id}, format='json')
+        print("Status code:", response.status_code, "Data:", response.data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {**data, 'company': self.company.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # the scope comes from the cache, only the company row itself is read
+        self.assertEqual(len([q for q in queries if 'FROM "SafeLedger_company"' in q['sql']]), 1)
+
+    def test_deleted_company_in_a_stale_scope_is_a_validation_error(self):
+        print("[CompanyScopeCacheAPITest] test_deleted_company_in_a_stale_scope_is_a_validation_error")
+        from .serializers import PostingsSerializer
+        request = mock.Mock(user=self.accountant)
+        data = {'accountHandleNumber': 1001, 'postDate': '2025-04-20', 'postAmount': '10',
+                'postCurrency': 'DKK', 'postDescription': 'Scoped'}
+        with mock.patch('SafeLedger.serializers.allowed_company_ids', return_value={self.company.id, 999_999}):
+            serializer = PostingsSerializer(data={**data, 'company': self.company.id}, context={'request': request})
+            self.assertTrue(serializer.is_valid())
+            self.assertEqual(serializer.validated_data['company'].companyName, 'TestCo')
+
+            serializer = PostingsSerializer(data={**data, 'company': 999_999}, context={'request': request})
+            self.assertFalse(serializer.is_valid())
+            self.assertIn('company', serializer.errors)
+
+class AsyncReadPathAPITest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.accountant)
+        other = Company.objects.create(companyName='OtherCo')
+        Postings.objects.bulk_create([
+            Postings(company=company, accountHandleNumber=1001, postDate=date(2025, 3, day),
+                     postAmount=Decimal(day), postCurrency='DKK', postDescription=f'Row {day}')
+            for company in (self.company, other) for day in range(1, 4)
+        ])
+        # session authentication takes the async views, force_authenticate the DRF views
+        self.session = APIClient()
+        self.session.force_login(self.accountant)
+
+    def drf_export(self, export_format):
+        response = self.client.get(reverse('postings-export', args=[export_format]))
+        return b''.join(response.streaming_content)
+
+    def test_session_list_matches_drf_view(self):
+        print("[AsyncReadPathAPITest] test_session_list_matches_drf_view")
+        from . import views
+        url = reverse('postings-list')
+        for params in ({}, {'page_size': 2}, {'fields': 'id,postAmount', 'date_from': '2025-03-02'}):
+            expected = self.client.get(url, params)
+            with mock.patch.object(views, '_postings_list', side_effect=AssertionError('not async')):
+                response = self.session.get(url, params)
+            self.assertEqual(response.content, expected.content)
+            self.assertEqual(response['Allow'], expected['Allow'])
+            self.assertIn('Accept', response['Vary'])
+
+        # errors, writes and the browsable API are answered by the DRF view
+        response = self.session.get(url, {'date_from': 'March'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'date_from': 'Use YYYY-MM-DD.'})
+        self.assertEqual(self.session.get(url, HTTP_ACCEPT='text/html').status_code, status.HTTP_200_OK)
+        self.assertEqual(APIClient().get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_asgi_export_and_session_views(self):
+        print("[AsyncReadPathAPITest] test_asgi_export_and_session_views")
+        response = await self.async_client.get(reverse('whoami'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        await self.async_client.aforce_login(self.accountant)
+        response = await self.async_client.get(reverse('whoami'))
+        self.assertEqual(response.json(), {'user': {'email': 'acct'}})
+        response = await self.async_client.get(reverse('session'))
+        self.assertTrue(response.json()['isAuthenticated'])
+        response = await self.async_client.get(reverse('user-details'))
+        self.assertEqual(response.json()['user']['companies'], [{'id': self.company.id, 'companyName': 'TestCo'}])
+
+        response = await self.async_client.get(reverse('postings-export', args=['csv']))
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(body, await sync_to_async(self.drf_export)('csv'))
+        self.assertEqual(len(body.splitlines()), 4)
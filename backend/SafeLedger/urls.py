@@ -3,7 +3,10 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
-    path('postings/', views.PostingsListView.as_view(), name='postings-list'),  # URL for the postings list view
+    path('postings/', views.postings_list_view, name='postings-list'),  # URL for the postings list view
+    path('postings/bulk/', views.PostingsBulkImportView.as_view(), name='postings-bulk'),  # URL for the bulk postings import view
+    path('postings/anomalies/', views.PostingAnomaliesView.as_view(), name='postings-anomalies'),  # URL for the most anomalous postings
+    path('postings/export/<str:export_format>/', views.postings_export_view, name='postings-export'),  # URL for the streaming postings export (csv or ndjson)
     path('postings/<int:pk>/', views.PostingsDetailView.as_view(), name='postings-detail'),  # URL for the postings detail view
     path('login/', views.login_view, name='login'),  # URL for the login view
     path('logout/', views.logout_view, name='logout'),  # URL for the logout view
@@ -13,9 +16,11 @@ urlpatterns = [
     path('user-details/', views.get_user_details, name='user-details'),  # URL for the user details view
     path('companies/', views.CompanyListCreateView.as_view(), name='companies-list'),  # URL for the companies list view
     path('companies/<int:pk>/', views.CompanyDetailView.as_view(), name='companies-detail'),  # URL for the companies detail view
+    path('companies/<int:pk>/summary/', views.CompanySummaryView.as_view(), name='companies-summary'),  # URL for the company ledger summary view
     path('customers/', views.CustomerListCreateView.as_view(), name='customers-list'),  # URL for the customers list view
     path('customers/<int:pk>/', views.CustomerDetailView.as_view(), name='customers-detail'),  # URL for the customers detail view
     path('accountants/', views.AccountantListCreateView.as_view(), name='accountants-list'),  # URL for the accountants list view
     path('accountants/<int:pk>/', views.AccountantDetailView.as_view(), name='accountants-detail'),  # URL for the accountants detail view
     path('retrain-ml/', views.RetrainModelView.as_view(), name='retrain-ml'),  # URL for the retrain ML model view
+    path('retrain-ml/<int:pk>/', views.RetrainJobDetailView.as_view(), name='retrain-job'),  # URL for the retrain job status view
 ]
@@ -1,28 +1,45 @@
 # backend/SafeLedger/views.py
 import os
 import json
-import pickle
-import numpy as np
+import hmac
 from rest_framework.permissions import BasePermission
-from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import IsolationForest
-from .ml.ml_model import scalers, iso_forests
+from .ml.ml_model import delete_model
 from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework import generics
+from rest_framework.reverse import reverse
+from rest_framework.exceptions import NotAcceptable, NotFound, ValidationError
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
-from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.contrib.auth import authenticate, login, logout, get_user_model
 from django.views.decorators.http import require_POST
 from django.views.generic import View
-from django.http import HttpResponse
-
-from .models import Postings, Company, User
-from .serializers import PostingsSerializer, CompanySerializer, CustomerSerializer, AccountantSerializer
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.cache import patch_vary_headers
+from django.db import transaction
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+from django.conf import settings
+
+from .models import Postings, Company, User, RetrainJob
+from .serializers import PostingsSerializer, CompanySerializer, CustomerSerializer, AccountantSerializer, RetrainJobSerializer, PostingSummarySerializer, SummaryTotalsSerializer
+from .jobs import enqueue_retrain
+from .filters import filter_postings, filter_values, requested_fields
+from .pagination import PostingsKeysetPagination
+from .exports import EXPORT_FORMATS, aexport_lines, aexport_rows, export_lines, export_rows
+from .fast_serializers import posting_rows, posting_values, render_json
+from .summaries import PERIODS, company_summary, record_deleted
+from .scoping import aallowed_company_ids, allowed_company_ids
+from . import metrics
 
     
 class FrontendAppView(View):
@@ -47,64 +64,276 @@ class RetrainModelView(APIView):
     def post(self, request):
         cid = request.data.get("company_id")
         # pick either one company or all
-        if cid:
-            companies = [Company.objects.get(id=cid)]
-        else:
-            companies = Company.objects.all()
-
-        # if single company, retrain only that one
-        if cid:
-            for comp in companies:
-                qs = Postings.objects.filter(company=comp)
-                X = np.array([[p.accountHandleNumber, float(p.postAmount)] for p in qs])
-                if X.size == 0:
-                    continue
-                scaler = StandardScaler().fit(X)
-                iso    = IsolationForest(contamination=0.05, random_state=42).fit(scaler.transform(X))
-                scalers[comp.id]     = scaler
-                iso_forests[comp.id] = iso
-        else:
-            # full retrain: clear and rebuild everything
-            scalers.clear()
-            iso_forests.clear()
-            for comp in companies:
-                qs = Postings.objects.filter(company=comp)
-                X = np.array([[p.accountHandleNumber, float(p.postAmount)] for p in qs])
-                if X.size == 0:
-                    continue
-                scaler = StandardScaler().fit(X)
-                iso    = IsolationForest(contamination=0.05, random_state=42).fit(scaler.transform(X))
-                scalers[comp.id]     = scaler
-                iso_forests[comp.id] = iso
-
-        # persist the updated dicts to disk
-        models_dir = os.path.join(os.path.dirname(__file__), "ml/models")
-        os.makedirs(models_dir, exist_ok=True)
-        with open(os.path.join(models_dir, "scalers.pkl"), "wb") as f:
-            pickle.dump(scalers, f)
-        with open(os.path.join(models_dir, "iso_forests.pkl"), "wb") as f:
-            pickle.dump(iso_forests, f)
-
+        company = Company.objects.get(id=cid) if cid else None
+        # "incremental" updates the models with the postings added since their last training
+        mode = request.data.get("mode", "full")
+        if mode not in dict(RetrainJob.MODE_CHOICES):
+            raise ValidationError({"mode": f"Use one of: {', '.join(dict(RetrainJob.MODE_CHOICES))}."})
+
+        # "sampled" refits on sample_size postings drawn at random, evenly over
+        # the ledger or ("sampling": "time") keeping each month's share
+        sample_size = request.data.get("sample_size")
+        if sample_size is not None:
+            try:
+                sample_size = int(sample_size)
+            except (TypeError, ValueError):
+                sample_size = 0
+            if sample_size < 1:
+                raise ValidationError({"sample_size": "Use a positive number of postings."})
+        sampling = request.data.get("sampling", "uniform")
+        if sampling not in dict(RetrainJob.SAMPLING_CHOICES):
+            raise ValidationError({"sampling": f"Use one of: {', '.join(dict(RetrainJob.SAMPLING_CHOICES))}."})
+
+        # training runs in the retrain_worker command, not in this request
+        job = enqueue_retrain(company=company, requested_by=request.user, mode=mode,
+                              sample_size=sample_size, sampling=sampling)
         return Response(
-            {"message": f"Retrained {1 if cid else len(scalers)} model(s)."},
-            status=status.HTTP_200_OK,
+            {
+                "message": f"Queued retrain of {job.tasks.count()} model(s).",
+                "job_id": job.id,
+                "status_url": reverse("retrain-job", args=[job.id], request=request),
+            },
+            status=status.HTTP_202_ACCEPTED,
         )
 
+class RetrainJobDetailView(generics.RetrieveAPIView):
+    queryset = RetrainJob.objects.all()
+    serializer_class = RetrainJobSerializer
+    permission_classes = [IsAuthenticated, IsSuperuserRole]
+
+def scoped_postings(user, company_id=None):
+    # accountants and customers only see the postings of their own companies
+    return postings_in(allowed_company_ids(user), company_id)
+
+def postings_in(allowed, company_id=None):
+    if allowed is not None:
+        qs = Postings.objects.filter(company_id__in=allowed)
+    else:
+        qs = Postings.objects.all()
+    if company_id:
+        qs = qs.filter(company_id=company_id)
+    return qs
+
+def wants_fast_json(request):
+    # plain compact JSON only; the browsable API and ?indent keep the serializer
+    return (type(request.accepted_renderer) is JSONRenderer
+            and "indent" not in (request.accepted_media_type or ""))
+
+def fast_json_response(request, data):
+    response = HttpResponse(render_json(data), content_type=request.accepted_renderer.media_type)
+    # like a DRF Response, so tests and callers can still read response.data
+    response.data = data
+    return response
+
 class PostingsListView(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = PostingsSerializer
+    pagination_class = PostingsKeysetPagination
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role in ("accountant", "customer"):
-            qs = Postings.objects.filter(company__in=user.companies.all())
+        qs = scoped_postings(self.request.user, self.request.query_params.get("company"))
+        if self.request.method == "GET":
+            qs = filter_postings(qs, self.request.query_params)
+            fields = self.get_fields()
+            if fields is not None:
+                # id and postDate are always loaded for the pagination cursor
+                qs = qs.only(*{*fields, "id", "postDate"})
+        return qs
+
+    def get_fields(self):
+        return requested_fields(self.request.query_params, PostingsSerializer.Meta.fields)
+
+    def list(self, request, *args, **kwargs):
+        if not wants_fast_json(request):
+            return super().list(request, *args, **kwargs)
+        # same bytes as the serializer, built from values_list() rows
+        fields = self.get_fields()
+        qs = posting_values(self.filter_queryset(self.get_queryset()), fields)
+        page = self.paginate_queryset(qs)
+        data = posting_rows(qs if page is None else page, fields)
+        if page is not None:
+            data = self.paginator.get_paginated_data(data)
+        return fast_json_response(request, data)
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method == "GET":
+            kwargs.setdefault("fields", self.get_fields())
+        return super().get_serializer(*args, **kwargs)
+
+class PostingAnomaliesView(generics.ListAPIView):
+    """
+    The most anomalous postings first, by their stored anomaly score, so a
+    review can move its threshold without re-scoring the ledger. ?limit=
+    (default 50, at most 1000) and the postings list filters, e.g. ?company=,
+    ?date_from=, ?date_to= and ?score_max=. Postings that were never scored
+    are left out.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = PostingsSerializer
+    pagination_class = None
+    default_limit = 50
+    max_limit = 1000
+
+    def get_limit(self):
+        raw = self.request.query_params.get("limit")
+        if raw in (None, ""):
+            return self.default_limit
+        try:
+            limit = int(raw)
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= self.max_limit:
+            raise ValidationError({"limit": f"Must be an integer from 1 to {self.max_limit}."})
+        return limit
+
+    def get_queryset(self):
+        params = self.request.query_params
+        qs = filter_postings(scoped_postings(self.request.user, params.get("company")), params)
+        # served from postings_company_score_idx for one company
+        return qs.filter(anomaly_score__isnull=False).order_by("anomaly_score", "id")[:self.get_limit()]
+
+    def list(self, request, *args, **kwargs):
+        if not wants_fast_json(request):
+            return super().list(request, *args, **kwargs)
+        return fast_json_response(request, posting_rows(posting_values(self.get_queryset())))
+
+class PostingsExportView(APIView):
+    """
+    Streams every posting the user can see as ';'-separated CSV or NDJSON.
+    Rows are read with a server-side cursor and written as they arrive, so
+    memory stays flat however large the ledger is. Takes the same ?company=
+    and filter parameters as the postings list.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, export_format):
+        if export_format not in EXPORT_FORMATS:
+            raise NotFound(f"Unknown export format, use one of: {', '.join(EXPORT_FORMATS)}.")
+        qs = filter_postings(scoped_postings(request.user, request.query_params.get("company")),
+                             request.query_params)
+        return export_response(export_lines(export_rows(qs), export_format), export_format)
+
+def export_response(lines, export_format):
+    _, _, content_type, extension = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="postings.{extension}"'
+    return response
+
+# The views below serve the read paths of the postings API on the async ORM,
+# so under ASGI (gunicorn_asgi.conf.py) a long list or export waits on the
+# database without holding a worker thread. They only take the common case,
+# a session-authenticated GET answered with plain JSON or an export; anything
+# else (writes, Basic auth, the browsable API, invalid parameters) is handed
+# to the DRF view, which produces the exact same response as before.
+
+_postings_list = PostingsListView.as_view()
+_postings_export = PostingsExportView.as_view()
+
+async def session_user(request):
+    # the user DRF's SessionAuthentication would pick, None if the DRF view should decide
+    if request.method != "GET" or "HTTP_AUTHORIZATION" in request.META:
+        return None
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+def drf_view(view_class, request):
+    view = view_class(format_kwarg=None)
+    view.setup(request)
+    return view
+
+def add_drf_headers(response, view):
+    # the Allow and Vary headers APIView.finalize_response sets
+    for key, value in view.default_response_headers.items():
+        if key == "Vary":
+            patch_vary_headers(response, [value])
+        else:
+            response[key] = value
+    return response
+
+def negotiate_fast_json(request, view):
+    """
+    Wraps a Django request in a DRF Request with the renderer the view would
+    pick; returns it when that is plain JSON, otherwise None.
+    """
+    drf_request = Request(request)
+    try:
+        drf_request.accepted_renderer, drf_request.accepted_media_type = (
+            view.perform_content_negotiation(drf_request))
+    except NotAcceptable:
+        return None
+    return drf_request if wants_fast_json(drf_request) else None
+
+async def postings_list_data(request, user):
+    params = request.query_params
+    qs = filter_postings(postings_in(await aallowed_company_ids(user), params.get("company")), params)
+    fields = requested_fields(params, PostingsSerializer.Meta.fields)
+    qs = posting_values(qs, fields)
+    paginator = PostingsKeysetPagination()
+    page = await paginator.apaginate_queryset(qs, request)
+    if page is None:
+        return posting_rows([row async for row in qs], fields)
+    return paginator.get_paginated_data(posting_rows(page, fields))
+
+@csrf_exempt
+async def postings_list_view(request):
+    user = await session_user(request)
+    view = drf_view(PostingsListView, request)
+    drf_request = user and negotiate_fast_json(request, view)
+    if drf_request:
+        try:
+            data = await postings_list_data(drf_request, user)
+        except (ValidationError, NotFound):
+            pass
         else:
-            qs = Postings.objects.all()
+            return add_drf_headers(fast_json_response(drf_request, data), view)
+    return await sync_to_async(_postings_list)(request)
+
+@csrf_exempt
+async def postings_export_view(request, export_format):
+    user = await session_user(request)
+    if user and export_format in EXPORT_FORMATS:
+        params = request.GET
+        try:
+            qs = filter_postings(postings_in(await aallowed_company_ids(user), params.get("company")), params)
+        except ValidationError:
+            pass
+        else:
+            if isinstance(request, ASGIRequest):
+                lines = aexport_lines(aexport_rows(qs), export_format)
+            else:
+                # a WSGI server can only consume a sync iterator
+                lines = export_lines(export_rows(qs), export_format)
+            return add_drf_headers(export_response(lines, export_format), drf_view(PostingsExportView, request))
+    return await sync_to_async(_postings_export)(request, export_format=export_format)
+
+class PostingsBulkImportView(APIView):
+    """
+    Imports many postings in one request, either as a JSON list (or
+    {"postings": [...]}) or as an uploaded ';'-separated CSV file.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, MultiPartParser, FormParser]
 
-        company_id = self.request.query_params.get("company")
-        if company_id:
-            qs = qs.filter(company_id=company_id)
-        return qs
+    def post(self, request):
+        # pandas is only needed here, keep it out of module import
+        from .ingest import read_postings_csv, read_postings_json, clean_postings_frame, import_postings
+
+        upload = request.FILES.get("file")
+        if upload is not None:
+            df = read_postings_csv(upload)
+        else:
+            rows = request.data
+            if isinstance(rows, dict):
+                rows = rows.get("postings")
+            df = read_postings_json(rows)
+
+        allowed = allowed_company_ids(request.user)
+
+        result = import_postings(clean_postings_frame(df, allowed_company_ids=allowed))
+        return Response(
+            {"message": f"Imported {result['created']} posting(s).", **result},
+            status=status.HTTP_201_CREATED,
+        )
 
 class PostingsDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Postings.objects.all()
@@ -112,10 +341,18 @@ class PostingsDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role in ("accountant", "customer"):
-            return Postings.objects.filter(company__in=user.companies.all())
-        return super().get_queryset()
+        return scoped_postings(self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not wants_fast_json(request):
+            return super().retrieve(request, *args, **kwargs)
+        row = get_object_or_404(posting_values(self.get_queryset()), pk=kwargs["pk"])
+        return fast_json_response(request, posting_rows([row])[0])
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            record_deleted([instance])
+            instance.delete()
 
 class CompanyListCreateView(generics.ListCreateAPIView):
     queryset = Company.objects.all()
@@ -126,50 +363,79 @@ class CompanyListCreateView(generics.ListCreateAPIView):
         company = serializer.save()
         self.request.user.companies.add(company)
 
-        scaler = StandardScaler()
-        iso = IsolationForest(contamination=0.05, random_state=42)
-        scalers[company.id] = scaler
-        iso_forests[company.id] = iso
-
-        models_dir = os.path.join(os.path.dirname(__file__), "ml/models")
-        os.makedirs(models_dir, exist_ok=True)
-        with open(os.path.join(models_dir, "scalers.pkl"), "wb") as f:
-            pickle.dump(scalers, f)
-        with open(os.path.join(models_dir, "iso_forests.pkl"), "wb") as f:
-            pickle.dump(iso_forests, f)
+        # a reused company id must not pick up an old company's model,
+        # postings are not flagged until the first retrain
+        delete_model(company.id)
 
 class CompanyDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Company.objects.all()
     serializer_class = CompanySerializer
     permission_classes = [IsAuthenticated]
 
+    def perform_destroy(self, instance):
+        company_id = instance.id
+        instance.delete()
+        delete_model(company_id)
+
+class CompanySummaryView(APIView):
+    """
+    Per-period totals, counts and suspicious counts per account and currency,
+    read from the PostingDailySummary rollup instead of the whole ledger.
+    ?group=day|month|year, ?date_from= and ?date_to= (YYYY-MM-DD).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        user = request.user
+        allowed = allowed_company_ids(user)
+        if allowed is not None and pk not in allowed:
+            raise NotFound()
+        company = get_object_or_404(Company, pk=pk)
+
+        period = request.query_params.get("group", "day")
+        if period not in PERIODS:
+            raise ValidationError({"group": f"Use one of: {', '.join(PERIODS)}."})
+        dates = filter_values(request.query_params, ("date_from", "date_to"))
+        rows = company_summary(company.id, period, dates.get("date_from"), dates.get("date_to"))
+
+        # amounts in different currencies are never added together
+        totals = {}
+        for row in rows:
+            currency = totals.setdefault(row["postCurrency"], {"total": 0, "count": 0, "suspicious_count": 0})
+            for key in currency:
+                currency[key] += row[key]
+        return Response({
+            "company": company.id,
+            "group": period,
+            "totals": {cur: SummaryTotalsSerializer(t).data for cur, t in totals.items()},
+            "rows": PostingSummarySerializer(rows, many=True).data,
+        })
+
+def customers_for(user):
+    if user.role == "accountant":
+        # a customer sharing several companies with the accountant would be
+        # joined once per company without distinct()
+        qs = User.objects.filter(role="customer", companies__id__in=allowed_company_ids(user)).distinct()
+    elif user.role == "superuser":
+        qs = User.objects.filter(role="customer")
+    else:
+        return User.objects.none()
+    # company_name for every customer in one extra query
+    return qs.prefetch_related(Prefetch("companies", queryset=Company.objects.only("id", "companyName")))
+
 class CustomerListCreateView(generics.ListCreateAPIView):
     serializer_class = CustomerSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == "accountant":
-            return User.objects.filter(
-                role="customer", companies__in=user.companies.all()
-            )
-        if user.role == "superuser":
-            return User.objects.filter(role="customer")
-        return User.objects.none()
+        return customers_for(self.request.user)
     
 class CustomerDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = CustomerSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == "accountant":
-            return User.objects.filter(
-                role="customer", companies__in=user.companies.all()
-            )
-        if user.role == "superuser":
-            return User.objects.filter(role="customer")
-        return User.objects.none()
+        return customers_for(self.request.user)
     
 class AccountantListCreateView(generics.ListCreateAPIView):
     serializer_class = AccountantSerializer
@@ -222,19 +488,16 @@ def logout_view(request):
     return JsonResponse({"message": "Logout successful."}, status=200)
 
 @login_required
-def get_user_details(request):
-    if not request.user.is_authenticated:
+async def get_user_details(request):
+    user = await request.auser()
+    if not user.is_authenticated:
         return JsonResponse({"isAuthenticated": False}, status=401)
 
-    user = request.user
     user_data = {
         "username": user.username,
         "email": user.email,
         "role": user.role,
-        "companies": [
-            {"id": c.id, "companyName": c.companyName}
-            for c in user.companies.all()
-        ],
+        "companies": [company async for company in user.companies.values("id", "companyName")],
     }
     return JsonResponse({"isAuthenticated": True, "user": user_data}, status=200)
 
@@ -243,13 +506,26 @@ def set_csrf_cookie(request):
     return JsonResponse({"csrfToken": request.META.get("CSRF_COOKIE")}, status=200)
 
 @ensure_csrf_cookie
-def session_view(request):
-    if not request.user.is_authenticated:
+async def session_view(request):
+    user = await request.auser()
+    if not user.is_authenticated:
         return JsonResponse({"isAuthenticated": False}, status=401)
-    return JsonResponse({"isAuthenticated": True, "user": {"email": request.user.username}}, status=200)
+    return JsonResponse({"isAuthenticated": True, "user": {"email": user.username}}, status=200)
 
-def whoami_view(request):
-    if not request.user.is_authenticated:
+async def whoami_view(request):
+    user = await request.auser()
+    if not user.is_authenticated:
         return JsonResponse({"isAuthenticated": False}, status=401)
-    return JsonResponse({"user": {"email": request.user.username}}, status=200)
-
+    return JsonResponse({"user": {"email": user.username}}, status=200)
+
+
+def metrics_view(request):
+    # scraped by Prometheus, so no session: a bearer token, or public only
+    # when explicitly configured, otherwise the endpoint does not exist
+    if settings.METRICS_TOKEN:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(supplied.encode(), settings.METRICS_TOKEN.encode()):
+            return HttpResponse(status=401)
+    elif not settings.METRICS_PUBLIC:
+        return HttpResponse(status=404)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
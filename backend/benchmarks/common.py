@@ -0,0 +1,55 @@
+# backend/benchmarks/common.py
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'results')
+
+
+def setup_django(db_name=None):
+    """
+    Sets up Django for a benchmark script. db_name points the default
+    database at a scratch SQLite file so benchmarks never touch db.sqlite3.
+    """
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    from django.conf import settings
+    if db_name is not None:
+        settings.DATABASES['default']['NAME'] = db_name
+    import django
+    django.setup()
+
+
+def timed(fn, repeat=5):
+    """Median and min wall time of fn() in seconds, after one warm-up call."""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return {'median_s': round(statistics.median(samples), 6), 'min_s': round(min(samples), 6)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(name, results, path=None):
+    """Saves results as JSON, by default to benchmarks/results/<name>-<commit>.json."""
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{name}-{git_commit() or 'local'}.json")
+    payload = {'benchmark': name, 'commit': git_commit(), 'python': sys.version.split()[0], **results}
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2, default=str)
+    return path
@@ -0,0 +1,96 @@
+# backend/benchmarks/compare.py
+"""
+Compares two benchmark result files, e.g. the same benchmark run on two
+commits, and lists every timing that got worse by more than the threshold.
+
+    python benchmarks/compare.py results/micro-1a2b3c4.json results/micro-5d6e7f8.json
+    python benchmarks/compare.py old.json new.json --threshold 0.05
+
+Times (keys ending in _s, _ms, _us or named seconds) and error counts are
+better when lower, rates (keys ending in _per_s) when higher. Settings such
+as row counts are only shown when they differ, since that makes the runs
+incomparable. Exits with status 1 when something regressed, so it can gate
+a CI job.
+"""
+import argparse
+import json
+import sys
+
+# result keys that describe the run rather than measure it
+IGNORED = {'benchmark', 'commit', 'python'}
+# outcomes already covered by a rate, like a load test's request count
+UNCOMPARED = {'requests', 'duration_s'}
+
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f'{prefix}.{key}' if prefix else key)
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            yield from flatten(item, f'{prefix}[{i}]')
+    else:
+        yield prefix, value
+
+
+def direction(path):
+    """1 when higher is better, -1 when lower is better, 0 for values that are not measurements."""
+    key = path.rsplit('.', 1)[-1]
+    if key.endswith('_per_s'):
+        return 1
+    if key.endswith(('_s', '_ms', '_us')) or key in ('seconds', 'errors'):
+        return -1
+    return 0
+
+
+def compare(old, new, threshold):
+    old, new = dict(flatten(old)), dict(flatten(new))
+    rows, regressions, mismatched = [], [], []
+    for path, before in old.items():
+        if path.split('.', 1)[0] in IGNORED or path.rsplit('.', 1)[-1] in UNCOMPARED or path not in new:
+            continue
+        after = new[path]
+        sign = direction(path)
+        if not sign:
+            if before != after:
+                mismatched.append((path, before, after))
+            continue
+        if not isinstance(before, (int, float)) or not isinstance(after, (int, float)):
+            continue
+        if before:
+            change = (after - before) / abs(before)
+        else:
+            # errors where there were none
+            change = float('inf') if after > 0 else 0.0
+        worse = -sign * change > threshold
+        rows.append((path, before, after, change, worse))
+        if worse:
+            regressions.append(path)
+    return rows, regressions, mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative change that counts as a regression (default 0.10)')
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows, regressions, mismatched = compare(old, new, args.threshold)
+
+    print(f"{old.get('benchmark')}: {old.get('commit')} -> {new.get('commit')}")
+    for path, before, after in mismatched:
+        print(f'  differs: {path}: {before} -> {after}')
+    for path, before, after, change, worse in rows:
+        print(f"{'REGRESSION' if worse else '':>10}  {path:<50} {before:>12} {after:>12} {change:>+8.1%}")
+    print(f'{len(regressions)} regression(s) over {args.threshold:.0%}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# backend/benchmarks/concurrency.py
+"""
+Write throughput of concurrent processes creating postings, like several
+gunicorn workers taking POST /api/postings/ at once, for each database mode.
+
+    python benchmarks/concurrency.py --processes 4 --writes 300
+    python benchmarks/concurrency.py --modes sqlite-default sqlite-tuned postgresql
+
+Each write is one transaction inserting a posting and updating its daily
+summary row, which is what PostingsSerializer.create does. Reader processes
+run the company's postings list and summary queries meanwhile, like open
+dashboards; on a default SQLite database they block committing writers.
+The postgresql
+mode uses the SAFELEDGER_DB_* variables from the environment and must point
+at an empty, disposable database.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import BACKEND_DIR, write_results
+
+MODES = {
+    'sqlite-default': {'SAFELEDGER_DB_ENGINE': 'sqlite', 'SAFELEDGER_SQLITE_TUNED': '0'},
+    'sqlite-tuned': {'SAFELEDGER_DB_ENGINE': 'sqlite', 'SAFELEDGER_SQLITE_TUNED': '1'},
+    'postgresql': {'SAFELEDGER_DB_ENGINE': 'postgresql'},
+}
+
+
+def worker(writes, company_id, seed):
+    """Runs in a child process; prints a JSON line with its own counts."""
+    from common import setup_django
+    setup_django()
+    from datetime import date, timedelta
+    from decimal import Decimal
+    from django.db import OperationalError, transaction
+    from SafeLedger.models import Postings
+    from SafeLedger.summaries import record_created
+
+    done = errors = 0
+    started = time.perf_counter()
+    for i in range(writes):
+        try:
+            with transaction.atomic():
+                posting = Postings.objects.create(
+                    company_id=company_id, accountHandleNumber=1001 + (seed + i) % 7,
+                    postDate=date(2025, 1, 1) + timedelta(days=(seed * writes + i) % 28),
+                    postAmount=Decimal(seed * 1000 + i) / 100, postCurrency='DKK',
+                    postDescription='Concurrency benchmark',
+                )
+                record_created([posting])
+            done += 1
+        except OperationalError:
+            # "database is locked" once the busy timeout runs out
+            errors += 1
+    print(json.dumps({'writes': done, 'errors': errors, 'seconds': time.perf_counter() - started}))
+
+
+def reader(company_id, running_flag):
+    """Reads until the parent removes running_flag; prints its counts."""
+    from common import setup_django
+    setup_django()
+    from django.db import OperationalError
+    from SafeLedger.models import Postings
+    from SafeLedger.summaries import company_summary
+
+    reads = errors = 0
+    while os.path.exists(running_flag):
+        try:
+            list(Postings.objects.filter(company_id=company_id).values_list('id', 'postAmount'))
+            company_summary(company_id)
+            reads += 1
+        except OperationalError:
+            errors += 1
+    print(json.dumps({'reads': reads, 'errors': errors}))
+
+
+def run_mode(mode, processes, writes, readers):
+    env = {**os.environ, **MODES[mode], 'SAFELEDGER_WARM_MODELS': '0'}
+    tmp = tempfile.TemporaryDirectory(prefix='safeledger-bench-')
+    running_flag = os.path.join(tmp.name, 'running')
+    open(running_flag, 'w').close()
+    if mode.startswith('sqlite'):
+        env['SAFELEDGER_DB_NAME'] = os.path.join(tmp.name, 'bench.sqlite3')
+    manage = [sys.executable, os.path.join(BACKEND_DIR, 'manage.py')]
+    subprocess.run(manage + ['migrate', '-v0'], env=env, check=True, cwd=BACKEND_DIR)
+    company_id = subprocess.run(
+        manage + ['shell', '-v0', '-c', "from SafeLedger.models import Company; "
+                                 "print(Company.objects.get_or_create(companyName='BenchCo')[0].id)"],
+        env=env, check=True, cwd=BACKEND_DIR, capture_output=True, text=True,
+    ).stdout.strip()
+
+    def spawn(*args):
+        return subprocess.Popen([sys.executable, __file__, *map(str, args)],
+                                env=env, cwd=BACKEND_DIR, stdout=subprocess.PIPE, text=True)
+
+    def result(child):
+        return json.loads(child.communicate()[0].strip().splitlines()[-1])
+
+    reading = [spawn('--reader', company_id, running_flag) for _ in range(readers)]
+    started = time.perf_counter()
+    writing = [spawn('--worker', writes, company_id, seed) for seed in range(processes)]
+    results = [result(child) for child in writing]
+    wall = time.perf_counter() - started
+    os.unlink(running_flag)
+    read_results = [result(child) for child in reading]
+    tmp.cleanup()
+
+    written = sum(r['writes'] for r in results)
+    return {
+        'processes': processes,
+        'readers': readers,
+        'writes': written,
+        'errors': sum(r['errors'] for r in results),
+        'reads': sum(r['reads'] for r in read_results),
+        'read_errors': sum(r['errors'] for r in read_results),
+        # includes process start-up; compare modes with each other, not in absolute terms
+        'wall_s': round(wall, 3),
+        'writes_per_s': round(written / max(r['seconds'] for r in results), 1),
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        worker(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == '--reader':
+        reader(int(sys.argv[2]), sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=['sqlite-default', 'sqlite-tuned'])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--writes', type=int, default=300, help='Writes per process')
+    parser.add_argument('--readers', type=int, default=2, help='Processes reading meanwhile')
+    parser.add_argument('--output', help='Where to write the JSON results')
+    args = parser.parse_args()
+
+    results = {mode: run_mode(mode, args.processes, args.writes, args.readers) for mode in args.modes}
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {write_results('concurrency', {'modes': results}, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
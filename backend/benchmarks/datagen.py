@@ -0,0 +1,154 @@
+# backend/benchmarks/datagen.py
+"""
+Synthetic ledger data in the style of Documents/company.csv and the
+posting.csv read by ml/train_model.py. Postings are generated with NumPy and
+inserted with executemany in large batches, so millions of rows take
+seconds to minutes rather than hours through the ORM.
+
+Also seeds a scratch database on its own, for the load test or manual runs:
+
+    python benchmarks/datagen.py --db /tmp/bench.sqlite3 --companies 50 --rows 2000000
+"""
+import argparse
+import os
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from common import BACKEND_DIR, setup_django
+
+COMPANY_CSV = os.path.join(os.path.dirname(BACKEND_DIR), 'Documents', 'company.csv')
+
+BENCH_PASSWORD = 'bench-password-1'
+
+ACCOUNTS = np.array([1001, 1010, 1100, 1200, 2001, 2100, 2200, 3001, 3100, 4001, 4100, 5001, 6001, 7001])
+CURRENCIES = np.array(['DKK'] * 8 + ['EUR', 'USD'])
+DESCRIPTIONS = np.array(['Faktura', 'Kreditnota', 'Equus regninger', 'Løn', 'Husleje',
+                         'Moms', 'Bankgebyr', 'Udlæg', 'Varekøb', 'Salg'])
+
+
+def company_names(count):
+    """Names from Documents/company.csv, suffixed when more are needed."""
+    with open(COMPANY_CSV, encoding='utf-8') as f:
+        base = [line.strip().split(';', 1)[1] for line in f if ';' in line]
+    return [base[i % len(base)] + ('' if i < len(base) else f' {i // len(base) + 1}')
+            for i in range(count)]
+
+
+def create_companies(count):
+    from SafeLedger.models import Company
+    existing = set(Company.objects.values_list('companyName', flat=True))
+    Company.objects.bulk_create([
+        Company(companyName=name) for name in company_names(count) if name not in existing
+    ])
+    return list(Company.objects.order_by('id').values_list('id', flat=True)[:count])
+
+
+def create_users(company_ids, accountants=5, customers_per_company=1, password=BENCH_PASSWORD):
+    """
+    A superuser, accountants sharing the companies round-robin and customers
+    of one company each, all with the same password. The password is hashed
+    once: a full PBKDF2 hash per user would take longer than the postings.
+    Returns {role: [username, ...]}.
+    """
+    from django.contrib.auth.hashers import make_password
+    from SafeLedger.models import User
+
+    hashed = make_password(password)
+    users = [User(username='bench-admin', email='bench-admin@bench.dk', role='superuser', password=hashed)]
+    users += [User(username=f'bench-accountant-{i}', email=f'bench-accountant-{i}@bench.dk',
+                   role='accountant', password=hashed) for i in range(accountants)]
+    users += [User(username=f'bench-customer-{cid}-{i}', email=f'bench-customer-{cid}-{i}@bench.dk',
+                   role='customer', password=hashed)
+              for cid in company_ids for i in range(customers_per_company)]
+    existing = set(User.objects.filter(username__startswith='bench-').values_list('username', flat=True))
+    User.objects.bulk_create([user for user in users if user.username not in existing])
+
+    by_name = {user.username: user for user in User.objects.filter(username__startswith='bench-')}
+    links = []
+    for i in range(accountants):
+        user = by_name[f'bench-accountant-{i}']
+        links += [(user.id, cid) for cid in company_ids[i::accountants]]
+    for cid in company_ids:
+        links += [(by_name[f'bench-customer-{cid}-{i}'].id, cid) for i in range(customers_per_company)]
+    through = User.companies.through
+    through.objects.bulk_create([through(user_id=uid, company_id=cid) for uid, cid in links],
+                                ignore_conflicts=True)
+
+    roles = {}
+    for user in users:
+        roles.setdefault(user.role, []).append(user.username)
+    return roles
+
+
+def posting_batches(company_ids, rows, seed=0, batch_size=50000, suspicious_rate=0.05,
+                    start=date(2020, 1, 1), days=5 * 365):
+    """
+    Yields lists of posting tuples (company_id, accountHandleNumber, postDate,
+    postAmount, postCurrency, postDescription, is_suspicious). Companies get
+    Zipf-like sizes, so a few large companies dominate as in a real client book.
+    """
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, len(company_ids) + 1) ** 0.8
+    weights /= weights.sum()
+    company_ids = np.asarray(company_ids)
+    day_offsets = np.arange(days)
+    for offset in range(0, rows, batch_size):
+        n = min(batch_size, rows - offset)
+        companies = rng.choice(company_ids, size=n, p=weights)
+        accounts = rng.choice(ACCOUNTS, size=n)
+        dates = [(start + timedelta(days=int(d))).isoformat() for d in rng.choice(day_offsets, size=n)]
+        amounts = np.round(rng.lognormal(7, 1.5, size=n) * rng.choice([-1, 1], size=n), 2)
+        currencies = rng.choice(CURRENCIES, size=n)
+        descriptions = rng.choice(DESCRIPTIONS, size=n)
+        suspicious = rng.random(n) < suspicious_rate
+        yield list(zip(companies.tolist(), accounts.tolist(), dates, [f'{a:.2f}' for a in amounts],
+                       currencies.tolist(), descriptions.tolist(), suspicious.tolist()))
+
+
+def insert_postings(company_ids, rows, seed=0, batch_size=50000, progress=None):
+    from django.db import connection, transaction
+    from SafeLedger.models import Postings
+
+    table = connection.ops.quote_name(Postings._meta.db_table)
+    columns = ['company_id', 'accountHandleNumber', 'postDate', 'postAmount',
+               'postCurrency', 'postDescription', 'is_suspicious']
+    sql = (f"INSERT INTO {table} ({', '.join(connection.ops.quote_name(c) for c in columns)}) "
+           f"VALUES ({', '.join(['%s'] * len(columns))})")
+    inserted = 0
+    for batch in posting_batches(company_ids, rows, seed=seed, batch_size=batch_size):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, batch)
+        inserted += len(batch)
+        if progress:
+            progress(inserted)
+    return inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a scratch database with synthetic SafeLedger data.')
+    parser.add_argument('--db', required=True, help='SQLite file to create or extend (never db.sqlite3)')
+    parser.add_argument('--companies', type=int, default=50)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--accountants', type=int, default=5)
+    parser.add_argument('--customers-per-company', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup_django(args.db)
+    from django.core.management import call_command
+    from SafeLedger.summaries import rebuild_summaries
+    call_command('migrate', verbosity=0)
+    started = time.perf_counter()
+    company_ids = create_companies(args.companies)
+    roles = create_users(company_ids, args.accountants, args.customers_per_company)
+    insert_postings(company_ids, args.rows, seed=args.seed,
+                    progress=lambda n: print(f'{n} postings', end='\r', flush=True))
+    rebuild_summaries()
+    print(f'\n{len(company_ids)} companies, {sum(map(len, roles.values()))} users and {args.rows} postings '
+          f'in {time.perf_counter() - started:.1f}s (password: {BENCH_PASSWORD})')
+
+
+if __name__ == '__main__':
+    main()
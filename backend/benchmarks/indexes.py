@@ -0,0 +1,139 @@
+# backend/benchmarks/indexes.py
+"""
+Shows the query plans and latencies of the ledger's hot queries before and
+after the postings indexes (migration 0008) on a generated dataset.
+
+    python benchmarks/indexes.py --rows 5000000
+
+The data goes into a scratch SQLite file, never into db.sqlite3.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import date
+from importlib import import_module
+
+from common import setup_django, timed, write_results
+
+# the schema stays at the latest migration, only these indexes are dropped
+# and re-created, so the queries run against the current Postings model
+INDEX_MIGRATION = 'SafeLedger.migrations.0008_postings_indexes'
+
+
+def postings_indexes():
+    return [operation.index for operation in import_module(INDEX_MIGRATION).Migration.operations]
+
+
+def set_indexes(present):
+    """Creates or drops the 0008 indexes, skipping those already in that state."""
+    from django.db import connection
+    from SafeLedger.models import Postings
+
+    with connection.cursor() as cursor:
+        existing = connection.introspection.get_constraints(cursor, Postings._meta.db_table)
+    with connection.schema_editor() as editor:
+        for index in postings_indexes():
+            if present and index.name not in existing:
+                editor.add_index(Postings, index)
+            elif not present and index.name in existing:
+                editor.remove_index(Postings, index)
+
+
+def hot_queries(company_id):
+    from django.db.models import Count, Q, Sum
+    from SafeLedger.models import Postings
+
+    company = Postings.objects.filter(company_id=company_id)
+    middle, last_id = date(2022, 6, 30), 0
+    return {
+        # first and a deep page of GET /api/postings/?company=<id>&page_size=500
+        'company_first_page': company.order_by('postDate', 'id')[:501],
+        'company_deep_page': company.filter(Q(postDate__gt=middle) | Q(postDate=middle, id__gt=last_id))
+                                    .order_by('postDate', 'id')[:501],
+        # ?date_from=&date_to= on one company, summed like a report
+        'company_date_range': company.filter(postDate__range=(date(2023, 1, 1), date(2023, 3, 31)))
+                                     .values('company_id').annotate(n=Count('id'), total=Sum('postAmount')),
+        # anomaly review: ?is_suspicious=true, newest first
+        'company_suspicious_review': company.filter(is_suspicious=True).order_by('-postDate')[:100],
+        # admin date_hierarchy drill-down across all companies (filters as gte/lt)
+        'admin_month': Postings.objects.filter(postDate__gte=date(2023, 6, 1), postDate__lt=date(2023, 7, 1))
+                                       .order_by('-postDate')[:100],
+    }
+
+
+def run_queries(company_id, repeat):
+    results = {}
+    for name, qs in hot_queries(company_id).items():
+        results[name] = {
+            'plan': qs.explain(),
+            **timed(lambda: list(qs.all()), repeat=repeat),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--companies', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help='SQLite file to use (default: a temporary file, deleted afterwards)')
+    parser.add_argument('--output', help='Where to write the JSON results')
+    args = parser.parse_args()
+
+    db = args.db or os.path.join(tempfile.mkdtemp(prefix='safeledger-bench-'), 'bench.sqlite3')
+    setup_django(db)
+    from django.core.management import call_command
+    from django.db import connection
+    from SafeLedger.models import Postings
+    import datagen
+
+    try:
+        call_command('migrate', 'SafeLedger', verbosity=0)
+        set_indexes(False)
+        if not Postings.objects.exists():
+            started = time.perf_counter()
+            company_ids = datagen.create_companies(args.companies)
+            datagen.insert_postings(company_ids, args.rows, seed=args.seed,
+                                    progress=lambda n: print(f'  {n} rows', end='\r', flush=True))
+            print(f'Generated {args.rows} postings in {time.perf_counter() - started:.1f}s')
+        # datagen gives the first company the most postings
+        company_id = Postings.objects.order_by('company_id').values_list('company_id', flat=True).first()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        before = run_queries(company_id, args.repeat)
+
+        started = time.perf_counter()
+        set_indexes(True)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        build_s = time.perf_counter() - started
+        after = run_queries(company_id, args.repeat)
+
+        summary = {
+            name: {
+                'before_ms': round(before[name]['median_s'] * 1000, 2),
+                'after_ms': round(after[name]['median_s'] * 1000, 2),
+                'speedup': round(before[name]['median_s'] / max(after[name]['median_s'], 1e-9), 1),
+            }
+            for name in before
+        }
+        print(json.dumps(summary, indent=2))
+        path = write_results('indexes', {
+            'rows': Postings.objects.count(), 'company_id': company_id, 'index_build_s': round(build_s, 2),
+            'summary': summary, 'before': before, 'after': after,
+        }, args.output)
+        print(f'Results written to {path}')
+    finally:
+        if not args.db:
+            connection.close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(db + suffix):
+                    os.unlink(db + suffix)
+            os.rmdir(os.path.dirname(db))
+
+
+if __name__ == '__main__':
+    main()
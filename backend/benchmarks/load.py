@@ -0,0 +1,262 @@
+# backend/benchmarks/load.py
+"""
+Load test of the API under gunicorn: concurrent clients log in, page
+through postings, create postings and queue retrains, and the latency of
+each endpoint is recorded.
+
+    python benchmarks/load.py --rows 500000 --clients 16 --duration 30
+    python benchmarks/load.py --server asgi --mix list=80 create=20
+    python benchmarks/load.py --retrain-worker
+
+The server runs the Procfile's gunicorn profile (wsgi, or asgi with the
+uvicorn worker) on a scratch SQLite database seeded by datagen.py, with
+models trained into a temporary SAFELEDGER_MODEL_DIR before the run. The
+clients are threads of this process using session authentication like the
+frontend; each logs in as one of the generated accountants. --retrain-worker
+also runs manage.py retrain_worker, so queued retrains compete with the
+requests for the CPU as in production.
+"""
+import argparse
+import http.cookies
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from common import BACKEND_DIR, setup_django, write_results
+
+SERVERS = {
+    'wsgi': ['core.wsgi', '-c', 'gunicorn.conf.py'],
+    'asgi': ['-c', 'gunicorn_asgi.conf.py'],
+}
+DEFAULT_MIX = {'list': 70, 'create': 20, 'login': 8, 'retrain': 2}
+
+
+class Client:
+    """
+    One browser-like session: its cookies and the CSRF token Django rotates
+    on login. Cookies are kept by hand, the settings mark them Secure and a
+    cookie jar would not send them to a plain-HTTP test server.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.cookies = {}
+
+    def csrf_token(self):
+        return self.cookies.get('csrftoken', '')
+
+    def _keep_cookies(self, headers):
+        for header in headers.get_all('Set-Cookie') or ():
+            for name, morsel in http.cookies.SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+
+    def request(self, method, path, data=None):
+        body = json.dumps(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method, headers={
+            'Content-Type': 'application/json', 'Accept': 'application/json', 'X-CSRFToken': self.csrf_token(),
+            'Cookie': '; '.join(f'{name}={value}' for name, value in self.cookies.items()),
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                self._keep_cookies(response.headers)
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def login(self, username, password):
+        if not self.csrf_token():
+            self.request('GET', '/api/csrf/')
+        return self.request('POST', '/api/login/', {'email': username, 'password': password})
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/api/whoami/', timeout=2)
+            return
+        except urllib.error.HTTPError:
+            # 401: the server answers
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server at {base_url} did not start within {timeout}s')
+
+
+def run_client(base_url, username, admin, password, mix, company_ids, deadline, seed, latencies, lock):
+    rng = random.Random(seed)
+    client, admin_client = Client(base_url), None
+    client.login(username, password)
+    operations, weights = zip(*mix.items())
+    local = {name: [] for name in operations}
+    errors = {name: 0 for name in operations}
+    while time.monotonic() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        company_id = rng.choice(company_ids)
+        started = time.perf_counter()
+        if operation == 'list':
+            status = client.request('GET', f'/api/postings/?company={company_id}&page_size=100')
+        elif operation == 'create':
+            status = client.request('POST', '/api/postings/', {
+                'company': company_id, 'accountHandleNumber': rng.choice([1001, 2001, 3001]),
+                'postDate': f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                'postAmount': f'{rng.lognormvariate(7, 1.5):.2f}', 'postCurrency': 'DKK',
+                'postDescription': 'Load test posting',
+            })
+        elif operation == 'login':
+            status = client.login(username, password)
+        else:
+            if admin_client is None:
+                admin_client = Client(base_url)
+                admin_client.login(admin, password)
+                started = time.perf_counter()
+            status = admin_client.request('POST', '/api/retrain-ml/', {'company_id': company_id,
+                                                                        'mode': 'incremental'})
+        elapsed = time.perf_counter() - started
+        local[operation].append(elapsed)
+        if status >= 400:
+            errors[operation] += 1
+    with lock:
+        for name in operations:
+            latencies[name][0].extend(local[name])
+            latencies[name][1] += errors[name]
+
+
+def summarize(latencies, seconds):
+    results = {}
+    for name, (samples, errors) in latencies.items():
+        if not samples:
+            continue
+        ms = np.array(samples) * 1000
+        results[name] = {
+            'requests': len(samples), 'errors': errors,
+            'requests_per_s': round(len(samples) / seconds, 1),
+            'p50_ms': round(float(np.percentile(ms, 50)), 2),
+            'p95_ms': round(float(np.percentile(ms, 95)), 2),
+            'p99_ms': round(float(np.percentile(ms, 99)), 2),
+            'max_ms': round(float(ms.max()), 2),
+        }
+    total = sum(len(samples) for samples, _ in latencies.values())
+    return {'requests': total, 'requests_per_s': round(total / seconds, 1), 'endpoints': results}
+
+
+def parse_mix(items):
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition('=')
+        if name not in DEFAULT_MIX or not weight.isdigit():
+            raise SystemExit(f'--mix takes NAME=WEIGHT with NAME one of {", ".join(DEFAULT_MIX)}')
+        mix[name] = int(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--companies', type=int, default=20)
+    parser.add_argument('--server', choices=list(SERVERS), default='wsgi')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent client threads')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds of load')
+    parser.add_argument('--mix', nargs='+', help=f'Operation weights, default {DEFAULT_MIX}')
+    parser.add_argument('--retrain-worker', action='store_true', help='Run retrain_worker during the load')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Where to write the JSON results')
+    args = parser.parse_args()
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+
+    tmp = tempfile.TemporaryDirectory(prefix='safeledger-bench-')
+    env = {
+        **os.environ,
+        'SAFELEDGER_DB_NAME': os.path.join(tmp.name, 'bench.sqlite3'),
+        'SAFELEDGER_MODEL_DIR': os.path.join(tmp.name, 'models'),
+        'SAFELEDGER_CACHE_DIR': os.path.join(tmp.name, 'cache'),
+    }
+    os.environ.update(env)
+    setup_django(env['SAFELEDGER_DB_NAME'])
+    from django.core.management import call_command
+    from SafeLedger.jobs import enqueue_retrain
+    from SafeLedger.summaries import rebuild_summaries
+    import datagen
+
+    started = time.perf_counter()
+    call_command('migrate', verbosity=0)
+    company_ids = datagen.create_companies(args.companies)
+    roles = datagen.create_users(company_ids, accountants=max(1, min(args.clients, args.companies)))
+    datagen.insert_postings(company_ids, args.rows, seed=args.seed)
+    rebuild_summaries()
+    enqueue_retrain()
+    call_command('retrain_worker', once=True, stdout=io.StringIO())
+    setup_s = time.perf_counter() - started
+    # the accountants only see their own companies
+    from SafeLedger.models import User
+    scopes = {user.username: list(user.companies.values_list('id', flat=True))
+              for user in User.objects.filter(role='accountant').prefetch_related('companies')}
+
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', *SERVERS[args.server], '--bind', f'127.0.0.1:{port}',
+         '--workers', str(args.workers), '--log-level', 'warning'],
+        cwd=BACKEND_DIR, env=env,
+    )
+    worker = None
+    if args.retrain_worker:
+        worker = subprocess.Popen([sys.executable, 'manage.py', 'retrain_worker', '--poll-interval', '0.5'],
+                                  cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    try:
+        wait_until_up(base_url)
+        accountants = roles['accountant']
+        latencies = {name: [[], 0] for name in mix}
+        lock = threading.Lock()
+        deadline = time.monotonic() + args.duration
+        load_started = time.perf_counter()
+        threads = [
+            threading.Thread(target=run_client, args=(
+                base_url, accountants[i % len(accountants)], roles['superuser'][0], datagen.BENCH_PASSWORD,
+                mix, scopes[accountants[i % len(accountants)]], deadline, args.seed + i, latencies, lock,
+            ))
+            for i in range(args.clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        load_s = time.perf_counter() - load_started
+    finally:
+        for process in (server, worker):
+            if process is not None:
+                process.terminate()
+                process.wait()
+        tmp.cleanup()
+
+    results = {
+        'rows': args.rows, 'companies': args.companies, 'server': args.server, 'workers': args.workers,
+        'clients': args.clients, 'mix': mix, 'retrain_worker': args.retrain_worker,
+        'setup_s': round(setup_s, 1), 'duration_s': round(load_s, 1),
+        **summarize(latencies, load_s),
+    }
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {write_results(f'load-{args.server}', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# backend/benchmarks/micro.py
+"""
+Micro-benchmarks of the hot paths outside HTTP: scoring one posting and a
+batch (for one company and through score_postings), creating postings
+through PostingsSerializer, serializing a list page, and retraining a
+company model (full, sampled and incremental).
+
+    python benchmarks/micro.py --rows 500000
+    python benchmarks/micro.py --only scoring retrain
+
+The data is generated into a scratch SQLite file and the models are saved to
+a temporary registry, so neither db.sqlite3 nor ml/models are touched. The
+generator is seeded, so two commits are benchmarked on the same data;
+compare the JSON results with benchmarks/compare.py.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from common import setup_django, timed, write_results
+
+SUITES = ('scoring', 'serializers', 'retrain')
+
+
+def per_call(fn, calls, repeat):
+    # timed() of a loop, reported per call
+    result = timed(lambda: [fn() for _ in range(calls)], repeat=repeat)
+    return {'calls': calls, 'median_us': round(result['median_s'] / calls * 1e6, 1),
+            'min_us': round(result['min_s'] / calls * 1e6, 1)}
+
+
+def throughput(fn, rows, repeat):
+    result = timed(fn, repeat=repeat)
+    return {'rows': rows, **result, 'rows_per_s': round(rows / result['median_s'])}
+
+
+def bench_scoring(company_id, frame, repeat):
+    from SafeLedger.ml.ml_model import evaluate_posting, evaluate_postings, score_postings
+
+    posting = {'company_id': company_id, **frame.iloc[0].drop('id').to_dict()}
+    batch = frame.drop(columns='id')
+    # the same rows as columns of plain lists, like an API batch
+    columns = {'company_id': [company_id] * len(batch), **batch.to_dict('list')}
+    return {
+        # a cached model, as in a warmed-up gunicorn worker
+        'evaluate_posting': per_call(lambda: evaluate_posting(posting), 200, repeat),
+        'evaluate_postings_batch': throughput(lambda: evaluate_postings(company_id, batch), len(batch), repeat),
+        'score_postings_batch': throughput(lambda: score_postings(columns), len(batch), repeat),
+    }
+
+
+def bench_serializers(company_id, admin, repeat):
+    from django.db import transaction
+    from SafeLedger.models import Postings
+    from SafeLedger.serializers import PostingsSerializer
+
+    context = {'request': SimpleNamespace(user=admin)}
+    data = {'company': company_id, 'accountHandleNumber': 1001, 'postDate': '2024-05-02',
+            'postAmount': '1250.00', 'postCurrency': 'DKK', 'postDescription': 'Benchmark posting'}
+
+    def create():
+        serializer = PostingsSerializer(data=data, context=context)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    def create_rolled_back():
+        # the table keeps its size between repeats
+        with transaction.atomic():
+            for _ in range(100):
+                create()
+            transaction.set_rollback(True)
+
+    page = list(Postings.objects.filter(company_id=company_id).order_by('postDate', 'id')[:500])
+    create_t = timed(create_rolled_back, repeat=repeat)
+    return {
+        # validation, scoring, INSERT and the daily summary update of one posting
+        'create': {'calls': 100, 'median_ms': round(create_t['median_s'] * 10, 3),
+                   'min_ms': round(create_t['min_s'] * 10, 3)},
+        'list_page': throughput(lambda: PostingsSerializer(page, many=True).data, len(page), repeat),
+    }
+
+
+def bench_retrain(company_ids, sizes, sample_size, repeat):
+    import pandas as pd
+    from SafeLedger.ml.dataset import company_frame, sample_company_frame
+    from SafeLedger.ml.training import ModelUpdate, fit_company_model, update_company_model
+
+    # the largest, the median and the smallest company
+    ranked = sorted(company_ids, key=sizes.get, reverse=True)
+    picked = dict.fromkeys([ranked[0], ranked[len(ranked) // 2], ranked[-1]])
+    results = {'full': [], 'sampled': None, 'incremental': None}
+    for company_id in picked:
+        frame = company_frame(company_id)
+        started = time.perf_counter()
+        fit_company_model(frame, n_jobs=1)
+        results['full'].append({'company_id': company_id, 'rows': len(frame),
+                                'seconds': round(time.perf_counter() - started, 3)})
+
+    largest = ranked[0]
+    started = time.perf_counter()
+    sample = sample_company_frame(largest, sample_size, seed=0)
+    drawn = time.perf_counter()
+    fit_company_model(sample.frame, n_jobs=1)
+    results['sampled'] = {'company_id': largest, 'rows': len(sample.frame), 'population': sample.population,
+                          'sample_s': round(drawn - started, 3),
+                          'fit_s': round(time.perf_counter() - drawn, 3)}
+
+    # 1% new postings on top of a model of the other 99%
+    frame = company_frame(largest)
+    split = int(len(frame) * 0.99)
+    old, new = frame.iloc[:split], frame.iloc[split:]
+
+    def update():
+        scaler, iso, features = fit_company_model(old, n_jobs=1)
+        reference = old.iloc[-2000:]
+        started = time.perf_counter()
+        update_company_model(ModelUpdate(scaler, iso, features, new, reference, 0.1), n_jobs=1)
+        return time.perf_counter() - started
+
+    update_times = [update() for _ in range(repeat)]
+    results['incremental'] = {'company_id': largest, 'rows': len(new),
+                              'median_s': round(pd.Series(update_times).median(), 4)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--companies', type=int, default=20)
+    parser.add_argument('--sample-size', type=int, default=50_000, help='Rows of the sampled retrain')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', choices=SUITES, default=list(SUITES))
+    parser.add_argument('--output', help='Where to write the JSON results')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory(prefix='safeledger-bench-')
+    setup_django(os.path.join(tmp.name, 'bench.sqlite3'))
+    from django.core.management import call_command
+    from SafeLedger.ml import ml_model
+    from SafeLedger.ml.dataset import company_frame, company_row_counts
+    from SafeLedger.ml.training import fit_company_model
+    from SafeLedger.models import User
+    import datagen
+
+    call_command('migrate', verbosity=0)
+    company_ids = datagen.create_companies(args.companies)
+    datagen.create_users(company_ids)
+    datagen.insert_postings(company_ids, args.rows)
+    sizes = company_row_counts(company_ids)
+    largest = max(company_ids, key=sizes.get)
+
+    ml_model.registry = ml_model.ModelRegistry(os.path.join(tmp.name, 'models'))
+    frame = company_frame(largest)
+    ml_model.save_model(largest, *fit_company_model(frame, n_jobs=1))
+
+    results = {'rows': args.rows, 'companies': args.companies}
+    if 'scoring' in args.only:
+        results['scoring'] = bench_scoring(largest, frame.iloc[:10_000], args.repeat)
+    if 'serializers' in args.only:
+        results['serializers'] = bench_serializers(largest, User.objects.get(username='bench-admin'), args.repeat)
+    if 'retrain' in args.only:
+        results['retrain'] = bench_retrain(company_ids, sizes, args.sample_size, args.repeat)
+    tmp.cleanup()
+
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {write_results('micro', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# backend/benchmarks/serializers.py
+"""
+Compares the postings list rendered through PostingsSerializer and DRF's
+JSONRenderer with the values()-based fast path, and checks that both
+produce the same bytes.
+
+    python benchmarks/serializers.py --rows 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+
+from common import setup_django, timed, write_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--fields', help='Comma-separated projection, like ?fields=')
+    parser.add_argument('--output', help='Where to write the JSON results')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory(prefix='safeledger-bench-')
+    setup_django(os.path.join(tmp.name, 'bench.sqlite3'))
+    from django.core.management import call_command
+    from rest_framework.renderers import JSONRenderer
+    from SafeLedger.fast_serializers import posting_rows, posting_values, render_json
+    from SafeLedger.models import Postings
+    from SafeLedger.serializers import PostingsSerializer
+    import datagen
+
+    call_command('migrate', verbosity=0)
+    datagen.insert_postings(datagen.create_companies(20), args.rows)
+    fields = args.fields.split(',') if args.fields else None
+    qs = Postings.objects.order_by('id')
+
+    def drf():
+        return JSONRenderer().render(PostingsSerializer(qs, many=True, fields=fields).data)
+
+    def fast():
+        return render_json(posting_rows(posting_values(qs, fields), fields))
+
+    # the same two paths on rows that were already fetched, which leaves
+    # out the database driver and Django's row converters
+    instances = list(qs)
+    tuples = list(posting_values(qs, fields))
+
+    def drf_render():
+        return JSONRenderer().render(PostingsSerializer(instances, many=True, fields=fields).data)
+
+    def fast_render():
+        return render_json(posting_rows(tuples, fields))
+
+    identical = drf() == fast() and drf_render() == fast_render()
+    results = {'rows': args.rows, 'fields': fields, 'identical_bytes': identical}
+    for name, serializer_fn, fast_fn in [('end_to_end', drf, fast), ('render_only', drf_render, fast_render)]:
+        serializer_t, fast_t = timed(serializer_fn, args.repeat), timed(fast_fn, args.repeat)
+        results[name] = {'serializer': serializer_t, 'fast_path': fast_t,
+                         'speedup': round(serializer_t['median_s'] / fast_t['median_s'], 1)}
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {write_results('serializers', results, args.output)}")
+    tmp.cleanup()
+    if not identical:
+        raise SystemExit("The fast path output differs from PostingsSerializer.")
+
+
+if __name__ == '__main__':
+    main()
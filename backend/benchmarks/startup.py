@@ -0,0 +1,71 @@
+# backend/benchmarks/startup.py
+"""
+Measures how long a fresh process needs to set up Django and import the URL
+conf (and with it every SafeLedger view), which is what each manage.py
+command, test run and gunicorn worker pays before doing any work. Exits
+with an error when that import loads pandas, sklearn or joblib.
+
+    python benchmarks/startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPET = """
+import os, sys, time
+started = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+import django
+django.setup()
+import {module}
+setup_done = time.perf_counter()
+loaded = [name for name in {heavy!r} if name in sys.modules]
+{warm_up}
+print(setup_done - started, time.perf_counter() - setup_done, *loaded)
+"""
+
+# what django.setup() and the URL conf must not import, see ml_model.warm_up
+HEAVY_MODULES = ("pandas", "sklearn", "joblib")
+
+
+def measure(module, runs, warm):
+    warm_up = "from SafeLedger.ml.ml_model import warm_up; warm_up()" if warm else ""
+    code = SNIPPET.format(module=module, warm_up=warm_up, heavy=HEAVY_MODULES)
+    imports, warm_ups, loaded = [], [], set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR,
+                             check=True, capture_output=True, text=True).stdout
+        import_s, warm_s, *heavy = out.split()
+        imports.append(float(import_s))
+        warm_ups.append(float(warm_s))
+        loaded.update(heavy)
+    return {
+        "module": module,
+        "runs": runs,
+        "import_median_s": round(statistics.median(imports), 4),
+        "import_min_s": round(min(imports), 4),
+        "warm_up_median_s": round(statistics.median(warm_ups), 4) if warm else None,
+        "heavy_modules_loaded": sorted(loaded),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--module", default="core.urls")
+    parser.add_argument("--warm-up", action="store_true",
+                        help="Also time ml_model.warm_up() after the import.")
+    args = parser.parse_args()
+    result = measure(args.module, args.runs, args.warm_up)
+    print(json.dumps(result, indent=2))
+    if result["heavy_modules_loaded"]:
+        sys.exit(f"Importing {args.module} loads {', '.join(result['heavy_modules_loaded'])}")
+
+
+if __name__ == "__main__":
+    main()
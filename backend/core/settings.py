@@ -11,6 +11,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -53,6 +54,10 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    # first, so its latency covers every other middleware too
+    'SafeLedger.middleware.MetricsMiddleware',
+    # opt-in, see PROFILE_SAMPLE_RATE below
+    'SafeLedger.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -114,13 +119,99 @@ WSGI_APPLICATION = 'core.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# SQLite by default. SAFELEDGER_DB_ENGINE=postgresql switches to PostgreSQL,
+# configured through the SAFELEDGER_DB_* variables below; benchmarks/concurrency.py
+# compares the write throughput of the modes.
+
+DB_ENGINE = os.environ.get('SAFELEDGER_DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('SAFELEDGER_DB_NAME', 'safeledger'),
+            'USER': os.environ.get('SAFELEDGER_DB_USER', 'safeledger'),
+            'PASSWORD': os.environ.get('SAFELEDGER_DB_PASSWORD', ''),
+            'HOST': os.environ.get('SAFELEDGER_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('SAFELEDGER_DB_PORT', '5432'),
+            # keep connections open between requests, and check them before
+            # reuse so a restarted server does not fail the next request
+            'CONN_MAX_AGE': int(os.environ.get('SAFELEDGER_DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
     }
-}
+    # SAFELEDGER_DB_POOL=<size> uses a psycopg connection pool per process
+    # instead; Django requires CONN_MAX_AGE=0 with a pool
+    DB_POOL_SIZE = int(os.environ.get('SAFELEDGER_DB_POOL', '0'))
+    if DB_POOL_SIZE:
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': 1,
+            'max_size': DB_POOL_SIZE,
+            'timeout': 10,
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SAFELEDGER_DB_NAME', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+    # WAL lets readers run while one process writes, NORMAL only syncs at
+    # checkpoints (safe with WAL), and IMMEDIATE transactions take the write
+    # lock up front so they wait for the busy timeout instead of failing with
+    # "database is locked". SAFELEDGER_SQLITE_TUNED=0 restores the defaults.
+    if os.environ.get('SAFELEDGER_SQLITE_TUNED', '1') != '0':
+        DATABASES['default']['OPTIONS'] = {
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        }
+
+
+# Cache
+# Holds the per-user allowed company ids (SafeLedger.scoping). File-based by
+# default so every gunicorn worker shares entries and invalidations;
+# SAFELEDGER_CACHE=locmem keeps it in process for single-process setups.
+
+if os.environ.get('SAFELEDGER_CACHE') == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('SAFELEDGER_CACHE_DIR', BASE_DIR / 'cache'),
+        }
+    }
+
+
+# Metrics
+# /metrics serves SafeLedger.metrics in the Prometheus text format. Set
+# SAFELEDGER_METRICS_DIR to a directory shared by the gunicorn workers and
+# the retrain_worker to report all processes together. The endpoint answers
+# 404 unless SAFELEDGER_METRICS_TOKEN is set, which requires
+# "Authorization: Bearer <token>", or SAFELEDGER_METRICS_PUBLIC=1 serves it
+# to anyone; the labels carry company ids.
+
+METRICS_TOKEN = os.environ.get('SAFELEDGER_METRICS_TOKEN', '')
+METRICS_PUBLIC = os.environ.get('SAFELEDGER_METRICS_PUBLIC') == '1'
+
+
+# Request profiling
+# SAFELEDGER_PROFILE_RATE=0.01 records wall time and SQL query count/time of
+# 1% of the requests in SAFELEDGER_PROFILE_DIR, SAFELEDGER_PROFILE_CPROFILE=1
+# adds a cProfile dump of each. `manage.py profile_summary` lists the slowest
+# views. Off by default.
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('SAFELEDGER_PROFILE_RATE', '0'))
+PROFILE_DIR = os.environ.get('SAFELEDGER_PROFILE_DIR', BASE_DIR / 'profiling')
+PROFILE_CPROFILE = os.environ.get('SAFELEDGER_PROFILE_CPROFILE') == '1'
 
 
 # Password validation
@@ -16,11 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include, re_path
-from SafeLedger.views import FrontendAppView
+from SafeLedger.views import FrontendAppView, metrics_view
 
 
 urlpatterns = [
     path('api/', include('SafeLedger.urls')),  # Include the URLs from the SafeLedger app
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     re_path(r'^.*$', FrontendAppView.as_view()),  # Catch-all URL for the frontend app
 ]
\ No newline at end of file
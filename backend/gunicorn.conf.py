@@ -0,0 +1,26 @@
+# backend/gunicorn.conf.py
+# Loaded with `gunicorn core.wsgi --chdir backend -c backend/gunicorn.conf.py` (see
+# Procfile); gunicorn reads the config before --chdir, so it must be passed.
+import os
+
+
+def on_starting(server):
+    # counters of the previous run's workers must not be added up again
+    from SafeLedger import metrics
+    metrics.clear_dir()
+
+
+def child_exit(server, worker):
+    from SafeLedger import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # Load sklearn and the per-company models in each worker before it takes
+    # requests, instead of on the first posting it has to score. Set
+    # SAFELEDGER_WARM_MODELS=0 to skip this and load models on demand only.
+    if os.environ.get("SAFELEDGER_WARM_MODELS", "1") == "0":
+        return
+    from SafeLedger.ml.ml_model import warm_up
+    loaded = warm_up()
+    server.log.info("Worker %s warmed up %s anomaly model(s)", worker.pid, loaded)
@@ -0,0 +1,15 @@
+# backend/gunicorn_asgi.conf.py
+# ASGI profile: `gunicorn --chdir backend -c backend/gunicorn_asgi.conf.py` (see Procfile).
+# Uvicorn workers run the async views (postings list and export, session,
+# whoami, user details) on an event loop, so a slow export or client waits on
+# the database without tying up the worker; the sync DRF views run in a
+# thread next to it.
+import os
+import runpy
+
+wsgi_app = "core.asgi:application"
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# same model warm-up and metrics files cleanup as the WSGI workers
+_wsgi = runpy.run_path(os.path.join(os.path.dirname(__file__), "gunicorn.conf.py"))
+post_fork, on_starting, child_exit = _wsgi["post_fork"], _wsgi["on_starting"], _wsgi["child_exit"]